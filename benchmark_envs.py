@@ -0,0 +1,81 @@
+import time
+from dataclasses import dataclass, field
+from typing import List, Literal
+
+import numpy as np
+import tyro
+
+from rle_assignment.vector_env import make_env, make_vector_env
+
+
+@dataclass
+class Args:
+    mode: Literal["throughput", "latency"] = "throughput"
+    """`throughput` compares the vector env backends, `latency` the per-step latency of the preprocessing chains"""
+    env_id: str = "ALE/SpaceInvaders-v5"
+    """the id of the environment"""
+    backends: List[str] = field(default_factory=lambda: ["sync", "async"])
+    """the vector env backends to compare"""
+    num_envs: List[int] = field(default_factory=lambda: [8, 16, 32])
+    """the numbers of parallel environments to compare"""
+    preprocessing: List[str] = field(default_factory=lambda: ["fused", "legacy"])
+    """the preprocessing chains to compare"""
+    skip_frames: int = 4
+    """the number of frames each action is repeated"""
+    num_steps: int = 1000
+    """the number of vector env steps to time per configuration"""
+    warmup_steps: int = 50
+    """the number of vector env steps before the timing starts"""
+    seed: int = 1
+    """seed of the benchmark"""
+
+
+def env_throughput(args: Args):
+    """
+    Measures the env steps per second of every vector env backend with random actions.
+    """
+    print("|backend|num_envs|SPS|")
+    print("|-|-|-|")
+    for num_envs in args.num_envs:
+        for backend in args.backends:
+            envs = make_vector_env(args.env_id, num_envs, False, "benchmark", args.skip_frames, backend=backend)
+            envs.action_space.seed(args.seed)
+            envs.reset(seed=args.seed)
+            for _ in range(args.warmup_steps):
+                envs.step(envs.action_space.sample())
+            start_time = time.perf_counter()
+            for _ in range(args.num_steps):
+                envs.step(envs.action_space.sample())
+            sps = args.num_steps * num_envs / (time.perf_counter() - start_time)
+            envs.close()
+            print(f"|{backend}|{num_envs}|{int(sps)}|")
+
+
+def preprocessing_latency(args: Args):
+    """
+    Measures the latency of single env steps (including resets) of every preprocessing chain with random actions.
+    """
+    print("|preprocessing|mean [us]|p50 [us]|p99 [us]|")
+    print("|-|-|-|-|")
+    for preprocessing in args.preprocessing:
+        env = make_env(args.env_id, 1, False, "benchmark", args.skip_frames, preprocessing)()
+        env.action_space.seed(args.seed)
+        env.reset(seed=args.seed)
+        latencies = np.zeros(args.warmup_steps + args.num_steps)
+        for i in range(len(latencies)):
+            start_time = time.perf_counter()
+            _, _, terminated, truncated, _ = env.step(env.action_space.sample())
+            if terminated or truncated:
+                env.reset()
+            latencies[i] = time.perf_counter() - start_time
+        env.close()
+        latencies = latencies[args.warmup_steps:] * 1e6
+        print(f"|{preprocessing}|{latencies.mean():.1f}|{np.percentile(latencies, 50):.1f}|{np.percentile(latencies, 99):.1f}|")
+
+
+if __name__ == "__main__":
+    args = tyro.cli(Args)
+    if args.mode == "throughput":
+        env_throughput(args)
+    else:
+        preprocessing_latency(args)
@@ -0,0 +1,67 @@
+import time
+from dataclasses import dataclass, field
+from typing import List
+
+import torch
+import tyro
+
+from rle_assignment.gae import GaeBackend, compute_gae
+
+
+@dataclass
+class Args:
+    num_steps: List[int] = field(default_factory=lambda: [128, 1024, 4096])
+    """the rollout lengths to compare"""
+    num_envs: List[int] = field(default_factory=lambda: [8, 64])
+    """the numbers of parallel environments to compare"""
+    backends: List[GaeBackend] = field(default_factory=lambda: ["loop", "torchscript", "numba", "cumsum"])
+    """the GAE backends to compare"""
+    gamma: float = 0.99
+    """the discount factor gamma"""
+    gae_lambda: float = 0.95
+    """the lambda for the general advantage estimation"""
+    done_probability: float = 0.01
+    """the probability of an episode end in every step"""
+    repeats: int = 20
+    """the number of timed runs per configuration"""
+    device: str = "cpu"
+    """the device of the rollout tensors"""
+    seed: int = 1
+    """seed of the benchmark"""
+
+
+def random_rollout(num_steps: int, num_envs: int, done_probability: float, device: torch.device):
+    rewards = torch.randn(num_steps, num_envs, device=device)
+    values = torch.randn(num_steps, num_envs, device=device)
+    dones = (torch.rand(num_steps, num_envs, device=device) < done_probability).float()
+    next_value = torch.randn(num_envs, device=device)
+    next_done = (torch.rand(num_envs, device=device) < done_probability).float()
+    return rewards, values, dones, next_value, next_done
+
+
+if __name__ == "__main__":
+    args = tyro.cli(Args)
+    torch.manual_seed(args.seed)
+    device = torch.device(args.device)
+
+    print("|num_steps|num_envs|backend|time [ms]|max abs error|")
+    print("|-|-|-|-|-|")
+    for num_steps in args.num_steps:
+        for num_envs in args.num_envs:
+            rollout = random_rollout(num_steps, num_envs, args.done_probability, device)
+            # the reference of the equivalence check is the loop in float64
+            reference, _ = compute_gae(*(x.double() for x in rollout), args.gamma, args.gae_lambda, backend="loop")
+            for backend in args.backends:
+                advantages, returns = compute_gae(*rollout, args.gamma, args.gae_lambda, backend=backend)  # warmup
+                error = (advantages.double() - reference).abs().max().item()
+                assert torch.allclose(advantages.double(), reference, rtol=1e-4, atol=1e-4), f"{backend} differs by {error}"
+                assert torch.allclose(returns, advantages + rollout[1])
+                if device.type == "cuda":
+                    torch.cuda.synchronize()
+                start_time = time.perf_counter()
+                for _ in range(args.repeats):
+                    compute_gae(*rollout, args.gamma, args.gae_lambda, backend=backend)
+                if device.type == "cuda":
+                    torch.cuda.synchronize()
+                elapsed = (time.perf_counter() - start_time) / args.repeats
+                print(f"|{num_steps}|{num_envs}|{backend}|{elapsed * 1e3:.3f}|{error:.2e}|")
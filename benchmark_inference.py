@@ -0,0 +1,151 @@
+import time
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from typing import List, Literal
+
+import gymnasium as gym
+import numpy as np
+import torch
+import tyro
+from torch.distributions.categorical import Categorical
+
+from rle_assignment.policy import sample_categorical
+from rle_assignment.quantization import QuantizedPolicy
+
+
+@dataclass
+class Args:
+    model: Literal["cnn", "resnet"] = "cnn"
+    """the agent to benchmark, the one of `ppo_clean_rl.py` or of `ppo_resnet.py`"""
+    batch_sizes: List[int] = field(default_factory=lambda: [16, 32, 64, 128, 256])
+    """the batch sizes (number of envs) to compare"""
+    num_actions: int = 6
+    """the size of the action space"""
+    num_steps: int = 200
+    """the number of timed rollout steps per configuration"""
+    warmup_steps: int = 20
+    """the number of rollout steps before the timing starts"""
+    num_samples: int = 200000
+    """the number of samples of the distribution check"""
+    quantized: bool = False
+    """also compare `act` of the fp32 agent with `act` of its int8 `QuantizedPolicy`"""
+    threads: int = 0
+    """the number of torch threads, 0 keeps the default"""
+    seed: int = 1
+    """seed of the benchmark"""
+
+
+def check_distribution(num_actions: int, num_samples: int):
+    """Compares the action frequencies of `sample_categorical` and `Categorical.sample` for random logits."""
+    logits = torch.randn(1, num_actions).expand(num_samples, -1)
+    expected = logits[0].softmax(dim=-1)
+    for name, actions in [
+        ("Categorical", Categorical(logits=logits).sample()),
+        ("Gumbel-max", sample_categorical(logits)[0]),
+    ]:
+        frequencies = torch.bincount(actions, minlength=num_actions) / num_samples
+        print(f"{name}: max abs deviation of the action frequencies {(frequencies - expected).abs().max().item():.4f}")
+    action, log_prob = sample_categorical(logits[:1000])
+    assert torch.allclose(log_prob, Categorical(logits=logits[:1000]).log_prob(action), atol=1e-6)
+
+
+def head_latency(batch_size: int, args: Args):
+    """The median latency of sampling actions and log-probs from the logits alone, the part `act` replaces."""
+    logits = torch.randn(batch_size, args.num_actions)
+
+    def categorical():
+        with torch.no_grad():
+            probs = Categorical(logits=logits)
+            action = probs.sample()
+            return action, probs.log_prob(action), probs.entropy()
+
+    def gumbel():
+        with torch.inference_mode():
+            return sample_categorical(logits)
+
+    latencies = []
+    for fn in [categorical, gumbel]:
+        timings = np.zeros(args.num_steps)
+        for step in range(args.warmup_steps + args.num_steps):
+            start_time = time.perf_counter()
+            fn()
+            if step >= args.warmup_steps:
+                timings[step - args.warmup_steps] = (time.perf_counter() - start_time) * 1e6
+        latencies.append(np.median(timings))
+    return latencies
+
+
+def rollout_latency(agent: torch.nn.Module, batch_size: int, args: Args):
+    obs = torch.randint(0, 256, (batch_size, 4, 84, 84), dtype=torch.uint8)
+    actions = torch.zeros((args.num_steps + args.warmup_steps, batch_size), dtype=torch.long)
+    logprobs = torch.zeros((args.num_steps + args.warmup_steps, batch_size))
+    values = torch.zeros((args.num_steps + args.warmup_steps, batch_size))
+
+    def get_action_and_value(step):
+        with torch.no_grad():
+            action, logprob, _, value = agent.get_action_and_value(obs)
+            values[step] = value.flatten()
+        actions[step] = action
+        logprobs[step] = logprob
+
+    def act(step):
+        agent.act(obs, actions[step], logprobs[step], values[step])
+
+    # both paths are timed alternately in every step, so load changes of the machine affect both equally
+    latencies = {"get_action_and_value": np.zeros(args.num_steps), "act": np.zeros(args.num_steps)}
+    for step in range(args.warmup_steps + args.num_steps):
+        for name, fn in [("get_action_and_value", get_action_and_value), ("act", act)]:
+            start_time = time.perf_counter()
+            fn(step)
+            if step >= args.warmup_steps:
+                latencies[name][step - args.warmup_steps] = (time.perf_counter() - start_time) * 1e6
+    return latencies
+
+
+def quantized_latency(agent: torch.nn.Module, batch_size: int, args: Args):
+    """The median latencies of `act` of the fp32 agent and of its int8 snapshot and the largest log-prob difference."""
+    obs = torch.randint(0, 256, (batch_size, 4, 84, 84), dtype=torch.uint8)
+    quantized = QuantizedPolicy(agent, torch.randint(0, 256, (64, 4, 84, 84), dtype=torch.uint8))
+    latencies = {"fp32": np.zeros(args.num_steps), "int8": np.zeros(args.num_steps)}
+    for step in range(args.warmup_steps + args.num_steps):
+        for name, policy in [("fp32", agent), ("int8", quantized)]:
+            start_time = time.perf_counter()
+            policy.act(obs)
+            if step >= args.warmup_steps:
+                latencies[name][step - args.warmup_steps] = (time.perf_counter() - start_time) * 1e6
+    with torch.no_grad():
+        logits = agent.actor(agent.features(obs)).log_softmax(dim=-1)
+        quantized_logits = quantized.actor(quantized.network(obs.float())).log_softmax(dim=-1)
+    return np.median(latencies["fp32"]), np.median(latencies["int8"]), (logits - quantized_logits).abs().max().item()
+
+
+if __name__ == "__main__":
+    args = tyro.cli(Args)
+    torch.manual_seed(args.seed)
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    check_distribution(args.num_actions, args.num_samples)
+
+    if args.model == "cnn":
+        from ppo_clean_rl import Agent
+    else:
+        from ppo_resnet import Agent
+    envs = SimpleNamespace(single_action_space=gym.spaces.Discrete(args.num_actions))
+    agent = Agent(envs).eval()
+
+    print("|batch size|get_action_and_value p50 [us]|act p50 [us]|saved p50 [us]|head only: Categorical [us]|head only: Gumbel-max [us]|")
+    print("|-|-|-|-|-|-|")
+    for batch_size in args.batch_sizes:
+        latencies = rollout_latency(agent, batch_size, args)
+        slow, fast = np.median(latencies["get_action_and_value"]), np.median(latencies["act"])
+        categorical, gumbel = head_latency(batch_size, args)
+        print(f"|{batch_size}|{slow:.0f}|{fast:.0f}|{slow - fast:.0f}|{categorical:.0f}|{gumbel:.0f}|")
+
+    if args.quantized:
+        print()
+        print("|batch size|fp32 act p50 [us]|int8 act p50 [us]|speedup|max abs log-prob difference|")
+        print("|-|-|-|-|-|")
+        for batch_size in args.batch_sizes:
+            fp32, int8, difference = quantized_latency(agent, batch_size, args)
+            print(f"|{batch_size}|{fp32:.0f}|{int8:.0f}|{fp32 / int8:.2f}x|{difference:.4f}|")
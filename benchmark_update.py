@@ -0,0 +1,87 @@
+import time
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from typing import List, Literal
+
+import gymnasium as gym
+import torch
+import torch.optim as optim
+import tyro
+
+from rle_assignment.layers import Precision
+from rle_assignment.ppo import PPOUpdate
+
+
+@dataclass
+class Args:
+    model: Literal["cnn", "resnet"] = "cnn"
+    """the agent to benchmark, the one of `ppo_clean_rl.py` or of `ppo_resnet.py`"""
+    minibatch_size: int = 256
+    """the size of the minibatches"""
+    num_actions: int = 6
+    """the size of the action space"""
+    num_updates: int = 50
+    """the number of timed update steps per mode"""
+    fused_adam: bool = False
+    """use the fused implementation of Adam"""
+    precisions: List[Precision] = field(default_factory=lambda: ["fp32"])
+    """the precisions of the network forward and backward to compare"""
+    compile: bool = True
+    """also time the compiled update step"""
+    threads: int = 0
+    """the number of torch threads, 0 keeps the default"""
+    seed: int = 1
+    """seed of the benchmark"""
+
+
+def random_minibatch(minibatch_size: int, num_actions: int):
+    return (
+        torch.randint(0, 256, (minibatch_size, 4, 84, 84), dtype=torch.uint8),
+        torch.randint(0, num_actions, (minibatch_size,)),
+        torch.randn(minibatch_size) - 2.0,
+        torch.randn(minibatch_size),
+        torch.randn(minibatch_size),
+        torch.randn(minibatch_size),
+    )
+
+
+def time_updates(Agent, compile: bool, precision: Precision, args: Args):
+    """Returns the duration of the first update (including the compilation) and the mean of the following ones."""
+    torch.manual_seed(args.seed)
+    agent = Agent(SimpleNamespace(single_action_space=gym.spaces.Discrete(args.num_actions)), precision=precision)
+    optimizer = optim.Adam(agent.parameters(), lr=2.5e-4, eps=1e-5, fused=args.fused_adam)
+    update_step = PPOUpdate(agent, optimizer, 0.5, 0.1, 0.01, 0.5, compile=compile)
+    minibatch = random_minibatch(args.minibatch_size, args.num_actions)
+
+    start_time = time.perf_counter()
+    update_step(*minibatch)
+    first_time = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    for _ in range(args.num_updates):
+        update_step(*minibatch)
+    return first_time, (time.perf_counter() - start_time) / args.num_updates, update_step.compiled
+
+
+if __name__ == "__main__":
+    args = tyro.cli(Args)
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    if args.model == "cnn":
+        from ppo_clean_rl import Agent
+    else:
+        from ppo_resnet import Agent
+
+    print("|precision|mode|first update [s]|steady update [ms]|speedup|")
+    print("|-|-|-|-|-|")
+    baseline_time = None
+    for precision in args.precisions:
+        _, eager_time, _ = time_updates(Agent, False, precision, args)
+        baseline_time = baseline_time or eager_time
+        print(f"|{precision}|eager|-|{eager_time * 1e3:.1f}|{baseline_time / eager_time:.2f}x|")
+        if not args.compile:
+            continue
+        compile_time, compiled_time, compiled = time_updates(Agent, True, precision, args)
+        mode = "compiled" if compiled else "eager (compile failed)"
+        print(f"|{precision}|{mode}|{compile_time:.1f}|{compiled_time * 1e3:.1f}|{baseline_time / compiled_time:.2f}x|")
+        if compiled_time < eager_time:
+            print(f"the compilation pays off after {compile_time / (eager_time - compiled_time):.0f} updates ({precision})")
@@ -2,6 +2,7 @@ import os
 import random
 import time
 from dataclasses import dataclass
+from functools import partial
 
 import gymnasium as gym
 import ale_py
@@ -13,15 +14,26 @@ import torch.optim as optim
 import tyro
 from torch.distributions.categorical import Categorical
 from torch.utils.tensorboard import SummaryWriter
-from rle_assignment.ppo_eval import evaluate
-
-from stable_baselines3.common.atari_wrappers import (  # isort:skip
-    ClipRewardEnv,
-    EpisodicLifeEnv,
-    FireResetEnv,
-    MaxAndSkipEnv,
-    NoopResetEnv,
+from rle_assignment.asha import RungReporter
+from rle_assignment.checkpoint import (
+    CheckpointWriter,
+    find_checkpoint,
+    list_checkpoints,
+    load_checkpoint,
+    rng_state,
+    save_tensors,
+    set_rng_state,
 )
+from rle_assignment.gae import GaeBackend, compute_gae
+from rle_assignment.layers import ScaledConv2d
+from rle_assignment.minibatch import MinibatchLoader
+from rle_assignment.placement import plan_cpu_placement
+from rle_assignment.policy import sample_categorical
+from rle_assignment.ppo_eval import evaluate
+from rle_assignment.rollout import collect_rollout
+from rle_assignment.rollout_storage import FrameStackStorage
+from rle_assignment.vector_env import Backend, Preprocessing, make_env, make_vector_env
+from rle_assignment.video import VideoReplayer
 
 
 gym.register_envs(ale_py)  # unnecessary but helpful for IDEs
@@ -58,6 +70,10 @@ class Args:
     """the learning rate of the optimizer"""
     num_envs: int = 16
     """the number of parallel game environments"""
+    env_backend: Backend = "sync"
+    """the vector env backend: `sync` (single process), `async` (one worker process per env, shared memory), `pool` (like `async`, supports `env_batch_size`) or `native` (C++ vector env of ale_py)"""
+    env_batch_size: int = 0
+    """if > 0, each rollout step only waits for the first `env_batch_size` ready envs (requires `--env_backend pool`)"""
     num_steps: int = 128
     """the number of steps to run in each environment per policy rollout"""
     anneal_lr: bool = True
@@ -66,6 +82,8 @@ class Args:
     """the discount factor gamma"""
     gae_lambda: float = 0.95
     """the lambda for the general advantage estimation"""
+    gae_backend: GaeBackend = "cumsum"
+    """the implementation of the advantage computation: `cumsum` (chunked discounted cumulative sum), `loop` (Python loop), `torchscript` (deprecated `torch.jit.script`) or `numba`"""
     num_minibatches: int = 4
     """the number of mini-batches"""
     update_epochs: int = 4
@@ -84,6 +102,28 @@ class Args:
     """the maximum norm for the gradient clipping"""
     target_kl: float = None
     """the target KL divergence threshold"""
+    prefetch_minibatches: bool = True
+    """gather the observations of the next minibatch on a background thread while the current one is optimized"""
+    cpu_placement: bool = False
+    """pin the env worker processes (`async`/`pool` backends) to their own cores and the learner to the remaining cores during the rollout and all cores during the update (no effect with the `sync` and `native` backends)"""
+    env_cores: int = 0
+    """the number of cores for the env workers with `cpu_placement` (0: one core per worker, leaving at least one core to torch)"""
+    resume: str = None
+    """if set, continue the run of this checkpoint or run directory, with `auto` the newest run of this `env_id`, `exp_name` and `seed` that has a checkpoint (a new run if there is none)"""
+    checkpoint_interval: int = 0
+    """if > 0, save the training state to `runs/{run_name}/checkpoint_{global_step}.safetensors` every `checkpoint_interval` iterations (on a background thread), so a preempted run can continue with `resume`"""
+    keep_checkpoints: int = 2
+    """the number of the newest checkpoints kept on disk (0: all)"""
+    stop_timesteps: int = 0
+    """if > 0, stop after this many of the `total_timesteps` and save a checkpoint to continue from with `resume` (the learning rate schedule stays the one of `total_timesteps`)"""
+    report_file: str = None
+    """if set, append the global step and the rolling mean of the training episodic returns to this JSON lines file after every iteration (the rungs of `rle_assignment/asha.py`)"""
+    report_window: int = 20
+    """the number of training episodes of the rolling mean return of `report_file`"""
+    skip_frames: int = 4
+    """the number of emulator frames each action is repeated (total action repeat)"""
+    preprocessing: Preprocessing = "fused"
+    """the Atari preprocessing: `fused` (single in-place wrapper) or `legacy` (separate gymnasium/SB3 wrappers)"""
     
     # IEM specific arguments
     uncertainty_coef: float = 0.1
@@ -98,28 +138,6 @@ class Args:
     """the number of iterations (computed in runtime)"""
 
 
-def make_env(env_id, idx, capture_video, run_name):
-    def thunk():
-        if capture_video and idx == 0:
-            env = gym.make(env_id, render_mode="rgb_array")
-            env = gym.wrappers.RecordVideo(env, f"videos/{run_name}")
-        else:
-            env = gym.make(env_id)
-        env = gym.wrappers.RecordEpisodeStatistics(env)
-        env = NoopResetEnv(env, noop_max=30)
-        env = MaxAndSkipEnv(env, skip=4)
-        env = EpisodicLifeEnv(env)
-        if "FIRE" in env.unwrapped.get_action_meanings():
-            env = FireResetEnv(env)
-        env = ClipRewardEnv(env)
-        env = gym.wrappers.ResizeObservation(env, (84, 84))
-        env = gym.wrappers.GrayscaleObservation(env)
-        env = gym.wrappers.FrameStackObservation(env, 4)
-        return env
-
-    return thunk
-
-
 def layer_init(layer, std=np.sqrt(2), bias_const=0.0):
     torch.nn.init.orthogonal_(layer.weight, std)
     torch.nn.init.constant_(layer.bias, bias_const)
@@ -130,7 +148,7 @@ class Agent(nn.Module):
     def __init__(self, envs):
         super().__init__()
         self.network = nn.Sequential(
-            layer_init(nn.Conv2d(4, 32, 8, stride=4)),
+            layer_init(ScaledConv2d(4, 32, 8, stride=4, scale=1 / 255.0)),
             nn.ReLU(),
             layer_init(nn.Conv2d(32, 64, 4, stride=2)),
             nn.ReLU(),
@@ -154,16 +172,27 @@ class Agent(nn.Module):
         )
 
     def get_value(self, x):
-        return self.critic(self.network(x / 255.0))
+        return self.critic(self.network(x))
 
     def get_action_and_value(self, x, action=None):
-        hidden = self.network(x / 255.0)
+        hidden = self.network(x)
         logits = self.actor(hidden)
         probs = Categorical(logits=logits)
         if action is None:
             action = probs.sample()
         return action, probs.log_prob(action), probs.entropy(), self.critic(hidden), hidden
 
+    @torch.inference_mode()
+    def act(self, x, action=None, logprob=None, value=None):
+        """
+        Rollout fast path of `get_action_and_value`: samples the actions without building a distribution and
+        computing the entropy, and writes the actions, their log-probs and the values into the given tensors.
+        """
+        hidden = self.network(x)
+        action, logprob = sample_categorical(self.actor(hidden), action, logprob)
+        value = self.critic(hidden).flatten() if value is None else value.copy_(self.critic(hidden).flatten())
+        return action, logprob, value
+
     def get_uncertainty(self, current_features, next_features):
         """Estimate the uncertainty between current and next state"""
         combined_features = torch.cat([current_features, next_features], dim=1)
@@ -171,6 +200,43 @@ class Agent(nn.Module):
         return steps_pred
 
 
+class UncertaintyReward:
+    """
+    The `step_hook` of `collect_rollout`: adds the tanh of the number of steps the uncertainty network predicts
+    between the features of the previous and the new observation of every env, times `coef`, to its reward and adds
+    the features of the previous observation to the state buffer of the env.
+    """
+    def __init__(self, agent, state_buffers, uncertainties, coef):
+        self.agent = agent
+        self.state_buffers = state_buffers
+        self.uncertainties = uncertainties
+        self.coef = coef
+        self.features = None  # the features of the current observation of every env
+
+    @torch.no_grad()
+    def reset(self, obs):
+        self.features = self.agent.network(obs)
+
+    @torch.no_grad()
+    def __call__(self, steps, env_ids, next_obs, rewards):
+        current_features = self.features[env_ids]
+        next_features = self.agent.network(next_obs)
+        # Higher step prediction means more uncertainty/novelty
+        uncertainty = torch.tanh(self.agent.get_uncertainty(current_features, next_features)).flatten()
+        self.uncertainties[steps, env_ids] = uncertainty
+        # Combine extrinsic and intrinsic rewards
+        rewards[steps, env_ids] += self.coef * uncertainty
+
+        # Add current state features to buffer
+        for env_idx, state_features in zip(np.arange(len(self.state_buffers))[env_ids], current_features):
+            self.state_buffers[env_idx].add(state_features)
+        if isinstance(env_ids, slice):
+            # the state buffers keep views of the previous features, they are replaced and not overwritten
+            self.features = next_features
+        else:
+            self.features[env_ids] = next_features
+
+
 class StateBuffer:
     def __init__(self, num_steps, feature_dim):
         self.num_steps = num_steps
@@ -185,6 +251,18 @@ class StateBuffer:
         if len(self.buffer) > self.num_steps:
             self.buffer.pop(0)
             
+    def state_dict(self):
+        """The buffered features and timestamps, e.g. for a checkpoint"""
+        return {
+            "features": [features for features, _ in self.buffer],
+            "timestamps": [timestamp for _, timestamp in self.buffer],
+            "current_timestamp": self.current_timestamp,
+        }
+
+    def load_state_dict(self, state):
+        self.buffer = list(zip(state["features"], state["timestamps"]))
+        self.current_timestamp = state["current_timestamp"]
+
     def get_all_pairs(self):
         """Get all unique ordered pairs of states from buffer
         Returns:
@@ -222,7 +300,22 @@ if __name__ == "__main__":
     args.batch_size = int(args.num_envs * args.num_steps)
     args.minibatch_size = int(args.batch_size // args.num_minibatches)
     args.num_iterations = args.total_timesteps // args.batch_size
+    assert args.env_batch_size == 0 or args.env_backend == "pool", "`env_batch_size` requires `--env_backend pool`"
+    placement = None
+    if args.cpu_placement:
+        placement = plan_cpu_placement(
+            args.num_envs if args.env_backend in ("async", "pool") else 0,
+            args.env_cores,
+        )
+        placement.pin_learner()
     run_name = f"{args.env_id}__{args.exp_name}__{args.seed}__{time.strftime('%Y%m%d_%H%M%S')}"
+    resume_state = None
+    resume_path = find_checkpoint(args.resume, f"runs/{args.env_id}__{args.exp_name}__{args.seed}") if args.resume else None
+    if resume_path is not None:
+        # the resumed run keeps logging into its run directory
+        resume_state = load_checkpoint(resume_path)
+        run_name = resume_state["run_name"]
+        print(f"resuming {run_name} after {resume_state['global_step']} steps from {resume_path}")
     if args.track:
         import wandb
 
@@ -232,13 +325,22 @@ if __name__ == "__main__":
             sync_tensorboard=True,
             config=vars(args),
             name=run_name,
+            id=resume_state.get("wandb_id") if resume_state is not None else None,
+            resume="allow",
             monitor_gym=True,
             save_code=True,
         )
-    writer = SummaryWriter(f"runs/{run_name}")
+    # a resumed run drops the events the previous job logged after its checkpoint
+    purge_step = resume_state["global_step"] if resume_state is not None else None
+    writer = SummaryWriter(f"runs/{run_name}", purge_step=purge_step)
+    reporter = RungReporter(args.report_file, args.report_window) if args.report_file else None
+    checkpoint_writer = CheckpointWriter(f"runs/{run_name}", args.keep_checkpoints)
+    if reporter is not None and resume_state is not None:
+        reporter.returns.extend(resume_state["episode_returns"])
+    hyperparameters = {**vars(args), **(placement.as_dict() if placement is not None else {})}
     writer.add_text(
         "hyperparameters",
-        "|param|value|\n|-|-|\n%s" % ("\n".join([f"|{key}|{value}|" for key, value in vars(args).items()])),
+        "|param|value|\n|-|-|\n%s" % ("\n".join([f"|{key}|{value}|" for key, value in hyperparameters.items()])),
     )
 
     # TRY NOT TO MODIFY: seeding
@@ -250,103 +352,120 @@ if __name__ == "__main__":
     device = torch.device("cuda" if torch.cuda.is_available() and args.cuda else "cpu")
 
     # env setup
-    envs = gym.vector.SyncVectorEnv(
-        [make_env(args.env_id, i, args.capture_video, run_name) for i in range(args.num_envs)],
+    envs = make_vector_env(
+        args.env_id,
+        args.num_envs,
+        args.capture_video,
+        run_name,
+        skip_frames=args.skip_frames,
+        backend=args.env_backend,
+        batch_size=args.env_batch_size,
+        preprocessing=args.preprocessing,
+        copy=False,
     )
     assert isinstance(envs.single_action_space, gym.spaces.Discrete), "only discrete action space is supported"
+    if placement is not None:
+        placement.pin_env_workers(envs)
+    # renders the videos of the episodes logged by env 0 in a background process
+    video_replayer = VideoReplayer(f"videos/{run_name}") if args.capture_video else None
 
     agent = Agent(envs).to(device)
     optimizer = optim.Adam(agent.parameters(), lr=args.learning_rate, eps=1e-5)
+    if resume_state is not None:
+        agent.load_state_dict(resume_state["agent"])
+        optimizer.load_state_dict(resume_state["optimizer"])
+    minibatch_loader = MinibatchLoader(args.minibatch_size, prefetch=args.prefetch_minibatches)
 
+    stopped = False
     if not args.eval_checkpoint:
         # ALGO Logic: Storage setup
-        obs = torch.zeros((args.num_steps, args.num_envs) + envs.single_observation_space.shape).to(device)
-        actions = torch.zeros((args.num_steps, args.num_envs) + envs.single_action_space.shape).to(device)
+        # keeps every frame of the stacked observations only once
+        obs = FrameStackStorage(args.num_steps, args.num_envs, envs.single_observation_space.shape, device)
+        actions = torch.zeros((args.num_steps, args.num_envs) + envs.single_action_space.shape, dtype=torch.long).to(device)
         logprobs = torch.zeros((args.num_steps, args.num_envs)).to(device)
         rewards = torch.zeros((args.num_steps, args.num_envs)).to(device)
         dones = torch.zeros((args.num_steps, args.num_envs)).to(device)
         values = torch.zeros((args.num_steps, args.num_envs)).to(device)
         uncertainties = torch.zeros((args.num_steps, args.num_envs)).to(device)
-        features = torch.zeros((args.num_steps, args.num_envs, 512)).to(device)  # Store features for uncertainty estimation
         
         # Initialize state buffer for each environment
         state_buffers = [StateBuffer(args.num_steps, 512) for _ in range(args.num_envs)]
+        uncertainty_reward = UncertaintyReward(agent, state_buffers, uncertainties, args.uncertainty_coef)
 
         # TRY NOT TO MODIFY: start the game
-        global_step = 0
-        start_time = time.time()
-        next_obs, _ = envs.reset(seed=args.seed)
-        next_obs = torch.Tensor(next_obs).to(device)
+        global_step = resume_state["global_step"] if resume_state is not None else 0
+        start_iteration = resume_state["iteration"] + 1 if resume_state is not None else 1
+        start_step, start_time = global_step, time.time()
+        # a resumed run seeds its envs from its step, so it does not replay the episodes of the first run
+        next_obs, _ = envs.reset(seed=args.seed + global_step)
+        next_obs = torch.as_tensor(next_obs).to(device)
         next_done = torch.zeros(args.num_envs).to(device)
-        next_features = agent.network(next_obs / 255.0)  # Get initial features
+        uncertainty_reward.reset(next_obs)  # Get initial features
+
+        if resume_state is not None:
+            for state_buffer, state in zip(state_buffers, resume_state["state_buffers"]):
+                state_buffer.load_state_dict(state)
+            # the envs start new episodes, the random number generators continue where the checkpoint left them
+            set_rng_state(resume_state["rng"])
+
+        for iteration in range(start_iteration, args.num_iterations + 1):
+            # the budget of this run (e.g. an ASHA rung) is used up
+            stopped = bool(args.stop_timesteps) and global_step >= args.stop_timesteps
+            checkpoint_due = args.checkpoint_interval > 0 and (iteration - 1) % args.checkpoint_interval == 0
+            if stopped or (checkpoint_due and iteration > start_iteration):
+                # the state after the update of the previous iteration, the learning rate follows from the iteration
+                checkpoint_path = checkpoint_writer.save(
+                    run_name=run_name,
+                    iteration=iteration - 1,
+                    global_step=global_step,
+                    agent=agent.state_dict(),
+                    optimizer=optimizer.state_dict(),
+                    state_buffers=[state_buffer.state_dict() for state_buffer in state_buffers],
+                    rng=rng_state(),
+                    episode_returns=list(reporter.returns) if reporter is not None else [],
+                    wandb_id=wandb.run.id if args.track else None,
+                )
+                print(f"saving the checkpoint after {global_step} steps to {checkpoint_path}")
+            if stopped:
+                if reporter is not None:
+                    # the reported checkpoint has to be on disk
+                    checkpoint_writer.wait()
+                    reporter.report(global_step, checkpoint=checkpoint_path)
+                break
 
-        for iteration in range(1, args.num_iterations + 1):
             # Annealing the rate if instructed to do so.
             if args.anneal_lr:
                 frac = 1.0 - (iteration - 1.0) / args.num_iterations
                 lrnow = frac * args.learning_rate
                 optimizer.param_groups[0]["lr"] = lrnow
 
-            for step in range(0, args.num_steps):
-                global_step += args.num_envs
-                obs[step] = next_obs
-                dones[step] = next_done
-                features[step] = next_features
-
-                # ALGO LOGIC: action logic
-                with torch.no_grad():
-                    action, logprob, _, value, current_features = agent.get_action_and_value(next_obs)
-                    values[step] = value.flatten()
-                actions[step] = action
-                logprobs[step] = logprob
-
-                # TRY NOT TO MODIFY: execute the game and log data.
-                next_obs, reward, terminations, truncations, infos = envs.step(action.cpu().numpy())
-                next_obs = torch.Tensor(next_obs).to(device)
-                next_done = torch.Tensor(np.logical_or(terminations, truncations)).to(device)
-                
-                # Calculate uncertainty-based intrinsic reward
-                with torch.no_grad():
-                    next_features = agent.network(next_obs / 255.0)
-                    steps_pred = agent.get_uncertainty(current_features, next_features)
-                    # Higher step prediction means more uncertainty/novelty
-                    uncertainty = torch.tanh(steps_pred)
-                    uncertainties[step] = uncertainty.flatten()
-                    
-                    # Add current state features to buffer
-                    for env_idx in range(args.num_envs):
-                        state_buffers[env_idx].add(current_features[env_idx])
-                    
-                    # Combine extrinsic and intrinsic rewards
-                    combined_reward = reward + args.uncertainty_coef * uncertainty.cpu().numpy().flatten()
-                    rewards[step] = torch.tensor(combined_reward).to(device).view(-1)
-
-                if (terminations.any() or truncations.any()) and "episode" in infos:
-                    for i in np.argwhere(infos["_episode"]):
-                        print(f"global_step={global_step}, episodic_return={infos['episode']['r'][i]}")
-                        writer.add_scalar("train/episodic_return", infos["episode"]["r"][i], global_step)
-                        writer.add_scalar("train/episodic_length", infos["episode"]["l"][i], global_step)
-                        writer.add_scalar("train/episodic_time", infos["episode"]["t"][i], global_step)
-                        writer.add_scalar("train/uncertainty_reward", uncertainty.mean().item(), global_step)
+            if placement is not None:
+                placement.rollout_phase()
+            next_obs, next_done, global_step = collect_rollout(
+                agent,
+                envs,
+                (obs, actions, logprobs, rewards, dones, values),
+                next_obs,
+                next_done,
+                global_step,
+                args.num_steps,
+                args.num_envs,
+                args.env_batch_size,
+                writers=[writer],
+                reporter=reporter,
+                step_hook=uncertainty_reward,
+            )
+            writer.add_scalar("train/uncertainty_reward", uncertainties.mean().item(), global_step)
 
             # bootstrap value if not done
             with torch.no_grad():
                 next_value = agent.get_value(next_obs).reshape(1, -1)
-                advantages = torch.zeros_like(rewards).to(device)
-                lastgaelam = 0
-                for t in reversed(range(args.num_steps)):
-                    if t == args.num_steps - 1:
-                        nextnonterminal = 1.0 - next_done
-                        nextvalues = next_value
-                    else:
-                        nextnonterminal = 1.0 - dones[t + 1]
-                        nextvalues = values[t + 1]
-                    delta = rewards[t] + args.gamma * nextvalues * nextnonterminal - values[t]
-                    advantages[t] = lastgaelam = delta + args.gamma * args.gae_lambda * nextnonterminal * lastgaelam
-                returns = advantages + values
+                advantages, returns = compute_gae(
+                    rewards, values, dones, next_value, next_done, args.gamma, args.gae_lambda, backend=args.gae_backend
+                )
 
             # flatten the batch
-            b_obs = obs.reshape((-1,) + envs.single_observation_space.shape)
+            b_obs = obs  # the stacks are rebuilt when the minibatches are gathered
             b_logprobs = logprobs.reshape(-1)
             b_actions = actions.reshape((-1,) + envs.single_action_space.shape)
             b_advantages = advantages.reshape(-1)
@@ -355,18 +474,17 @@ if __name__ == "__main__":
             b_uncertainties = uncertainties.reshape(-1)
 
             # Optimizing the policy and value network
+            if placement is not None:
+                placement.update_phase()
             b_inds = np.arange(args.batch_size)
             clipfracs = []
             for epoch in range(args.update_epochs):
                 np.random.shuffle(b_inds)
-                for start in range(0, args.batch_size, args.minibatch_size):
-                    end = start + args.minibatch_size
-                    mb_inds = b_inds[start:end]
-
-                    _, newlogprob, entropy, newvalue, current_features = agent.get_action_and_value(
-                        b_obs[mb_inds], b_actions.long()[mb_inds]
-                    )
-                    logratio = newlogprob - b_logprobs[mb_inds]
+                for mb_obs, mb_actions, mb_logprobs, mb_advantages, mb_returns, mb_values in minibatch_loader(
+                    b_inds, b_obs, b_actions, b_logprobs, b_advantages, b_returns, b_values
+                ):
+                    _, newlogprob, entropy, newvalue, current_features = agent.get_action_and_value(mb_obs, mb_actions)
+                    logratio = newlogprob - mb_logprobs
                     ratio = logratio.exp()
 
                     with torch.no_grad():
@@ -375,7 +493,6 @@ if __name__ == "__main__":
                         approx_kl = ((ratio - 1) - logratio).mean()
                         clipfracs += [((ratio - 1.0).abs() > args.clip_coef).float().mean().item()]
 
-                    mb_advantages = b_advantages[mb_inds]
                     if args.norm_adv:
                         mb_advantages = (mb_advantages - mb_advantages.mean()) / (mb_advantages.std() + 1e-8)
 
@@ -387,17 +504,17 @@ if __name__ == "__main__":
                     # Value loss
                     newvalue = newvalue.view(-1)
                     if args.clip_vloss:
-                        v_loss_unclipped = (newvalue - b_returns[mb_inds]) ** 2
-                        v_clipped = b_values[mb_inds] + torch.clamp(
-                            newvalue - b_values[mb_inds],
+                        v_loss_unclipped = (newvalue - mb_returns) ** 2
+                        v_clipped = mb_values + torch.clamp(
+                            newvalue - mb_values,
                             -args.clip_coef,
                             args.clip_coef,
                         )
-                        v_loss_clipped = (v_clipped - b_returns[mb_inds]) ** 2
+                        v_loss_clipped = (v_clipped - mb_returns) ** 2
                         v_loss_max = torch.max(v_loss_unclipped, v_loss_clipped)
                         v_loss = 0.5 * v_loss_max.mean()
                     else:
-                        v_loss = 0.5 * ((newvalue - b_returns[mb_inds]) ** 2).mean()
+                        v_loss = 0.5 * ((newvalue - mb_returns) ** 2).mean()
 
                     # Uncertainty network loss
                     uncertainty_loss = 0
@@ -436,34 +553,40 @@ if __name__ == "__main__":
             writer.add_scalar("losses/approx_kl", approx_kl.item(), global_step)
             writer.add_scalar("losses/clipfrac", np.mean(clipfracs), global_step)
             writer.add_scalar("losses/explained_variance", explained_var, global_step)
-            print("SPS:", int(global_step / (time.time() - start_time)))
-            writer.add_scalar("charts/StepPerSecond", int(global_step / (time.time() - start_time)), global_step)
-
-        if args.save_model:
+            print("SPS:", int((global_step - start_step) / (time.time() - start_time)))
+            writer.add_scalar("charts/StepPerSecond", int((global_step - start_step) / (time.time() - start_time)), global_step)
+            if reporter is not None:
+                reporter.report(global_step)
+
+        checkpoint_writer.close()
+        if not stopped:
+            # the run is complete, `resume auto` starts a new one
+            for checkpoint_path in list_checkpoints(f"runs/{run_name}"):
+                os.remove(checkpoint_path)
+        if args.save_model and not stopped:
             model_path = f"runs/{run_name}/{args.exp_name}.cleanrl_model"
-            torch.save(agent.state_dict(), model_path)
+            save_tensors(model_path, agent.state_dict())
 
             print(f"model saved to {model_path}")
         
-    model_path = args.eval_checkpoint if args.eval_checkpoint else model_path
-    episodic_events = evaluate(
-        model_path,
-        make_env,
-        args.env_id,
-        eval_episodes=100,
-        run_name=f"{run_name}-eval",
-        Model=Agent,
-        device=device,
-    )
+    if not stopped:
+        model_path = args.eval_checkpoint if args.eval_checkpoint else model_path
+        episodic_events = evaluate(
+            model_path,
+            partial(make_env, skip_frames=args.skip_frames, preprocessing=args.preprocessing),
+            args.env_id,
+            eval_episodes=100,
+            run_name=f"{run_name}-eval",
+            Model=Agent,
+            device=device,
+        )
 
-    for idx, event in enumerate(episodic_events):
-        writer.add_scalar("eval/episodic_return", event['return'], idx)
-        writer.add_scalar("eval/episodic_length", event['length'], idx)
-        writer.add_scalar("eval/episodic_time", event['time'], idx)
+        for idx, event in enumerate(episodic_events):
+            writer.add_scalar("eval/episodic_return", event['return'], idx)
+            writer.add_scalar("eval/episodic_length", event['length'], idx)
+            writer.add_scalar("eval/episodic_time", event['time'], idx)
     
-    try:
-        writer.close()
-        envs.close()
-    except:
-        # somehow this code throws an "AttributeError: 'RecordVideo' object has no attribute 'enabled'" when running the evaluation code
-        pass
\ No newline at end of file
+    writer.close()
+    envs.close()
+    if video_replayer is not None:
+        video_replayer.close()
\ No newline at end of file
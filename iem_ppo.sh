@@ -6,4 +6,6 @@
 #SBATCH --output=out/iem-ppo-%A_%a.out
 #SBATCH --error=out/iem-ppo-%A_%a.err
 
-.venv/bin/python iem_ppo.py --track --exp_name "iem_ppo_coef_$1" --uncertainty_coef $1
\ No newline at end of file
+# saves a checkpoint every 20 iterations and continues the newest run of this coefficient, so a run that hits the
+# time limit continues in a chained job: sbatch --dependency=afterany:<job id> iem_ppo.sh <coef>
+.venv/bin/python iem_ppo.py --track --exp_name "iem_ppo_coef_$1" --uncertainty_coef $1 --checkpoint_interval 20 --resume auto
\ No newline at end of file
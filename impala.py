@@ -0,0 +1,360 @@
+# IMPALA (https://arxiv.org/abs/1802.01561) with the agents of the PPO scripts: actor processes stream trajectory
+# chunks through shared memory to the learner, which corrects for the policy lag with V-trace
+import os
+import queue
+import random
+import time
+from dataclasses import dataclass
+from functools import partial
+from types import SimpleNamespace
+from typing import Literal
+
+import gymnasium as gym
+import ale_py
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+import torch.nn as nn
+import torch.optim as optim
+import tyro
+from torch.distributions.categorical import Categorical
+from torch.utils.tensorboard import SummaryWriter
+from rle_assignment.checkpoint import save_tensors
+from rle_assignment.gae import GaeBackend
+from rle_assignment.ppo_eval import evaluate
+from rle_assignment.vector_env import Preprocessing, make_env, make_vector_env
+from rle_assignment.video import VideoReplayer
+from rle_assignment.vtrace import vtrace
+
+
+gym.register_envs(ale_py)  # unnecessary but helpful for IDEs
+
+@dataclass
+class Args:
+    exp_name: str = os.path.basename(__file__)[: -len(".py")]
+    """the name of this experiment"""
+    seed: int = 1
+    """seed of the experiment"""
+    track: bool = False
+    """if toggled, this experiment will be tracked with Weights and Biases"""
+    wandb_project_name: str = "cleanRL"
+    """the wandb's project name"""
+    wandb_entity: str = None
+    """the entity (team) of wandb's project"""
+    capture_video: bool = True
+    """whether to capture videos of the agent performances (check out `videos` folder)"""
+    save_model: bool = True
+    """whether to save model into the `runs/{run_name}` folder"""
+    eval_checkpoint: str = None
+    """"if set, no training, only evaluation of the checkpoint is done"""
+
+    # Algorithm specific arguments
+    env_id: str = "ALE/SpaceInvaders-v5"
+    """the id of the environment"""
+    model: Literal["cnn", "resnet"] = "cnn"
+    """the agent, the one of `ppo_clean_rl.py` or of `ppo_resnet.py`"""
+    total_timesteps: int = 1000000
+    """total timesteps of the experiments"""
+    learning_rate: float = 6e-4
+    """the learning rate of the optimizer"""
+    anneal_lr: bool = True
+    """Toggle learning rate annealing for policy and value networks"""
+    num_actors: int = 4
+    """the number of actor processes"""
+    num_envs_per_actor: int = 4
+    """the number of game environments every actor steps"""
+    unroll_length: int = 20
+    """the number of steps of every trajectory chunk an actor sends to the learner"""
+    batch_chunks: int = 4
+    """the number of trajectory chunks per learner update"""
+    learner_threads: int = 0
+    """the number of torch threads of the learner, 0 keeps the default"""
+    num_buffers: int = 0
+    """the number of shared-memory chunk buffers, 0 uses `2 * max(num_actors, batch_chunks)`"""
+    gamma: float = 0.99
+    """the discount factor gamma"""
+    clip_rho: float = 1.0
+    """the clipping threshold of the importance weights of the V-trace targets"""
+    clip_pg_rho: float = 1.0
+    """the clipping threshold of the importance weights of the policy gradient"""
+    clip_c: float = 1.0
+    """the clipping threshold of the trace coefficients of V-trace"""
+    scan_backend: GaeBackend = "cumsum"
+    """the implementation of the V-trace recursion: `cumsum` (chunked discounted cumulative sum), `loop` (Python loop), `torchscript` (deprecated `torch.jit.script`) or `numba`"""
+    ent_coef: float = 0.01
+    """coefficient of the entropy"""
+    vf_coef: float = 0.5
+    """coefficient of the value function"""
+    max_grad_norm: float = 40.0
+    """the maximum norm for the gradient clipping"""
+    skip_frames: int = 4
+    """the number of emulator frames each action is repeated (total action repeat)"""
+    preprocessing: Preprocessing = "fused"
+    """the Atari preprocessing: `fused` (single in-place wrapper) or `legacy` (separate gymnasium/SB3 wrappers)"""
+
+    # to be filled in runtime
+    batch_size: int = 0
+    """the number of transitions per learner update (computed in runtime)"""
+
+
+def load_agent_class(model: str):
+    if model == "cnn":
+        from ppo_clean_rl import Agent
+    else:
+        from ppo_resnet import Agent
+    return Agent
+
+
+def create_buffers(args: Args, obs_shape) -> dict:
+    """The shared-memory chunk buffers, every chunk holds `unroll_length + 1` steps of the envs of one actor."""
+    shape = (args.num_buffers, args.unroll_length + 1, args.num_envs_per_actor)
+    return {
+        "obs": torch.zeros(shape + tuple(obs_shape), dtype=torch.uint8).share_memory_(),
+        "actions": torch.zeros(shape, dtype=torch.long).share_memory_(),
+        "logprobs": torch.zeros(shape).share_memory_(),
+        "rewards": torch.zeros(shape).share_memory_(),
+        "dones": torch.zeros(shape).share_memory_(),
+        # the version of the weights that collected the chunk
+        "versions": torch.zeros(args.num_buffers, dtype=torch.long).share_memory_(),
+    }
+
+
+def actor(actor_id, args, run_name, buffers, shared_agent, weights_lock, weights_version, free_queue, full_queue, stats_queue):
+    """
+    Steps `num_envs_per_actor` envs with the latest weights of `shared_agent` and writes chunks of `unroll_length`
+    steps into the buffer slots it takes from `free_queue`, the filled slots are put into `full_queue`. The last
+    observation of a chunk is the first one of the next. Stops when it takes `None` from `free_queue`.
+    """
+    torch.set_num_threads(1)
+    torch.manual_seed(args.seed + actor_id)
+    envs = make_vector_env(
+        args.env_id,
+        args.num_envs_per_actor,
+        args.capture_video and actor_id == 0,
+        run_name,
+        skip_frames=args.skip_frames,
+        preprocessing=args.preprocessing,
+        copy=False,
+    )
+    agent = load_agent_class(args.model)(envs).eval()
+    version = -1
+
+    next_obs, _ = envs.reset(seed=args.seed + actor_id * args.num_envs_per_actor)
+    next_obs = torch.as_tensor(next_obs)
+    next_done = torch.zeros(args.num_envs_per_actor)
+    while True:
+        index = free_queue.get()
+        if index is None:
+            break
+        if weights_version.value != version:
+            with weights_lock:
+                agent.load_state_dict(shared_agent.state_dict())
+                version = weights_version.value
+        buffers["versions"][index] = version
+
+        for step in range(args.unroll_length + 1):
+            buffers["obs"][index, step] = next_obs
+            buffers["dones"][index, step] = next_done
+            if step == args.unroll_length:
+                break
+            agent.act(next_obs, buffers["actions"][index, step], buffers["logprobs"][index, step])
+
+            next_obs, reward, terminations, truncations, infos = envs.step(buffers["actions"][index, step].numpy())
+            buffers["rewards"][index, step] = torch.from_numpy(reward)
+            next_done = torch.from_numpy(np.logical_or(terminations, truncations)).float()
+            next_obs = torch.as_tensor(next_obs)
+
+            if (terminations.any() or truncations.any()) and "episode" in infos:
+                for i in np.argwhere(infos["_episode"]).flatten():
+                    stats_queue.put((float(infos["episode"]["r"][i]), int(infos["episode"]["l"][i]), float(infos["episode"]["t"][i])))
+        full_queue.put(index)
+    envs.close()
+
+
+def get_full_chunk(full_queue, actors) -> int:
+    """Waits for the next filled chunk, raises if an actor died instead."""
+    while True:
+        try:
+            return full_queue.get(timeout=1.0)
+        except queue.Empty:
+            for process in actors:
+                if process.exitcode not in (None, 0):
+                    raise RuntimeError(f"actor process {process.name} exited with code {process.exitcode}")
+
+
+if __name__ == "__main__":
+    args = tyro.cli(Args)
+    args.num_buffers = args.num_buffers or 2 * max(args.num_actors, args.batch_chunks)
+    assert args.num_buffers >= args.batch_chunks, "`num_buffers` must hold at least `batch_chunks` chunks"
+    args.batch_size = args.batch_chunks * args.unroll_length * args.num_envs_per_actor
+    run_name = f"{args.env_id}__{args.exp_name}__{args.seed}__{time.strftime('%Y%m%d_%H%M%S')}"
+    if args.track:
+        import wandb
+
+        wandb.init(
+            project=args.wandb_project_name,
+            entity=args.wandb_entity,
+            sync_tensorboard=True,
+            config=vars(args),
+            name=run_name,
+            monitor_gym=True,
+            save_code=True,
+        )
+    writer = SummaryWriter(f"runs/{run_name}")
+    writer.add_text(
+        "hyperparameters",
+        "|param|value|\n|-|-|\n%s" % ("\n".join([f"|{key}|{value}|" for key, value in vars(args).items()])),
+    )
+
+    # TRY NOT TO MODIFY: seeding
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    if args.learner_threads > 0:
+        torch.set_num_threads(args.learner_threads)
+
+    # IMPALA runs entirely on the CPU: the actors and the learner share the weights and chunks through shared memory
+    device = torch.device("cpu")
+    Agent = load_agent_class(args.model)
+    env = make_env(args.env_id, 0, False, run_name, args.skip_frames, args.preprocessing)()
+    assert isinstance(env.action_space, gym.spaces.Discrete), "only discrete action space is supported"
+    spaces = SimpleNamespace(single_action_space=env.action_space, single_observation_space=env.observation_space)
+    env.close()
+    # renders the videos of the episodes logged by env 0 of actor 0 in a background process
+    video_replayer = VideoReplayer(f"videos/{run_name}") if args.capture_video else None
+
+    agent = Agent(spaces)
+    optimizer = optim.Adam(agent.parameters(), lr=args.learning_rate, eps=1e-5)
+
+    if not args.eval_checkpoint:
+        ctx = mp.get_context("spawn")
+        buffers = create_buffers(args, spaces.single_observation_space.shape)
+        shared_agent = Agent(spaces).share_memory()
+        shared_agent.load_state_dict(agent.state_dict())
+        weights_lock, weights_version = ctx.Lock(), ctx.Value("l", 0)
+        free_queue, full_queue, stats_queue = ctx.Queue(), ctx.Queue(), ctx.Queue()
+        for index in range(args.num_buffers):
+            free_queue.put(index)
+        actors = [
+            ctx.Process(
+                target=actor,
+                args=(i, args, run_name, buffers, shared_agent, weights_lock, weights_version, free_queue, full_queue, stats_queue),
+                name=f"actor-{i}",
+            )
+            for i in range(args.num_actors)
+        ]
+        for process in actors:
+            process.start()
+
+        global_step = 0
+        update = 0
+        start_time = time.time()
+        while global_step < args.total_timesteps:
+            # Annealing the rate if instructed to do so.
+            if args.anneal_lr:
+                frac = 1.0 - global_step / args.total_timesteps
+                optimizer.param_groups[0]["lr"] = frac * args.learning_rate
+
+            indices = [get_full_chunk(full_queue, actors) for _ in range(args.batch_chunks)]
+            # time-major batch (unroll_length + 1, batch_chunks * num_envs_per_actor, ...) of the chunks
+            batch = {key: torch.cat([buffers[key][i] for i in indices], dim=1) for key in ["obs", "actions", "logprobs", "rewards", "dones"]}
+            policy_lag = update - buffers["versions"][indices].float().mean().item()
+            for index in indices:
+                free_queue.put(index)
+            global_step += args.batch_size
+            update += 1
+
+            # ALGO LOGIC: V-trace actor-critic loss
+            update_start_time = time.perf_counter()
+            num_steps, num_envs = batch["rewards"].shape
+            hidden = agent.features(batch["obs"].flatten(0, 1))
+            logits = agent.actor(hidden).view(num_steps, num_envs, -1)[:-1]
+            newvalues = agent.critic(hidden).view(num_steps, num_envs)
+            probs = Categorical(logits=logits)
+            newlogprobs = probs.log_prob(batch["actions"][:-1])
+            # the transition of step t ends its episode if the observation of step t + 1 is the first of a new one
+            discounts = args.gamma * (1.0 - batch["dones"][1:])
+            vs, pg_advantages = vtrace(
+                batch["logprobs"][:-1],
+                newlogprobs.detach(),
+                batch["rewards"][:-1],
+                newvalues[:-1].detach(),
+                newvalues[-1].detach(),
+                discounts,
+                clip_rho=args.clip_rho,
+                clip_pg_rho=args.clip_pg_rho,
+                clip_c=args.clip_c,
+                backend=args.scan_backend,
+            )
+
+            pg_loss = -(newlogprobs * pg_advantages).mean()
+            v_loss = 0.5 * ((vs - newvalues[:-1]) ** 2).mean()
+            entropy_loss = probs.entropy().mean()
+            loss = pg_loss - args.ent_coef * entropy_loss + v_loss * args.vf_coef
+
+            optimizer.zero_grad()
+            loss.backward()
+            nn.utils.clip_grad_norm_(agent.parameters(), args.max_grad_norm)
+            optimizer.step()
+
+            # push the new weights to the actors
+            with weights_lock:
+                shared_agent.load_state_dict(agent.state_dict())
+                weights_version.value = update
+            update_time = time.perf_counter() - update_start_time
+
+            while True:
+                try:
+                    episodic_return, episodic_length, episodic_time = stats_queue.get_nowait()
+                except queue.Empty:
+                    break
+                print(f"global_step={global_step}, episodic_return={episodic_return}")
+                writer.add_scalar("train/episodic_return", episodic_return, global_step)
+                writer.add_scalar("train/episodic_length", episodic_length, global_step)
+                writer.add_scalar("train/episodic_time", episodic_time, global_step)
+
+            # TRY NOT TO MODIFY: record rewards for plotting purposes
+            writer.add_scalar("charts/learning_rate", optimizer.param_groups[0]["lr"], global_step)
+            writer.add_scalar("losses/value_loss", v_loss.item(), global_step)
+            writer.add_scalar("losses/policy_loss", pg_loss.item(), global_step)
+            writer.add_scalar("losses/entropy", entropy_loss.item(), global_step)
+            writer.add_scalar("charts/update_time", update_time, global_step)
+            writer.add_scalar("charts/policy_lag", policy_lag, global_step)
+            print("SPS:", int(global_step / (time.time() - start_time)))
+            writer.add_scalar("charts/StepPerSecond", int(global_step / (time.time() - start_time)), global_step)
+
+        for _ in actors:
+            free_queue.put(None)
+        for process in actors:
+            process.join(timeout=60)
+            if process.is_alive():
+                process.terminate()
+
+        if args.save_model:
+            model_path = f"runs/{run_name}/{args.exp_name}.cleanrl_model"
+            save_tensors(model_path, agent.state_dict())
+
+            print(f"model saved to {model_path}")
+
+    model_path = args.eval_checkpoint if args.eval_checkpoint else model_path
+    episodic_events = evaluate(
+        model_path,
+        partial(make_env, skip_frames=args.skip_frames, preprocessing=args.preprocessing),
+        args.env_id,
+        eval_episodes=100,
+        run_name=f"{run_name}-eval",
+        Model=Agent,
+        device=device,
+    )
+
+    for idx, event in enumerate(episodic_events):
+        writer.add_scalar("eval/episodic_return", event['return'], idx)
+        writer.add_scalar("eval/episodic_length", event['length'], idx)
+        writer.add_scalar("eval/episodic_time", event['time'], idx)
+    mean_return = np.mean([event['return'] for event in episodic_events])
+    writer.add_scalar("eval/mean_episodic_return", mean_return)
+    print(f"eval mean episodic return: {mean_return:.2f}")
+
+    writer.close()
+    if video_replayer is not None:
+        video_replayer.close()
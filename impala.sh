@@ -0,0 +1,9 @@
+#!/bin/sh
+#SBATCH --time=6:00:00 # never more than 6 hours
+#SBATCH --cpus-per-task=16  # must match num_actors + learner_threads, never more than 16
+#SBATCH --gres=gpu:0  # never more than 0
+#SBATCH --partition=performance # do not change
+#SBATCH --output=out/impala-%A_%a.out
+#SBATCH --error=out/impala-%A_%a.err
+
+.venv/bin/python impala.py --track --num_actors 12 --num_envs_per_actor 4 --learner_threads 4
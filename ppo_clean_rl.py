@@ -1,27 +1,48 @@
 # docs and experiment results can be found at https://docs.cleanrl.dev/rl-algorithms/ppo/#ppo_ataripy
+import copy
 import os
 import random
+import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from functools import partial
 
 import gymnasium as gym
 import ale_py
 import numpy as np
 import torch
+import torch.distributed as dist
 import torch.nn as nn
 import torch.optim as optim
 import tyro
 from torch.distributions.categorical import Categorical
 from torch.utils.tensorboard import SummaryWriter
-from rle_assignment.ppo_eval import evaluate
-
-from stable_baselines3.common.atari_wrappers import (  # isort:skip
-    ClipRewardEnv,
-    EpisodicLifeEnv,
-    FireResetEnv,
-    MaxAndSkipEnv,
-    NoopResetEnv,
+from rle_assignment.asha import RungReporter
+from rle_assignment.autotune import autotune
+from rle_assignment.checkpoint import (
+    CheckpointWriter,
+    find_checkpoint,
+    list_checkpoints,
+    load_checkpoint,
+    rng_state,
+    save_tensors,
+    set_rng_state,
 )
+from rle_assignment.distributed import all_reduce_mean, broadcast_parameters, init_distributed
+from rle_assignment.gae import GaeBackend, compute_gae
+from rle_assignment.layers import Precision, ScaledConv2d, autocast
+from rle_assignment.minibatch import MinibatchLoader
+from rle_assignment.multi_seed import SeedBatching, SeedEnsemble, SeedPPOUpdate, seed_batch_indices
+from rle_assignment.placement import plan_cpu_placement
+from rle_assignment.policy import sample_categorical
+from rle_assignment.ppo import PPOUpdate, recompute_logprobs_and_values
+from rle_assignment.ppo_eval import evaluate
+from rle_assignment.quantization import QuantizedPolicy
+from rle_assignment.rollout import collect_rollout
+from rle_assignment.rollout_storage import FrameStackStorage
+from rle_assignment.vector_env import Backend, Preprocessing, make_env, make_vector_env
+from rle_assignment.video import VideoReplayer
 
 
 gym.register_envs(ale_py)  # unnecessary but helpful for IDEs
@@ -57,7 +78,11 @@ class Args:
     learning_rate: float = 2.5e-4
     """the learning rate of the optimizer"""
     num_envs: int = 16
-    """the number of parallel game environments"""
+    """the number of parallel game environments (per process when started with `torchrun`)"""
+    env_backend: Backend = "sync"
+    """the vector env backend: `sync` (single process), `async` (one worker process per env, shared memory), `pool` (like `async`, supports `env_batch_size`) or `native` (C++ vector env of ale_py)"""
+    env_batch_size: int = 0
+    """if > 0, each rollout step only waits for the first `env_batch_size` ready envs (requires `--env_backend pool`)"""
     num_steps: int = 128
     """the number of steps to run in each environment per policy rollout"""
     anneal_lr: bool = True
@@ -66,6 +91,8 @@ class Args:
     """the discount factor gamma"""
     gae_lambda: float = 0.95
     """the lambda for the general advantage estimation"""
+    gae_backend: GaeBackend = "cumsum"
+    """the implementation of the advantage computation: `cumsum` (chunked discounted cumulative sum), `loop` (Python loop), `torchscript` (deprecated `torch.jit.script`) or `numba`"""
     num_minibatches: int = 4
     """the number of mini-batches"""
     update_epochs: int = 4
@@ -84,8 +111,50 @@ class Args:
     """the maximum norm for the gradient clipping"""
     target_kl: float = None
     """the target KL divergence threshold"""
+    prefetch_minibatches: bool = True
+    """gather the observations of the next minibatch on a background thread while the current one is optimized"""
+    compile_update: bool = False
+    """compile the forward, loss and backward of the PPO update with `torch.compile` (falls back to eager mode if it fails)"""
+    fused_adam: bool = False
+    """use the fused implementation of Adam for the optimizer step"""
+    precision: Precision = "fp32"
+    """the precision of the network forward and backward: `fp32` or `bf16` (CPU autocast, the weights, losses and advantages stay fp32)"""
+    quantized_rollout: bool = False
+    """select the rollout actions with an int8 quantized snapshot of the agent (CPU only), refreshed after every update phase"""
+    quantized_eval: bool = False
+    """evaluate with an int8 quantized snapshot of the trained agent (CPU only)"""
+    pipelined_rollout: bool = False
+    """collect the next rollout on a background thread with a snapshot of the agent while the current one is optimized (policy lag of one update)"""
+    cpu_placement: bool = False
+    """pin the env worker processes (`async`/`pool` backends) to their own cores and the learner to the remaining cores during the rollout and all cores during the update (no effect with the `sync` and `native` backends)"""
+    env_cores: int = 0
+    """the number of cores for the env workers with `cpu_placement` (0: one core per worker, leaving at least one core to torch)"""
+    autotune: bool = False
+    """measure the env, inference and update times before training and choose `env_backend`, `num_envs`, the torch threads and `num_minibatches` with the highest estimated SPS (saved as `autotune.json` in the run directory)"""
+    autotune_seconds: float = 60.0
+    """the time budget of all `autotune` measurements including the start of the envs, configurations not measured within it are not chosen"""
+    autotune_memory_gb: float = 8.0
+    """the memory cap of the configurations `autotune` chooses from"""
+    num_seeds: int = 1
+    """the number of agents trained in this process with the seeds `seed`, `seed + 1`, ..., each with its own `num_envs` envs, generators, optimizer state and tensorboard run"""
+    seed_batching: SeedBatching = "loop"
+    """how the forward and backward of the `num_seeds` agents run: `loop` (one seed after another, faster on the measured CPUs) or `vmap` (batched over the stacked parameters)"""
+    resume: str = None
+    """if set, continue the run of this checkpoint or run directory, with `auto` the newest run of this `env_id`, `exp_name` and `seed` that has a checkpoint (a new run if there is none)"""
+    checkpoint_interval: int = 0
+    """if > 0, save the training state to `runs/{run_name}/checkpoint_{global_step}.safetensors` every `checkpoint_interval` iterations (on a background thread), so a preempted run can continue with `resume`"""
+    keep_checkpoints: int = 2
+    """the number of the newest checkpoints kept on disk (0: all)"""
+    stop_timesteps: int = 0
+    """if > 0, stop after this many of the `total_timesteps` and save a checkpoint to continue from with `resume` (the learning rate schedule stays the one of `total_timesteps`)"""
+    report_file: str = None
+    """if set, append the global step and the rolling mean of the training episodic returns to this JSON lines file after every iteration (the rungs of `rle_assignment/asha.py`)"""
+    report_window: int = 20
+    """the number of training episodes of the rolling mean return of `report_file`"""
     skip_frames: int = 4
-    """number of frames to skip in MaxAndSkipEnv wrapper"""
+    """the number of emulator frames each action is repeated (total action repeat)"""
+    preprocessing: Preprocessing = "fused"
+    """the Atari preprocessing: `fused` (single in-place wrapper) or `legacy` (separate gymnasium/SB3 wrappers)"""
 
     # to be filled in runtime
     batch_size: int = 0
@@ -94,28 +163,8 @@ class Args:
     """the mini-batch size (computed in runtime)"""
     num_iterations: int = 0
     """the number of iterations (computed in runtime)"""
-
-
-def make_env(env_id, idx, capture_video, run_name):
-    def thunk():
-        if capture_video and idx == 0:
-            env = gym.make(env_id, render_mode="rgb_array")
-            env = gym.wrappers.RecordVideo(env, f"videos/{run_name}")
-        else:
-            env = gym.make(env_id)
-        env = gym.wrappers.RecordEpisodeStatistics(env)
-        env = NoopResetEnv(env, noop_max=30)
-        env = MaxAndSkipEnv(env, skip=args.skip_frames)
-        env = EpisodicLifeEnv(env)
-        if "FIRE" in env.unwrapped.get_action_meanings():
-            env = FireResetEnv(env)
-        env = ClipRewardEnv(env)
-        env = gym.wrappers.ResizeObservation(env, (84, 84))
-        env = gym.wrappers.GrayscaleObservation(env)
-        env = gym.wrappers.FrameStackObservation(env, 4)
-        return env
-
-    return thunk
+    world_size: int = 1
+    """the number of data-parallel processes started by `torchrun` (computed in runtime)"""
 
 
 def layer_init(layer, std=np.sqrt(2), bias_const=0.0):
@@ -125,10 +174,11 @@ def layer_init(layer, std=np.sqrt(2), bias_const=0.0):
 
 
 class Agent(nn.Module):
-    def __init__(self, envs):
+    def __init__(self, envs, precision: Precision = "fp32"):
         super().__init__()
+        self.precision = precision
         self.network = nn.Sequential(
-            layer_init(nn.Conv2d(4, 32, 8, stride=4)),
+            layer_init(ScaledConv2d(4, 32, 8, stride=4, scale=1 / 255.0)),
             nn.ReLU(),
             layer_init(nn.Conv2d(32, 64, 4, stride=2)),
             nn.ReLU(),
@@ -141,25 +191,264 @@ class Agent(nn.Module):
         self.actor = layer_init(nn.Linear(512, envs.single_action_space.n), std=0.01)
         self.critic = layer_init(nn.Linear(512, 1), std=1)
 
+    def features(self, x):
+        # only the network runs in `self.precision`, the actor and critic heads and everything after them stay fp32
+        with autocast(x, self.precision):
+            return self.network(x).float()
+
     def get_value(self, x):
-        return self.critic(self.network(x / 255.0))
+        return self.critic(self.features(x))
 
     def get_action_and_value(self, x, action=None):
-        hidden = self.network(x / 255.0)
+        hidden = self.features(x)
         logits = self.actor(hidden)
         probs = Categorical(logits=logits)
         if action is None:
             action = probs.sample()
         return action, probs.log_prob(action), probs.entropy(), self.critic(hidden)
 
+    @torch.inference_mode()
+    def act(self, x, action=None, logprob=None, value=None):
+        """
+        Rollout fast path of `get_action_and_value`: samples the actions without building a distribution and
+        computing the entropy, and writes the actions, their log-probs and the values into the given tensors.
+        """
+        hidden = self.features(x)
+        action, logprob = sample_categorical(self.actor(hidden), action, logprob)
+        value = self.critic(hidden).flatten() if value is None else value.copy_(self.critic(hidden).flatten())
+        return action, logprob, value
+
+
+def train_seeds(args):
+    """
+    Trains `args.num_seeds` agents with the seeds `args.seed`, `args.seed + 1`, ... in this process as a
+    `SeedEnsemble`. Every seed steps its own `args.num_envs` envs of one vector env (seeded like a single run with its
+    seed), samples its actions and minibatches from its own generators, has its own optimizer state and logs, saves
+    and evaluates into its own run directory.
+    """
+    assert args.world_size == 1, "`num_seeds` is not supported with `torchrun`"
+    assert not (args.pipelined_rollout or args.quantized_rollout or args.compile_update or args.autotune), (
+        "`num_seeds` does not support `pipelined_rollout`, `quantized_rollout`, `compile_update` and `autotune`"
+    )
+    assert args.env_batch_size == 0 and args.target_kl is None and not args.track, (
+        "`num_seeds` does not support `env_batch_size`, `target_kl` and `track`"
+    )
+    assert not (args.resume or args.stop_timesteps or args.report_file or args.checkpoint_interval), (
+        "`num_seeds` does not support `resume`, `stop_timesteps`, `report_file` and `checkpoint_interval`"
+    )
+    seeds = [args.seed + i for i in range(args.num_seeds)]
+    num_envs = args.num_envs * args.num_seeds
+    timestamp = time.strftime('%Y%m%d_%H%M%S')
+    run_names = [f"{args.env_id}__{args.exp_name}__{seed}__{timestamp}" for seed in seeds]
+    placement = None
+    if args.cpu_placement:
+        placement = plan_cpu_placement(num_envs if args.env_backend in ("async", "pool") else 0, args.env_cores)
+        placement.pin_learner()
+    writers = []
+    for seed, run_name in zip(seeds, run_names):
+        writer = SummaryWriter(f"runs/{run_name}")
+        hyperparameters = {**vars(args), "seed": seed, **(placement.as_dict() if placement is not None else {})}
+        writer.add_text(
+            "hyperparameters",
+            "|param|value|\n|-|-|\n%s" % ("\n".join([f"|{key}|{value}|" for key, value in hyperparameters.items()])),
+        )
+        writers.append(writer)
+
+    # TRY NOT TO MODIFY: seeding
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    torch.backends.cudnn.deterministic = args.torch_deterministic
+    rngs = [np.random.default_rng(seed) for seed in seeds]
+
+    device = torch.device("cuda" if torch.cuda.is_available() and args.cuda else "cpu")
+
+    # env setup, env `i` belongs to seed `i // args.num_envs`
+    envs = make_vector_env(
+        args.env_id,
+        num_envs,
+        args.capture_video,
+        run_names[0],
+        skip_frames=args.skip_frames,
+        backend=args.env_backend,
+        preprocessing=args.preprocessing,
+        copy=False,
+    )
+    assert isinstance(envs.single_action_space, gym.spaces.Discrete), "only discrete action space is supported"
+    if placement is not None:
+        placement.pin_env_workers(envs)
+    video_replayer = VideoReplayer(f"videos/{run_names[0]}") if args.capture_video else None
+
+    # every agent is initialized like the agent of a single run with its seed
+    agents = []
+    for seed in seeds:
+        torch.manual_seed(seed)
+        agents.append(Agent(envs, precision=args.precision).to(device))
+    torch.manual_seed(args.seed)
+    agent = SeedEnsemble(agents, seeds, args.seed_batching)
+    optimizer = optim.Adam(agent.parameters(), lr=args.learning_rate, eps=1e-5, fused=args.fused_adam)
+    update_step = SeedPPOUpdate(
+        agent,
+        optimizer,
+        args.max_grad_norm,
+        args.clip_coef,
+        args.ent_coef,
+        args.vf_coef,
+        norm_adv=args.norm_adv,
+        clip_vloss=args.clip_vloss,
+    )
+    minibatch_loader = MinibatchLoader(args.minibatch_size * args.num_seeds, prefetch=args.prefetch_minibatches)
+
+    # ALGO Logic: Storage setup
+    storage = (
+        FrameStackStorage(args.num_steps, num_envs, envs.single_observation_space.shape, device),
+        torch.zeros((args.num_steps, num_envs) + envs.single_action_space.shape, dtype=torch.long).to(device),
+        torch.zeros((args.num_steps, num_envs)).to(device),
+        torch.zeros((args.num_steps, num_envs)).to(device),
+        torch.zeros((args.num_steps, num_envs)).to(device),
+        torch.zeros((args.num_steps, num_envs)).to(device),
+    )
+    obs, actions, logprobs, rewards, dones, values = storage
+
+    # TRY NOT TO MODIFY: start the game
+    global_step = 0  # the steps of every single seed
+    start_time = time.time()
+    next_obs, _ = envs.reset(seed=[seed + i for seed in seeds for i in range(args.num_envs)])
+    next_obs = torch.as_tensor(next_obs).to(device)
+    next_done = torch.zeros(num_envs).to(device)
+
+    for iteration in range(1, args.num_iterations + 1):
+        # Annealing the rate if instructed to do so.
+        if args.anneal_lr:
+            frac = 1.0 - (iteration - 1.0) / args.num_iterations
+            lrnow = frac * args.learning_rate
+            optimizer.param_groups[0]["lr"] = lrnow
+
+        if placement is not None:
+            placement.rollout_phase()
+        next_obs, next_done, global_step = collect_rollout(
+            agent, envs, storage, next_obs, next_done, global_step, args.num_steps, args.num_envs, writers=writers
+        )
+
+        # bootstrap value if not done
+        with torch.no_grad():
+            next_value = agent.get_value(next_obs).reshape(1, -1)
+            advantages, returns = compute_gae(
+                rewards, values, dones, next_value, next_done, args.gamma, args.gae_lambda, backend=args.gae_backend
+            )
+
+        # flatten the batch
+        b_obs = obs  # the stacks are rebuilt when the minibatches are gathered
+        b_logprobs = logprobs.reshape(-1)
+        b_actions = actions.reshape((-1,) + envs.single_action_space.shape)
+        b_advantages = advantages.reshape(-1)
+        b_returns = returns.reshape(-1)
+        b_values = values.reshape(-1)
+
+        # Optimizing the policy and value networks of all seeds
+        if placement is not None:
+            placement.update_phase()
+        update_start_time = time.perf_counter()
+        clipfracs = []
+        for epoch in range(args.update_epochs):
+            b_inds = seed_batch_indices(rngs, args.num_steps, args.num_envs, args.minibatch_size)
+            for minibatch in minibatch_loader(b_inds, b_obs, b_actions, b_logprobs, b_advantages, b_returns, b_values):
+                pg_loss, v_loss, entropy_loss, old_approx_kl, approx_kl, clipfrac = update_step(*minibatch)
+                clipfracs += [clipfrac]
+        update_time = time.perf_counter() - update_start_time
+        clipfracs = torch.stack(clipfracs).mean(0)
+
+        sps = int(global_step / (time.time() - start_time))
+        print("SPS:", sps, f"(per seed, {sps * args.num_seeds} in total)")
+        for i, writer in enumerate(writers):
+            seed_envs = slice(i * args.num_envs, (i + 1) * args.num_envs)
+            y_pred, y_true = values[:, seed_envs].cpu().numpy(), returns[:, seed_envs].cpu().numpy()
+            var_y = np.var(y_true)
+            explained_var = np.nan if var_y == 0 else 1 - np.var(y_true - y_pred) / var_y
+
+            # TRY NOT TO MODIFY: record rewards for plotting purposes
+            writer.add_scalar("charts/learning_rate", optimizer.param_groups[0]["lr"], global_step)
+            writer.add_scalar("losses/value_loss", v_loss[i].item(), global_step)
+            writer.add_scalar("losses/policy_loss", pg_loss[i].item(), global_step)
+            writer.add_scalar("losses/entropy", entropy_loss[i].item(), global_step)
+            writer.add_scalar("losses/old_approx_kl", old_approx_kl[i].item(), global_step)
+            writer.add_scalar("losses/approx_kl", approx_kl[i].item(), global_step)
+            writer.add_scalar("losses/clipfrac", clipfracs[i].item(), global_step)
+            writer.add_scalar("losses/explained_variance", explained_var, global_step)
+            writer.add_scalar("charts/update_time", update_time, global_step)
+            writer.add_scalar("charts/StepPerSecond", sps, global_step)
+    envs.close()
+    if video_replayer is not None:
+        video_replayer.close()
+
+    for state_dict, run_name, writer in zip(agent.state_dicts(), run_names, writers):
+        # always saved, `evaluate` loads the agent from the file
+        model_path = f"runs/{run_name}/{args.exp_name}.cleanrl_model"
+        save_tensors(model_path, state_dict)
+        print(f"model saved to {model_path}")
+        episodic_events = evaluate(
+            model_path,
+            partial(make_env, skip_frames=args.skip_frames, preprocessing=args.preprocessing),
+            args.env_id,
+            eval_episodes=100,
+            run_name=f"{run_name}-eval",
+            Model=Agent,
+            device=device,
+            quantize=args.quantized_eval,
+        )
+        for idx, event in enumerate(episodic_events):
+            writer.add_scalar("eval/episodic_return", event['return'], idx)
+            writer.add_scalar("eval/episodic_length", event['length'], idx)
+            writer.add_scalar("eval/episodic_time", event['time'], idx)
+        mean_return = np.mean([event['return'] for event in episodic_events])
+        writer.add_scalar("eval/mean_episodic_return", mean_return)
+        print(f"eval mean episodic return ({run_name}): {mean_return:.2f}")
+        writer.close()
+
 
 if __name__ == "__main__":
     args = tyro.cli(Args)
+    # data parallel with `torchrun --nproc_per_node N ppo_clean_rl.py`: every process collects its own rollouts,
+    # the gradients are averaged and only rank 0 logs, saves and evaluates
+    rank, args.world_size = init_distributed()
+    tuning = None
+    if args.autotune:
+        # every process could choose a different number of minibatches and all-reduces
+        assert args.world_size == 1, "`autotune` is not supported with `torchrun`"
+        tuning = autotune(
+            lambda envs: Agent(envs, precision=args.precision), args, args.autotune_seconds, args.autotune_memory_gb
+        )
+        args.env_backend, args.num_envs, args.num_minibatches = tuning.env_backend, tuning.num_envs, tuning.num_minibatches
+        torch.set_num_threads(tuning.num_threads)
+        print(
+            f"autotune: env_backend={tuning.env_backend}, num_envs={tuning.num_envs}, threads={tuning.num_threads}, "
+            f"num_minibatches={tuning.num_minibatches}, estimated SPS {tuning.estimated_sps:.0f}"
+        )
     args.batch_size = int(args.num_envs * args.num_steps)
     args.minibatch_size = int(args.batch_size // args.num_minibatches)
-    args.num_iterations = args.total_timesteps // args.batch_size
+    args.num_iterations = args.total_timesteps // (args.batch_size * args.world_size)
+    assert args.env_batch_size == 0 or args.env_backend == "pool", "`env_batch_size` requires `--env_backend pool`"
+    if args.num_seeds > 1:
+        train_seeds(args)
+        sys.exit()
+    placement = None
+    if args.cpu_placement:
+        placement = plan_cpu_placement(
+            args.num_envs if args.env_backend in ("async", "pool") else 0,
+            args.env_cores,
+            overlapped=args.pipelined_rollout,
+            # the phases of the placement set the torch threads, at most the ones chosen by the autotuner
+            max_threads=tuning.num_threads if tuning is not None else 0,
+        )
+        placement.pin_learner()
     run_name = f"{args.env_id}__{args.exp_name}__{args.seed}__{time.strftime('%Y%m%d_%H%M%S')}"
-    if args.track:
+    resume_state = None
+    resume_path = find_checkpoint(args.resume, f"runs/{args.env_id}__{args.exp_name}__{args.seed}") if args.resume else None
+    if resume_path is not None:
+        # the resumed run keeps logging into its run directory
+        resume_state = load_checkpoint(resume_path)
+        run_name = resume_state["run_name"]
+        print(f"resuming {run_name} after {resume_state['global_step']} steps from {resume_path}")
+    if args.track and rank == 0:
         import wandb
 
         wandb.init(
@@ -168,101 +457,228 @@ if __name__ == "__main__":
             sync_tensorboard=True,
             config=vars(args),
             name=run_name,
+            id=resume_state.get("wandb_id") if resume_state is not None else None,
+            resume="allow",
             monitor_gym=True,
             save_code=True,
         )
-    writer = SummaryWriter(f"runs/{run_name}")
-    writer.add_text(
-        "hyperparameters",
-        "|param|value|\n|-|-|\n%s" % ("\n".join([f"|{key}|{value}|" for key, value in vars(args).items()])),
-    )
+    # a resumed run drops the events the previous job logged after its checkpoint
+    purge_step = resume_state["global_step"] if resume_state is not None else None
+    writer = SummaryWriter(f"runs/{run_name}", purge_step=purge_step) if rank == 0 else None
+    writers = [writer] if writer is not None else None
+    reporter = RungReporter(args.report_file, args.report_window) if args.report_file and rank == 0 else None
+    checkpoint_writer = CheckpointWriter(f"runs/{run_name}", args.keep_checkpoints) if rank == 0 else None
+    if reporter is not None and resume_state is not None:
+        reporter.returns.extend(resume_state["episode_returns"])
+    if writer is not None:
+        hyperparameters = {
+            **vars(args),
+            **(placement.as_dict() if placement is not None else {}),
+            **(tuning.as_dict() if tuning is not None else {}),
+        }
+        writer.add_text(
+            "hyperparameters",
+            "|param|value|\n|-|-|\n%s" % ("\n".join([f"|{key}|{value}|" for key, value in hyperparameters.items()])),
+        )
+        if tuning is not None:
+            tuning.save(f"runs/{run_name}/autotune.json")
 
     # TRY NOT TO MODIFY: seeding
-    random.seed(args.seed)
-    np.random.seed(args.seed)
-    torch.manual_seed(args.seed)
+    random.seed(args.seed + rank)
+    np.random.seed(args.seed + rank)
+    torch.manual_seed(args.seed + rank)
     torch.backends.cudnn.deterministic = args.torch_deterministic
 
     device = torch.device("cuda" if torch.cuda.is_available() and args.cuda else "cpu")
+    assert device.type == "cpu" or not (args.quantized_rollout or args.quantized_eval), "int8 quantization requires `--no-cuda`"
 
     # env setup
-    envs = gym.vector.SyncVectorEnv(
-        [make_env(args.env_id, i, args.capture_video, run_name) for i in range(args.num_envs)],
+    envs = make_vector_env(
+        args.env_id,
+        args.num_envs,
+        args.capture_video and rank == 0,
+        run_name,
+        skip_frames=args.skip_frames,
+        backend=args.env_backend,
+        batch_size=args.env_batch_size,
+        preprocessing=args.preprocessing,
+        copy=False,
     )
     assert isinstance(envs.single_action_space, gym.spaces.Discrete), "only discrete action space is supported"
+    if placement is not None:
+        placement.pin_env_workers(envs)
+    # renders the videos of the episodes logged by env 0 in a background process
+    video_replayer = VideoReplayer(f"videos/{run_name}") if args.capture_video and rank == 0 else None
+
+    agent = Agent(envs, precision=args.precision).to(device)
+    optimizer = optim.Adam(agent.parameters(), lr=args.learning_rate, eps=1e-5, fused=args.fused_adam)
+    if resume_state is not None:
+        agent.load_state_dict(resume_state["agent"])
+        optimizer.load_state_dict(resume_state["optimizer"])
+    if args.world_size > 1:
+        broadcast_parameters(agent)
+    update_step = PPOUpdate(
+        agent,
+        optimizer,
+        args.max_grad_norm,
+        args.clip_coef,
+        args.ent_coef,
+        args.vf_coef,
+        norm_adv=args.norm_adv,
+        clip_vloss=args.clip_vloss,
+        compile=args.compile_update,
+        distributed=args.world_size > 1,
+    )
+    minibatch_loader = MinibatchLoader(args.minibatch_size, prefetch=args.prefetch_minibatches)
 
-    agent = Agent(envs).to(device)
-    optimizer = optim.Adam(agent.parameters(), lr=args.learning_rate, eps=1e-5)
-
+    stopped = False
     if not args.eval_checkpoint:
 
         # ALGO Logic: Storage setup
-        obs = torch.zeros((args.num_steps, args.num_envs) + envs.single_observation_space.shape).to(device)
-        actions = torch.zeros((args.num_steps, args.num_envs) + envs.single_action_space.shape).to(device)
-        logprobs = torch.zeros((args.num_steps, args.num_envs)).to(device)
-        rewards = torch.zeros((args.num_steps, args.num_envs)).to(device)
-        dones = torch.zeros((args.num_steps, args.num_envs)).to(device)
-        values = torch.zeros((args.num_steps, args.num_envs)).to(device)
+        # the frame stack storage keeps every frame of the stacked observations only once,
+        # the pipelined rollout alternates between two storages
+        storages = [
+            (
+                FrameStackStorage(args.num_steps, args.num_envs, envs.single_observation_space.shape, device),
+                torch.zeros((args.num_steps, args.num_envs) + envs.single_action_space.shape, dtype=torch.long).to(device),
+                torch.zeros((args.num_steps, args.num_envs)).to(device),
+                torch.zeros((args.num_steps, args.num_envs)).to(device),
+                torch.zeros((args.num_steps, args.num_envs)).to(device),
+                torch.zeros((args.num_steps, args.num_envs)).to(device),
+            )
+            for _ in range(2 if args.pipelined_rollout else 1)
+        ]
 
         # TRY NOT TO MODIFY: start the game
-        global_step = 0
-        start_time = time.time()
-        next_obs, _ = envs.reset(seed=args.seed)
-        next_obs = torch.Tensor(next_obs).to(device)
+        global_step = resume_state["global_step"] if resume_state is not None else 0
+        start_iteration = resume_state["iteration"] + 1 if resume_state is not None else 1
+        start_step, start_time = global_step, time.time()
+        # a resumed run seeds its envs from its step, so it does not replay the episodes of the first run
+        next_obs, _ = envs.reset(seed=args.seed + global_step + rank * args.num_envs)
+        next_obs = torch.as_tensor(next_obs).to(device)
         next_done = torch.zeros(args.num_envs).to(device)
+        # the policy that selects the rollout actions: an int8 snapshot of the agent with `quantized_rollout`, a
+        # frozen copy with `pipelined_rollout` (the agent is updated while the rollout runs) or the agent itself
+        if args.quantized_rollout:
+            rollout_policy = QuantizedPolicy(agent, next_obs)
+        elif args.pipelined_rollout:
+            rollout_policy = copy.deepcopy(agent)
+        else:
+            rollout_policy = agent
+        # with both, the fp32 snapshot the int8 policy of every rollout buffer was calibrated from: the rollout is
+        # one update stale, its log-probs and values are recomputed with the snapshot, not with the updated agent
+        behaviour_agents = (
+            [copy.deepcopy(agent) for _ in storages] if args.pipelined_rollout and args.quantized_rollout else None
+        )
+        rollout_executor = ThreadPoolExecutor(max_workers=1) if args.pipelined_rollout else None
+        pending_rollout = None
+        if resume_state is not None and rank == 0:
+            # the envs start new episodes, the random number generators continue where the checkpoint left them
+            # (the other processes of a distributed run start their generators from their seeds again)
+            set_rng_state(resume_state["rng"])
+
+        for iteration in range(start_iteration, args.num_iterations + 1):
+            # the budget of this run (e.g. an ASHA rung) is used up
+            stopped = bool(args.stop_timesteps) and global_step >= args.stop_timesteps
+            if stopped and pending_rollout is not None:
+                # the rollout collected in the background for this iteration is discarded
+                pending_rollout.result()
+            checkpoint_due = args.checkpoint_interval > 0 and (iteration - 1) % args.checkpoint_interval == 0
+            if rank == 0 and (stopped or (checkpoint_due and iteration > start_iteration)):
+                if pending_rollout is not None:
+                    # the rollout running in the background draws from the torch generator, the saved state is the
+                    # one after it
+                    pending_rollout.result()
+                # the state after the update of the previous iteration, the learning rate follows from the iteration
+                # (with `pipelined_rollout` the resumed run collects its first rollout with the updated agent)
+                checkpoint_path = checkpoint_writer.save(
+                    run_name=run_name,
+                    iteration=iteration - 1,
+                    global_step=global_step,
+                    agent=agent.state_dict(),
+                    optimizer=optimizer.state_dict(),
+                    rng=rng_state(),
+                    episode_returns=list(reporter.returns) if reporter is not None else [],
+                    wandb_id=wandb.run.id if args.track else None,
+                )
+                print(f"saving the checkpoint after {global_step} steps to {checkpoint_path}")
+            if stopped:
+                if reporter is not None:
+                    # the reported checkpoint has to be on disk
+                    checkpoint_writer.wait()
+                    reporter.report(global_step, checkpoint=checkpoint_path)
+                break
 
-        for iteration in range(1, args.num_iterations + 1):
             # Annealing the rate if instructed to do so.
             if args.anneal_lr:
                 frac = 1.0 - (iteration - 1.0) / args.num_iterations
                 lrnow = frac * args.learning_rate
                 optimizer.param_groups[0]["lr"] = lrnow
 
-            for step in range(0, args.num_steps):
-                global_step += args.num_envs
-                obs[step] = next_obs
-                dones[step] = next_done
-
-                # ALGO LOGIC: action logic
-                with torch.no_grad():
-                    action, logprob, _, value = agent.get_action_and_value(next_obs)
-                    values[step] = value.flatten()
-                actions[step] = action
-                logprobs[step] = logprob
-
-                # TRY NOT TO MODIFY: execute the game and log data.
-                next_obs, reward, terminations, truncations, infos = envs.step(action.cpu().numpy())
-                next_done = np.logical_or(terminations, truncations)
-                rewards[step] = torch.tensor(reward).to(device).view(-1)
-                next_obs, next_done = torch.Tensor(next_obs).to(device), torch.Tensor(next_done).to(device)
-
-                # terminated is also sent when the space ship gets one hist but the agent still has a live left.
-                # So we check whether "episode" is in infos. But could also check whether "lives" is 0.
-                if (terminations.any() or truncations.any()) and "episode" in infos:
-                    for i in np.argwhere(infos["_episode"]):
-                        print(f"global_step={global_step}, episodic_return={infos['episode']['r'][i]}")
-                        writer.add_scalar("train/episodic_return", infos["episode"]["r"][i], global_step)
-                        writer.add_scalar("train/episodic_length", infos["episode"]["l"][i], global_step)
-                        writer.add_scalar("train/episodic_time",   infos["episode"]["t"][i], global_step)
+            if placement is not None:
+                placement.rollout_phase()
+            obs, actions, logprobs, rewards, dones, values = storage = storages[iteration % len(storages)]
+            if pending_rollout is None:
+                next_obs, next_done, global_step = collect_rollout(
+                    rollout_policy,
+                    envs,
+                    storage,
+                    next_obs,
+                    next_done,
+                    global_step,
+                    args.num_steps,
+                    args.num_envs,
+                    args.env_batch_size,
+                    world_size=args.world_size,
+                    writers=writers,
+                    reporter=reporter,
+                )
+            else:
+                next_obs, next_done, global_step = pending_rollout.result()
+
+            if args.pipelined_rollout and iteration < args.num_iterations:
+                # the next rollout is collected on a background thread with a snapshot of the current agent while
+                # this one is optimized, so every rollout lags one update behind the agent trained on it and the
+                # PPO ratio is taken against the stored log-probs of the snapshot that selected the actions
+                if args.quantized_rollout:
+                    behaviour_agent = behaviour_agents[(iteration + 1) % len(storages)]
+                    behaviour_agent.load_state_dict(agent.state_dict())
+                    rollout_policy = QuantizedPolicy(behaviour_agent, obs[np.random.permutation(args.batch_size)[:64]])
+                else:
+                    rollout_policy.load_state_dict(agent.state_dict())
+                rollout_start = (next_obs, next_done)
+                # stepping the envs overwrites next_obs, the bootstrap value of this rollout uses copies
+                next_obs, next_done = next_obs.clone(), next_done.clone()
+                pending_rollout = rollout_executor.submit(
+                    collect_rollout,
+                    rollout_policy,
+                    envs,
+                    storages[(iteration + 1) % len(storages)],
+                    *rollout_start,
+                    global_step,
+                    args.num_steps,
+                    args.num_envs,
+                    args.env_batch_size,
+                    world_size=args.world_size,
+                    writers=writers,
+                    reporter=reporter,
+                )
+
+            if args.quantized_rollout:
+                # the PPO ratio and GAE use the log-probs and values of the fp32 policy that selected the actions (the
+                # agent itself, or with `pipelined_rollout` its snapshot), not the ones of the int8 copy
+                behaviour_agent = behaviour_agents[iteration % len(storages)] if behaviour_agents is not None else agent
+                recompute_logprobs_and_values(behaviour_agent, obs, actions, logprobs, values, args.minibatch_size)
 
             # bootstrap value if not done
             with torch.no_grad():
                 next_value = agent.get_value(next_obs).reshape(1, -1)
-                advantages = torch.zeros_like(rewards).to(device)
-                lastgaelam = 0
-                for t in reversed(range(args.num_steps)):
-                    if t == args.num_steps - 1:
-                        nextnonterminal = 1.0 - next_done
-                        nextvalues = next_value
-                    else:
-                        nextnonterminal = 1.0 - dones[t + 1]
-                        nextvalues = values[t + 1]
-                    delta = rewards[t] + args.gamma * nextvalues * nextnonterminal - values[t]
-                    advantages[t] = lastgaelam = delta + args.gamma * args.gae_lambda * nextnonterminal * lastgaelam
-                returns = advantages + values
+                advantages, returns = compute_gae(
+                    rewards, values, dones, next_value, next_done, args.gamma, args.gae_lambda, backend=args.gae_backend
+                )
 
             # flatten the batch
-            b_obs = obs.reshape((-1,) + envs.single_observation_space.shape)
+            b_obs = obs  # the stacks are rebuilt when the minibatches are gathered
             b_logprobs = logprobs.reshape(-1)
             b_actions = actions.reshape((-1,) + envs.single_action_space.shape)
             b_advantages = advantages.reshape(-1)
@@ -270,58 +686,32 @@ if __name__ == "__main__":
             b_values = values.reshape(-1)
 
             # Optimizing the policy and value network
+            if placement is not None:
+                placement.update_phase()
+            update_start_time = time.perf_counter()
             b_inds = np.arange(args.batch_size)
             clipfracs = []
             for epoch in range(args.update_epochs):
                 np.random.shuffle(b_inds)
-                for start in range(0, args.batch_size, args.minibatch_size):
-                    end = start + args.minibatch_size
-                    mb_inds = b_inds[start:end]
-
-                    _, newlogprob, entropy, newvalue = agent.get_action_and_value(b_obs[mb_inds], b_actions.long()[mb_inds])
-                    logratio = newlogprob - b_logprobs[mb_inds]
-                    ratio = logratio.exp()
-
-                    with torch.no_grad():
-                        # calculate approx_kl http://joschu.net/blog/kl-approx.html
-                        old_approx_kl = (-logratio).mean()
-                        approx_kl = ((ratio - 1) - logratio).mean()
-                        clipfracs += [((ratio - 1.0).abs() > args.clip_coef).float().mean().item()]
-
-                    mb_advantages = b_advantages[mb_inds]
-                    if args.norm_adv:
-                        mb_advantages = (mb_advantages - mb_advantages.mean()) / (mb_advantages.std() + 1e-8)
-
-                    # Policy loss
-                    pg_loss1 = -mb_advantages * ratio
-                    pg_loss2 = -mb_advantages * torch.clamp(ratio, 1 - args.clip_coef, 1 + args.clip_coef)
-                    pg_loss = torch.max(pg_loss1, pg_loss2).mean()
-
-                    # Value loss
-                    newvalue = newvalue.view(-1)
-                    if args.clip_vloss:
-                        v_loss_unclipped = (newvalue - b_returns[mb_inds]) ** 2
-                        v_clipped = b_values[mb_inds] + torch.clamp(
-                            newvalue - b_values[mb_inds],
-                            -args.clip_coef,
-                            args.clip_coef,
-                        )
-                        v_loss_clipped = (v_clipped - b_returns[mb_inds]) ** 2
-                        v_loss_max = torch.max(v_loss_unclipped, v_loss_clipped)
-                        v_loss = 0.5 * v_loss_max.mean()
-                    else:
-                        v_loss = 0.5 * ((newvalue - b_returns[mb_inds]) ** 2).mean()
-
-                    entropy_loss = entropy.mean()
-                    loss = pg_loss - args.ent_coef * entropy_loss + v_loss * args.vf_coef
-
-                    optimizer.zero_grad()
-                    loss.backward()
-                    nn.utils.clip_grad_norm_(agent.parameters(), args.max_grad_norm)
-                    optimizer.step()
-
-                if args.target_kl is not None and approx_kl > args.target_kl:
-                    break
+                for minibatch in minibatch_loader(b_inds, b_obs, b_actions, b_logprobs, b_advantages, b_returns, b_values):
+                    pg_loss, v_loss, entropy_loss, old_approx_kl, approx_kl, clipfrac = update_step(*minibatch)
+                    clipfracs += [clipfrac.item()]
+
+                if args.target_kl is not None:
+                    # all processes have to stop after the same epoch, they all-reduce every gradient
+                    if args.world_size > 1:
+                        approx_kl = all_reduce_mean(approx_kl)
+                    if approx_kl > args.target_kl:
+                        break
+
+            update_time = time.perf_counter() - update_start_time
+            if args.quantized_rollout and not args.pipelined_rollout:
+                # calibrated on 64 random observations of the last rollout
+                rollout_policy = QuantizedPolicy(agent, b_obs[b_inds[:64]])
+            if rank != 0:
+                continue
+            if iteration == 1 and update_step.compile_time is not None:
+                print(f"compiled the update step in {update_step.compile_time:.1f}s")
 
             y_pred, y_true = b_values.cpu().numpy(), b_returns.cpu().numpy()
             var_y = np.var(y_true)
@@ -336,34 +726,47 @@ if __name__ == "__main__":
             writer.add_scalar("losses/approx_kl", approx_kl.item(), global_step)
             writer.add_scalar("losses/clipfrac", np.mean(clipfracs), global_step)
             writer.add_scalar("losses/explained_variance", explained_var, global_step)
-            print("SPS:", int(global_step / (time.time() - start_time)))
-            writer.add_scalar("charts/StepPerSecond", int(global_step / (time.time() - start_time)), global_step)
-
-        if args.save_model:
+            writer.add_scalar("charts/update_time", update_time, global_step)
+            print("SPS:", int((global_step - start_step) / (time.time() - start_time)))
+            writer.add_scalar("charts/StepPerSecond", int((global_step - start_step) / (time.time() - start_time)), global_step)
+            if reporter is not None:
+                reporter.report(global_step)
+
+        if checkpoint_writer is not None:
+            checkpoint_writer.close()
+            if not stopped:
+                # the run is complete, `resume auto` starts a new one
+                for checkpoint_path in list_checkpoints(f"runs/{run_name}"):
+                    os.remove(checkpoint_path)
+        if args.save_model and rank == 0 and not stopped:
             model_path = f"runs/{run_name}/{args.exp_name}.cleanrl_model"
-            torch.save(agent.state_dict(), model_path)
+            save_tensors(model_path, agent.state_dict())
 
             print(f"model saved to {model_path}")
         
-    model_path = args.eval_checkpoint if args.eval_checkpoint else model_path
-    episodic_events = evaluate(
-        model_path,
-        make_env,
-        args.env_id,
-        eval_episodes=100,
-        run_name=f"{run_name}-eval",
-        Model=Agent,
-        device=device,
-    )
+    if rank == 0 and not stopped:
+        model_path = args.eval_checkpoint if args.eval_checkpoint else model_path
+        episodic_events = evaluate(
+            model_path,
+            partial(make_env, skip_frames=args.skip_frames, preprocessing=args.preprocessing),
+            args.env_id,
+            eval_episodes=100,
+            run_name=f"{run_name}-eval",
+            Model=Agent,
+            device=device,
+            quantize=args.quantized_eval,
+        )
 
-    for idx, event in enumerate(episodic_events):
-        writer.add_scalar("eval/episodic_return", event['return'], idx)
-        writer.add_scalar("eval/episodic_length", event['length'], idx)
-        writer.add_scalar("eval/episodic_time", event['time'], idx)
-    
-    try:
+        for idx, event in enumerate(episodic_events):
+            writer.add_scalar("eval/episodic_return", event['return'], idx)
+            writer.add_scalar("eval/episodic_length", event['length'], idx)
+            writer.add_scalar("eval/episodic_time", event['time'], idx)
+        mean_return = np.mean([event['return'] for event in episodic_events])
+        writer.add_scalar("eval/mean_episodic_return", mean_return)
+        print(f"eval mean episodic return ({args.precision}): {mean_return:.2f}")
         writer.close()
-        envs.close()
-    except:
-        # somehow this code throws an "AttributeError: 'RecordVideo' object has no attribute 'enabled'" when running the evaluation code
-        pass
\ No newline at end of file
+    envs.close()
+    if video_replayer is not None:
+        video_replayer.close()
+    if args.world_size > 1:
+        dist.destroy_process_group()
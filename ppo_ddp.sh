@@ -0,0 +1,14 @@
+#!/bin/sh
+#SBATCH --time=6:00:00 # never more than 6 hours
+#SBATCH --nodes=2  # one data-parallel process per node
+#SBATCH --ntasks-per-node=1
+#SBATCH --cpus-per-task=16  # must match num_env, never more than 16
+#SBATCH --gres=gpu:0  # never more than 0
+#SBATCH --partition=performance # do not change
+#SBATCH --output=out/ppo-ddp-%A_%a.out
+#SBATCH --error=out/ppo-ddp-%A_%a.err
+
+head_node=$(scontrol show hostnames "$SLURM_JOB_NODELIST" | head -n 1)
+srun .venv/bin/torchrun --nnodes "$SLURM_NNODES" --nproc_per_node 1 \
+    --rdzv_backend c10d --rdzv_endpoint "$head_node:29500" --rdzv_id "$SLURM_JOB_ID" \
+    ppo_clean_rl.py --track --exp_name ppo_ddp --env_backend async
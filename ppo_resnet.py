@@ -1,8 +1,11 @@
 # docs and experiment results can be found at https://docs.cleanrl.dev/rl-algorithms/ppo/#ppo_ataripy
+import copy
 import os
 import random
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from functools import partial
 
 import gymnasium as gym
 import ale_py
@@ -13,15 +16,29 @@ import torch.optim as optim
 import tyro
 from torch.distributions.categorical import Categorical
 from torch.utils.tensorboard import SummaryWriter
-from rle_assignment.ppo_eval import evaluate
-
-from stable_baselines3.common.atari_wrappers import (  # isort:skip
-    ClipRewardEnv,
-    EpisodicLifeEnv,
-    FireResetEnv,
-    MaxAndSkipEnv,
-    NoopResetEnv,
+from rle_assignment.asha import RungReporter
+from rle_assignment.autotune import autotune
+from rle_assignment.checkpoint import (
+    CheckpointWriter,
+    find_checkpoint,
+    list_checkpoints,
+    load_checkpoint,
+    rng_state,
+    save_tensors,
+    set_rng_state,
 )
+from rle_assignment.gae import GaeBackend, compute_gae
+from rle_assignment.layers import Precision, ScaledConv2d, autocast
+from rle_assignment.minibatch import MinibatchLoader
+from rle_assignment.placement import plan_cpu_placement
+from rle_assignment.policy import sample_categorical
+from rle_assignment.ppo import PPOUpdate, recompute_logprobs_and_values
+from rle_assignment.ppo_eval import evaluate
+from rle_assignment.quantization import QuantizedPolicy
+from rle_assignment.rollout import collect_rollout
+from rle_assignment.rollout_storage import FrameStackStorage
+from rle_assignment.vector_env import Backend, Preprocessing, make_env, make_vector_env
+from rle_assignment.video import VideoReplayer
 
 import torchvision.models as models
 
@@ -64,6 +81,10 @@ class Args:
     """the learning rate of the optimizer"""
     num_envs: int = 16
     """the number of parallel game environments"""
+    env_backend: Backend = "sync"
+    """the vector env backend: `sync` (single process), `async` (one worker process per env, shared memory), `pool` (like `async`, supports `env_batch_size`) or `native` (C++ vector env of ale_py)"""
+    env_batch_size: int = 0
+    """if > 0, each rollout step only waits for the first `env_batch_size` ready envs (requires `--env_backend pool`)"""
     num_steps: int = 128
     """the number of steps to run in each environment per policy rollout"""
     anneal_lr: bool = True
@@ -72,6 +93,8 @@ class Args:
     """the discount factor gamma"""
     gae_lambda: float = 0.95
     """the lambda for the general advantage estimation"""
+    gae_backend: GaeBackend = "cumsum"
+    """the implementation of the advantage computation: `cumsum` (chunked discounted cumulative sum), `loop` (Python loop), `torchscript` (deprecated `torch.jit.script`) or `numba`"""
     num_minibatches: int = 4
     """the number of mini-batches"""
     update_epochs: int = 4
@@ -90,6 +113,46 @@ class Args:
     """the maximum norm for the gradient clipping"""
     target_kl: float = None
     """the target KL divergence threshold"""
+    prefetch_minibatches: bool = True
+    """gather the observations of the next minibatch on a background thread while the current one is optimized"""
+    compile_update: bool = False
+    """compile the forward, loss and backward of the PPO update with `torch.compile` (falls back to eager mode if it fails)"""
+    fused_adam: bool = False
+    """use the fused implementation of Adam for the optimizer step"""
+    precision: Precision = "fp32"
+    """the precision of the network forward and backward: `fp32` or `bf16` (CPU autocast, the weights, losses and advantages stay fp32)"""
+    quantized_rollout: bool = False
+    """select the rollout actions with an int8 quantized snapshot of the agent (CPU only), refreshed after every update phase"""
+    quantized_eval: bool = False
+    """evaluate with an int8 quantized snapshot of the trained agent (CPU only)"""
+    pipelined_rollout: bool = False
+    """collect the next rollout on a background thread with a snapshot of the agent while the current one is optimized (policy lag of one update)"""
+    cpu_placement: bool = False
+    """pin the env worker processes (`async`/`pool` backends) to their own cores and the learner to the remaining cores during the rollout and all cores during the update (no effect with the `sync` and `native` backends)"""
+    env_cores: int = 0
+    """the number of cores for the env workers with `cpu_placement` (0: one core per worker, leaving at least one core to torch)"""
+    autotune: bool = False
+    """measure the env, inference and update times before training and choose `env_backend`, `num_envs`, the torch threads and `num_minibatches` with the highest estimated SPS (saved as `autotune.json` in the run directory)"""
+    autotune_seconds: float = 60.0
+    """the time budget of all `autotune` measurements including the start of the envs, configurations not measured within it are not chosen"""
+    autotune_memory_gb: float = 8.0
+    """the memory cap of the configurations `autotune` chooses from"""
+    resume: str = None
+    """if set, continue the run of this checkpoint or run directory, with `auto` the newest run of this `env_id`, `exp_name` and `seed` that has a checkpoint (a new run if there is none)"""
+    checkpoint_interval: int = 0
+    """if > 0, save the training state to `runs/{run_name}/checkpoint_{global_step}.safetensors` every `checkpoint_interval` iterations (on a background thread), so a preempted run can continue with `resume`"""
+    keep_checkpoints: int = 2
+    """the number of the newest checkpoints kept on disk (0: all)"""
+    stop_timesteps: int = 0
+    """if > 0, stop after this many of the `total_timesteps` and save a checkpoint to continue from with `resume` (the learning rate schedule stays the one of `total_timesteps`)"""
+    report_file: str = None
+    """if set, append the global step and the rolling mean of the training episodic returns to this JSON lines file after every iteration (the rungs of `rle_assignment/asha.py`)"""
+    report_window: int = 20
+    """the number of training episodes of the rolling mean return of `report_file`"""
+    skip_frames: int = 4
+    """the number of emulator frames each action is repeated (total action repeat)"""
+    preprocessing: Preprocessing = "fused"
+    """the Atari preprocessing: `fused` (single in-place wrapper) or `legacy` (separate gymnasium/SB3 wrappers)"""
 
     # to be filled in runtime
     batch_size: int = 0
@@ -100,28 +163,6 @@ class Args:
     """the number of iterations (computed in runtime)"""
 
 
-def make_env(env_id, idx, capture_video, run_name):
-    def thunk():
-        if capture_video and idx == 0:
-            env = gym.make(env_id, render_mode="rgb_array")
-            env = gym.wrappers.RecordVideo(env, f"videos/{run_name}")
-        else:
-            env = gym.make(env_id)
-        env = gym.wrappers.RecordEpisodeStatistics(env)
-        env = NoopResetEnv(env, noop_max=30)
-        env = MaxAndSkipEnv(env, skip=4)
-        env = EpisodicLifeEnv(env)
-        if "FIRE" in env.unwrapped.get_action_meanings():
-            env = FireResetEnv(env)
-        env = ClipRewardEnv(env)
-        env = gym.wrappers.ResizeObservation(env, (84, 84))
-        env = gym.wrappers.GrayscaleObservation(env)
-        env = gym.wrappers.FrameStackObservation(env, 4)
-        return env
-
-    return thunk
-
-
 def layer_init(layer, std=np.sqrt(2), bias_const=0.0):
     torch.nn.init.orthogonal_(layer.weight, std)
     torch.nn.init.constant_(layer.bias, bias_const)
@@ -129,12 +170,18 @@ def layer_init(layer, std=np.sqrt(2), bias_const=0.0):
 
 
 class Agent(nn.Module):
-    def __init__(self, envs, pretrained_weights = False):
+    def __init__(self, envs, pretrained_weights = False, precision: Precision = "fp32"):
         super().__init__()
         self.pretrained_weights = pretrained_weights
+        self.precision = precision
         # Initialize ResNet18 and modify first conv layer to accept 4 channels
         resnet = models.resnet18(weights=models.ResNet18_Weights.DEFAULT if self.pretrained_weights else None)
-        resnet.conv1 = nn.Conv2d(4, 64, kernel_size=(7, 7), stride=(2, 2), padding=(3, 3), bias=False)
+        # the first conv normalizes the uint8 frames itself (with the ImageNet statistics for the pretrained weights)
+        if self.pretrained_weights:
+            scale, shift = 1 / (255.0 * 0.226), -0.449 / 0.226
+        else:
+            scale, shift = 1 / 255.0, 0.0
+        resnet.conv1 = ScaledConv2d(4, 64, kernel_size=(7, 7), stride=(2, 2), padding=(3, 3), bias=False, scale=scale, shift=shift)
         
         # Remove the final avgpool and fc layers
         self.network = nn.Sequential(
@@ -148,30 +195,69 @@ class Agent(nn.Module):
         self.actor = layer_init(nn.Linear(512, envs.single_action_space.n), std=0.01)
         self.critic = layer_init(nn.Linear(512, 1), std=1)
 
-    def transform_input(self, x):
-        if not self.pretrained_weights:
-            return x / 255.0
-        else:
-            return ((x / 255.0) - 0.449) / 0.226
+    def features(self, x):
+        # only the network runs in `self.precision`, the actor and critic heads and everything after them stay fp32
+        with autocast(x, self.precision):
+            return self.network(x).float()
 
     def get_value(self, x):
-        return self.critic(self.network(self.transform_input(x)))
+        return self.critic(self.features(x))
 
     def get_action_and_value(self, x, action=None):
-        hidden = self.network(self.transform_input(x))
+        hidden = self.features(x)
         logits = self.actor(hidden)
         probs = Categorical(logits=logits)
         if action is None:
             action = probs.sample()
         return action, probs.log_prob(action), probs.entropy(), self.critic(hidden)
 
+    @torch.inference_mode()
+    def act(self, x, action=None, logprob=None, value=None):
+        """
+        Rollout fast path of `get_action_and_value`: samples the actions without building a distribution and
+        computing the entropy, and writes the actions, their log-probs and the values into the given tensors.
+        """
+        hidden = self.features(x)
+        action, logprob = sample_categorical(self.actor(hidden), action, logprob)
+        value = self.critic(hidden).flatten() if value is None else value.copy_(self.critic(hidden).flatten())
+        return action, logprob, value
+
 
 if __name__ == "__main__":
     args = tyro.cli(Args)
+    tuning = None
+    if args.autotune:
+        tuning = autotune(
+            lambda envs: Agent(envs, args.pretrained_weights, precision=args.precision), args, args.autotune_seconds, args.autotune_memory_gb
+        )
+        args.env_backend, args.num_envs, args.num_minibatches = tuning.env_backend, tuning.num_envs, tuning.num_minibatches
+        torch.set_num_threads(tuning.num_threads)
+        print(
+            f"autotune: env_backend={tuning.env_backend}, num_envs={tuning.num_envs}, threads={tuning.num_threads}, "
+            f"num_minibatches={tuning.num_minibatches}, estimated SPS {tuning.estimated_sps:.0f}"
+        )
     args.batch_size = int(args.num_envs * args.num_steps)
     args.minibatch_size = int(args.batch_size // args.num_minibatches)
     args.num_iterations = args.total_timesteps // args.batch_size
+    assert args.env_batch_size == 0 or args.env_backend == "pool", "`env_batch_size` requires `--env_backend pool`"
+    placement = None
+    if args.cpu_placement:
+        placement = plan_cpu_placement(
+            args.num_envs if args.env_backend in ("async", "pool") else 0,
+            args.env_cores,
+            overlapped=args.pipelined_rollout,
+            # the phases of the placement set the torch threads, at most the ones chosen by the autotuner
+            max_threads=tuning.num_threads if tuning is not None else 0,
+        )
+        placement.pin_learner()
     run_name = f"{args.env_id}__{args.exp_name}__{args.seed}__{time.strftime('%Y%m%d_%H%M%S')}"
+    resume_state = None
+    resume_path = find_checkpoint(args.resume, f"runs/{args.env_id}__{args.exp_name}__{args.seed}") if args.resume else None
+    if resume_path is not None:
+        # the resumed run keeps logging into its run directory
+        resume_state = load_checkpoint(resume_path)
+        run_name = resume_state["run_name"]
+        print(f"resuming {run_name} after {resume_state['global_step']} steps from {resume_path}")
     if args.track:
         import wandb
 
@@ -181,14 +267,29 @@ if __name__ == "__main__":
             sync_tensorboard=True,
             config=vars(args),
             name=run_name,
+            id=resume_state.get("wandb_id") if resume_state is not None else None,
+            resume="allow",
             monitor_gym=True,
             save_code=True,
         )
-    writer = SummaryWriter(f"runs/{run_name}")
+    # a resumed run drops the events the previous job logged after its checkpoint
+    purge_step = resume_state["global_step"] if resume_state is not None else None
+    writer = SummaryWriter(f"runs/{run_name}", purge_step=purge_step)
+    reporter = RungReporter(args.report_file, args.report_window) if args.report_file else None
+    checkpoint_writer = CheckpointWriter(f"runs/{run_name}", args.keep_checkpoints)
+    if reporter is not None and resume_state is not None:
+        reporter.returns.extend(resume_state["episode_returns"])
+    hyperparameters = {
+        **vars(args),
+        **(placement.as_dict() if placement is not None else {}),
+        **(tuning.as_dict() if tuning is not None else {}),
+    }
     writer.add_text(
         "hyperparameters",
-        "|param|value|\n|-|-|\n%s" % ("\n".join([f"|{key}|{value}|" for key, value in vars(args).items()])),
+        "|param|value|\n|-|-|\n%s" % ("\n".join([f"|{key}|{value}|" for key, value in hyperparameters.items()])),
     )
+    if tuning is not None:
+        tuning.save(f"runs/{run_name}/autotune.json")
 
     # TRY NOT TO MODIFY: seeding
     random.seed(args.seed)
@@ -197,85 +298,189 @@ if __name__ == "__main__":
     torch.backends.cudnn.deterministic = args.torch_deterministic
 
     device = torch.device("cuda" if torch.cuda.is_available() and args.cuda else "cpu")
+    assert device.type == "cpu" or not (args.quantized_rollout or args.quantized_eval), "int8 quantization requires `--no-cuda`"
 
     # env setup
-    envs = gym.vector.SyncVectorEnv(
-        [make_env(args.env_id, i, args.capture_video, run_name) for i in range(args.num_envs)],
+    envs = make_vector_env(
+        args.env_id,
+        args.num_envs,
+        args.capture_video,
+        run_name,
+        skip_frames=args.skip_frames,
+        backend=args.env_backend,
+        batch_size=args.env_batch_size,
+        preprocessing=args.preprocessing,
+        copy=False,
     )
     assert isinstance(envs.single_action_space, gym.spaces.Discrete), "only discrete action space is supported"
+    if placement is not None:
+        placement.pin_env_workers(envs)
+    # renders the videos of the episodes logged by env 0 in a background process
+    video_replayer = VideoReplayer(f"videos/{run_name}") if args.capture_video else None
+
+    agent = Agent(envs, args.pretrained_weights, precision=args.precision).to(device)
+    optimizer = optim.Adam(agent.parameters(), lr=args.learning_rate, eps=1e-5, fused=args.fused_adam)
+    if resume_state is not None:
+        agent.load_state_dict(resume_state["agent"])
+        optimizer.load_state_dict(resume_state["optimizer"])
+    update_step = PPOUpdate(
+        agent,
+        optimizer,
+        args.max_grad_norm,
+        args.clip_coef,
+        args.ent_coef,
+        args.vf_coef,
+        norm_adv=args.norm_adv,
+        clip_vloss=args.clip_vloss,
+        compile=args.compile_update,
+    )
+    minibatch_loader = MinibatchLoader(args.minibatch_size, prefetch=args.prefetch_minibatches)
 
-    agent = Agent(envs, args.pretrained_weights).to(device)
-    optimizer = optim.Adam(agent.parameters(), lr=args.learning_rate, eps=1e-5)
-
+    stopped = False
     if not args.eval_checkpoint:
 
         # ALGO Logic: Storage setup
-        obs = torch.zeros((args.num_steps, args.num_envs) + envs.single_observation_space.shape).to(device)
-        actions = torch.zeros((args.num_steps, args.num_envs) + envs.single_action_space.shape).to(device)
-        logprobs = torch.zeros((args.num_steps, args.num_envs)).to(device)
-        rewards = torch.zeros((args.num_steps, args.num_envs)).to(device)
-        dones = torch.zeros((args.num_steps, args.num_envs)).to(device)
-        values = torch.zeros((args.num_steps, args.num_envs)).to(device)
+        # the frame stack storage keeps every frame of the stacked observations only once,
+        # the pipelined rollout alternates between two storages
+        storages = [
+            (
+                FrameStackStorage(args.num_steps, args.num_envs, envs.single_observation_space.shape, device),
+                torch.zeros((args.num_steps, args.num_envs) + envs.single_action_space.shape, dtype=torch.long).to(device),
+                torch.zeros((args.num_steps, args.num_envs)).to(device),
+                torch.zeros((args.num_steps, args.num_envs)).to(device),
+                torch.zeros((args.num_steps, args.num_envs)).to(device),
+                torch.zeros((args.num_steps, args.num_envs)).to(device),
+            )
+            for _ in range(2 if args.pipelined_rollout else 1)
+        ]
 
         # TRY NOT TO MODIFY: start the game
-        global_step = 0
-        start_time = time.time()
-        next_obs, _ = envs.reset(seed=args.seed)
-        next_obs = torch.Tensor(next_obs).to(device)
+        global_step = resume_state["global_step"] if resume_state is not None else 0
+        start_iteration = resume_state["iteration"] + 1 if resume_state is not None else 1
+        start_step, start_time = global_step, time.time()
+        # a resumed run seeds its envs from its step, so it does not replay the episodes of the first run
+        next_obs, _ = envs.reset(seed=args.seed + global_step)
+        next_obs = torch.as_tensor(next_obs).to(device)
         next_done = torch.zeros(args.num_envs).to(device)
+        # the policy that selects the rollout actions: an int8 snapshot of the agent with `quantized_rollout`, a
+        # frozen copy with `pipelined_rollout` (the agent is updated while the rollout runs) or the agent itself
+        if args.quantized_rollout:
+            rollout_policy = QuantizedPolicy(agent, next_obs)
+        elif args.pipelined_rollout:
+            rollout_policy = copy.deepcopy(agent)
+        else:
+            rollout_policy = agent
+        # with both, the fp32 snapshot the int8 policy of every rollout buffer was calibrated from: the rollout is
+        # one update stale, its log-probs and values are recomputed with the snapshot, not with the updated agent
+        behaviour_agents = (
+            [copy.deepcopy(agent) for _ in storages] if args.pipelined_rollout and args.quantized_rollout else None
+        )
+        rollout_executor = ThreadPoolExecutor(max_workers=1) if args.pipelined_rollout else None
+        pending_rollout = None
+        if resume_state is not None:
+            # the envs start new episodes, the random number generators continue where the checkpoint left them
+            set_rng_state(resume_state["rng"])
+
+        for iteration in range(start_iteration, args.num_iterations + 1):
+            # the budget of this run (e.g. an ASHA rung) is used up
+            stopped = bool(args.stop_timesteps) and global_step >= args.stop_timesteps
+            if stopped and pending_rollout is not None:
+                # the rollout collected in the background for this iteration is discarded
+                pending_rollout.result()
+            checkpoint_due = args.checkpoint_interval > 0 and (iteration - 1) % args.checkpoint_interval == 0
+            if stopped or (checkpoint_due and iteration > start_iteration):
+                if pending_rollout is not None:
+                    # the rollout running in the background draws from the torch generator, the saved state is the
+                    # one after it
+                    pending_rollout.result()
+                # the state after the update of the previous iteration, the learning rate follows from the iteration
+                # (with `pipelined_rollout` the resumed run collects its first rollout with the updated agent)
+                checkpoint_path = checkpoint_writer.save(
+                    run_name=run_name,
+                    iteration=iteration - 1,
+                    global_step=global_step,
+                    agent=agent.state_dict(),
+                    optimizer=optimizer.state_dict(),
+                    rng=rng_state(),
+                    episode_returns=list(reporter.returns) if reporter is not None else [],
+                    wandb_id=wandb.run.id if args.track else None,
+                )
+                print(f"saving the checkpoint after {global_step} steps to {checkpoint_path}")
+            if stopped:
+                if reporter is not None:
+                    # the reported checkpoint has to be on disk
+                    checkpoint_writer.wait()
+                    reporter.report(global_step, checkpoint=checkpoint_path)
+                break
 
-        for iteration in range(1, args.num_iterations + 1):
             # Annealing the rate if instructed to do so.
             if args.anneal_lr:
                 frac = 1.0 - (iteration - 1.0) / args.num_iterations
                 lrnow = frac * args.learning_rate
                 optimizer.param_groups[0]["lr"] = lrnow
 
-            for step in range(0, args.num_steps):
-                global_step += args.num_envs
-                obs[step] = next_obs
-                dones[step] = next_done
-
-                # ALGO LOGIC: action logic
-                with torch.no_grad():
-                    action, logprob, _, value = agent.get_action_and_value(next_obs)
-                    values[step] = value.flatten()
-                actions[step] = action
-                logprobs[step] = logprob
-
-                # TRY NOT TO MODIFY: execute the game and log data.
-                next_obs, reward, terminations, truncations, infos = envs.step(action.cpu().numpy())
-                next_done = np.logical_or(terminations, truncations)
-                rewards[step] = torch.tensor(reward).to(device).view(-1)
-                next_obs, next_done = torch.Tensor(next_obs).to(device), torch.Tensor(next_done).to(device)
-
-                # terminated is also sent when the space ship gets one hist but the agent still has a live left.
-                # So we check whether "episode" is in infos. But could also check whether "lives" is 0.
-                if (terminations.any() or truncations.any()) and "episode" in infos:
-                    for i in np.argwhere(infos["_episode"]):
-                        print(f"global_step={global_step}, episodic_return={infos['episode']['r'][i]}")
-                        writer.add_scalar("train/episodic_return", infos["episode"]["r"][i], global_step)
-                        writer.add_scalar("train/episodic_length", infos["episode"]["l"][i], global_step)
-                        writer.add_scalar("train/episodic_time",   infos["episode"]["t"][i], global_step)
+            if placement is not None:
+                placement.rollout_phase()
+            obs, actions, logprobs, rewards, dones, values = storage = storages[iteration % len(storages)]
+            if pending_rollout is None:
+                next_obs, next_done, global_step = collect_rollout(
+                    rollout_policy,
+                    envs,
+                    storage,
+                    next_obs,
+                    next_done,
+                    global_step,
+                    args.num_steps,
+                    args.num_envs,
+                    args.env_batch_size,
+                    writers=[writer],
+                    reporter=reporter,
+                )
+            else:
+                next_obs, next_done, global_step = pending_rollout.result()
+
+            if args.pipelined_rollout and iteration < args.num_iterations:
+                # the next rollout is collected on a background thread with a snapshot of the current agent while
+                # this one is optimized, so every rollout lags one update behind the agent trained on it and the
+                # PPO ratio is taken against the stored log-probs of the snapshot that selected the actions
+                if args.quantized_rollout:
+                    behaviour_agent = behaviour_agents[(iteration + 1) % len(storages)]
+                    behaviour_agent.load_state_dict(agent.state_dict())
+                    rollout_policy = QuantizedPolicy(behaviour_agent, obs[np.random.permutation(args.batch_size)[:64]])
+                else:
+                    rollout_policy.load_state_dict(agent.state_dict())
+                rollout_start = (next_obs, next_done)
+                # stepping the envs overwrites next_obs, the bootstrap value of this rollout uses copies
+                next_obs, next_done = next_obs.clone(), next_done.clone()
+                pending_rollout = rollout_executor.submit(
+                    collect_rollout,
+                    rollout_policy,
+                    envs,
+                    storages[(iteration + 1) % len(storages)],
+                    *rollout_start,
+                    global_step,
+                    args.num_steps,
+                    args.num_envs,
+                    args.env_batch_size,
+                    writers=[writer],
+                    reporter=reporter,
+                )
+
+            if args.quantized_rollout:
+                # the PPO ratio and GAE use the log-probs and values of the fp32 policy that selected the actions (the
+                # agent itself, or with `pipelined_rollout` its snapshot), not the ones of the int8 copy
+                behaviour_agent = behaviour_agents[iteration % len(storages)] if behaviour_agents is not None else agent
+                recompute_logprobs_and_values(behaviour_agent, obs, actions, logprobs, values, args.minibatch_size)
 
             # bootstrap value if not done
             with torch.no_grad():
                 next_value = agent.get_value(next_obs).reshape(1, -1)
-                advantages = torch.zeros_like(rewards).to(device)
-                lastgaelam = 0
-                for t in reversed(range(args.num_steps)):
-                    if t == args.num_steps - 1:
-                        nextnonterminal = 1.0 - next_done
-                        nextvalues = next_value
-                    else:
-                        nextnonterminal = 1.0 - dones[t + 1]
-                        nextvalues = values[t + 1]
-                    delta = rewards[t] + args.gamma * nextvalues * nextnonterminal - values[t]
-                    advantages[t] = lastgaelam = delta + args.gamma * args.gae_lambda * nextnonterminal * lastgaelam
-                returns = advantages + values
+                advantages, returns = compute_gae(
+                    rewards, values, dones, next_value, next_done, args.gamma, args.gae_lambda, backend=args.gae_backend
+                )
 
             # flatten the batch
-            b_obs = obs.reshape((-1,) + envs.single_observation_space.shape)
+            b_obs = obs  # the stacks are rebuilt when the minibatches are gathered
             b_logprobs = logprobs.reshape(-1)
             b_actions = actions.reshape((-1,) + envs.single_action_space.shape)
             b_advantages = advantages.reshape(-1)
@@ -283,59 +488,27 @@ if __name__ == "__main__":
             b_values = values.reshape(-1)
 
             # Optimizing the policy and value network
+            if placement is not None:
+                placement.update_phase()
+            update_start_time = time.perf_counter()
             b_inds = np.arange(args.batch_size)
             clipfracs = []
             for epoch in range(args.update_epochs):
                 np.random.shuffle(b_inds)
-                for start in range(0, args.batch_size, args.minibatch_size):
-                    end = start + args.minibatch_size
-                    mb_inds = b_inds[start:end]
-
-                    _, newlogprob, entropy, newvalue = agent.get_action_and_value(b_obs[mb_inds], b_actions.long()[mb_inds])
-                    logratio = newlogprob - b_logprobs[mb_inds]
-                    ratio = logratio.exp()
-
-                    with torch.no_grad():
-                        # calculate approx_kl http://joschu.net/blog/kl-approx.html
-                        old_approx_kl = (-logratio).mean()
-                        approx_kl = ((ratio - 1) - logratio).mean()
-                        clipfracs += [((ratio - 1.0).abs() > args.clip_coef).float().mean().item()]
-
-                    mb_advantages = b_advantages[mb_inds]
-                    if args.norm_adv:
-                        mb_advantages = (mb_advantages - mb_advantages.mean()) / (mb_advantages.std() + 1e-8)
-
-                    # Policy loss
-                    pg_loss1 = -mb_advantages * ratio
-                    pg_loss2 = -mb_advantages * torch.clamp(ratio, 1 - args.clip_coef, 1 + args.clip_coef)
-                    pg_loss = torch.max(pg_loss1, pg_loss2).mean()
-
-                    # Value loss
-                    newvalue = newvalue.view(-1)
-                    if args.clip_vloss:
-                        v_loss_unclipped = (newvalue - b_returns[mb_inds]) ** 2
-                        v_clipped = b_values[mb_inds] + torch.clamp(
-                            newvalue - b_values[mb_inds],
-                            -args.clip_coef,
-                            args.clip_coef,
-                        )
-                        v_loss_clipped = (v_clipped - b_returns[mb_inds]) ** 2
-                        v_loss_max = torch.max(v_loss_unclipped, v_loss_clipped)
-                        v_loss = 0.5 * v_loss_max.mean()
-                    else:
-                        v_loss = 0.5 * ((newvalue - b_returns[mb_inds]) ** 2).mean()
-
-                    entropy_loss = entropy.mean()
-                    loss = pg_loss - args.ent_coef * entropy_loss + v_loss * args.vf_coef
-
-                    optimizer.zero_grad()
-                    loss.backward()
-                    nn.utils.clip_grad_norm_(agent.parameters(), args.max_grad_norm)
-                    optimizer.step()
+                for minibatch in minibatch_loader(b_inds, b_obs, b_actions, b_logprobs, b_advantages, b_returns, b_values):
+                    pg_loss, v_loss, entropy_loss, old_approx_kl, approx_kl, clipfrac = update_step(*minibatch)
+                    clipfracs += [clipfrac.item()]
 
                 if args.target_kl is not None and approx_kl > args.target_kl:
                     break
 
+            update_time = time.perf_counter() - update_start_time
+            if args.quantized_rollout and not args.pipelined_rollout:
+                # calibrated on 64 random observations of the last rollout
+                rollout_policy = QuantizedPolicy(agent, b_obs[b_inds[:64]])
+            if iteration == 1 and update_step.compile_time is not None:
+                print(f"compiled the update step in {update_step.compile_time:.1f}s")
+
             y_pred, y_true = b_values.cpu().numpy(), b_returns.cpu().numpy()
             var_y = np.var(y_true)
             explained_var = np.nan if var_y == 0 else 1 - np.var(y_true - y_pred) / var_y
@@ -349,34 +522,45 @@ if __name__ == "__main__":
             writer.add_scalar("losses/approx_kl", approx_kl.item(), global_step)
             writer.add_scalar("losses/clipfrac", np.mean(clipfracs), global_step)
             writer.add_scalar("losses/explained_variance", explained_var, global_step)
-            print("SPS:", int(global_step / (time.time() - start_time)))
-            writer.add_scalar("charts/StepPerSecond", int(global_step / (time.time() - start_time)), global_step)
-
-        if args.save_model:
+            writer.add_scalar("charts/update_time", update_time, global_step)
+            print("SPS:", int((global_step - start_step) / (time.time() - start_time)))
+            writer.add_scalar("charts/StepPerSecond", int((global_step - start_step) / (time.time() - start_time)), global_step)
+            if reporter is not None:
+                reporter.report(global_step)
+
+        checkpoint_writer.close()
+        if not stopped:
+            # the run is complete, `resume auto` starts a new one
+            for checkpoint_path in list_checkpoints(f"runs/{run_name}"):
+                os.remove(checkpoint_path)
+        if args.save_model and not stopped:
             model_path = f"runs/{run_name}/{args.exp_name}.cleanrl_model"
-            torch.save(agent.state_dict(), model_path)
+            save_tensors(model_path, agent.state_dict())
 
             print(f"model saved to {model_path}")
         
-    model_path = args.eval_checkpoint if args.eval_checkpoint else model_path
-    episodic_events = evaluate(
-        model_path,
-        make_env,
-        args.env_id,
-        eval_episodes=100,
-        run_name=f"{run_name}-eval",
-        Model=Agent,
-        device=device,
-    )
+    if not stopped:
+        model_path = args.eval_checkpoint if args.eval_checkpoint else model_path
+        episodic_events = evaluate(
+            model_path,
+            partial(make_env, skip_frames=args.skip_frames, preprocessing=args.preprocessing),
+            args.env_id,
+            eval_episodes=100,
+            run_name=f"{run_name}-eval",
+            Model=Agent,
+            device=device,
+            quantize=args.quantized_eval,
+        )
 
-    for idx, event in enumerate(episodic_events):
-        writer.add_scalar("eval/episodic_return", event['return'], idx)
-        writer.add_scalar("eval/episodic_length", event['length'], idx)
-        writer.add_scalar("eval/episodic_time", event['time'], idx)
+        for idx, event in enumerate(episodic_events):
+            writer.add_scalar("eval/episodic_return", event['return'], idx)
+            writer.add_scalar("eval/episodic_length", event['length'], idx)
+            writer.add_scalar("eval/episodic_time", event['time'], idx)
+        mean_return = np.mean([event['return'] for event in episodic_events])
+        writer.add_scalar("eval/mean_episodic_return", mean_return)
+        print(f"eval mean episodic return ({args.precision}): {mean_return:.2f}")
     
-    try:
-        writer.close()
-        envs.close()
-    except:
-        # somehow this code throws an "AttributeError: 'RecordVideo' object has no attribute 'enabled'" when running the evaluation code
-        pass
\ No newline at end of file
+    writer.close()
+    envs.close()
+    if video_replayer is not None:
+        video_replayer.close()
\ No newline at end of file
@@ -11,13 +11,8 @@ import torch.nn as nn
 import tyro
 from torch.utils.tensorboard import SummaryWriter
 
-from stable_baselines3.common.atari_wrappers import (
-    ClipRewardEnv,
-    EpisodicLifeEnv,
-    FireResetEnv,
-    MaxAndSkipEnv,
-    NoopResetEnv,
-)
+from rle_assignment.vector_env import make_env
+from rle_assignment.video import VideoReplayer
 
 
 gym.register_envs(ale_py)  # unnecessary but helpful for IDEs
@@ -41,26 +36,6 @@ class Args:
     eval_episodes: int = 100
     """number of episodes to evaluate"""
 
-def make_env(env_id, idx, capture_video, run_name):
-    def thunk():
-        if capture_video and idx == 0:
-            env = gym.make(env_id, render_mode="rgb_array")
-            env = gym.wrappers.RecordVideo(env, f"videos/{run_name}")
-        else:
-            env = gym.make(env_id)
-        env = gym.wrappers.RecordEpisodeStatistics(env)
-        env = NoopResetEnv(env, noop_max=30)
-        env = MaxAndSkipEnv(env, skip=4)
-        env = EpisodicLifeEnv(env)
-        if "FIRE" in env.unwrapped.get_action_meanings():
-            env = FireResetEnv(env)
-        env = ClipRewardEnv(env)
-        env = gym.wrappers.ResizeObservation(env, (84, 84))
-        env = gym.wrappers.GrayscaleObservation(env)
-        env = gym.wrappers.FrameStackObservation(env, 4)
-        return env
-    return thunk
-
 class RandomAgent:
     def __init__(self, action_space):
         self.action_space = action_space
@@ -79,6 +54,7 @@ def evaluate_random(
     Returns a list of dictionaries, each containing the return, length, and time of the episode.
     """
     envs = gym.vector.SyncVectorEnv([make_env(env_id, 0, capture_video, run_name)])
+    video_replayer = VideoReplayer(f"videos/{run_name}") if capture_video else None
     agent = RandomAgent(envs.single_action_space)
 
     obs, _ = envs.reset()
@@ -93,6 +69,9 @@ def evaluate_random(
             episodic_events += [{'return': infos['episode']['r'], 'length': infos['episode']['l'], 'time': infos['episode']['t']}]
         obs = next_obs
 
+    envs.close()
+    if video_replayer is not None:
+        video_replayer.close()
     return episodic_events
 
 if __name__ == "__main__":
@@ -0,0 +1,123 @@
+import json
+import math
+import os
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from rle_assignment.sweep import Sweep, SweepRun
+
+
+class RungReporter:
+    """
+    The trainer side of `AshaSweep`: keeps the last `window` training episodic returns and appends the global step
+    and their mean (the rolling `train/episodic_return`) to the JSON lines file `path` after every iteration.
+    """
+    def __init__(self, path: str, window: int = 20):
+        self.path = path
+        self.returns = deque(maxlen=window)
+
+    def add_episode(self, episodic_return: float):
+        self.returns.append(float(episodic_return))
+
+    def report(self, global_step: int, checkpoint: Optional[str] = None):
+        """With `checkpoint` the run stopped at its budget, the path is the checkpoint it continues from."""
+        mean_return = float(np.mean(self.returns)) if self.returns else None
+        with open(self.path, "a") as f:
+            f.write(json.dumps({"global_step": global_step, "mean_return": mean_return, "checkpoint": checkpoint}) + "\n")
+
+
+def read_last_report(path: str) -> Optional[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        lines = f.read().splitlines()
+    return json.loads(lines[-1]) if lines else None
+
+
+@dataclass
+class AshaTrial(SweepRun):
+    rung: int = 0
+    """the number of completed rungs, a started trial trains to the budget of rung `rung`"""
+    results: List[float] = field(default_factory=list)
+    """the rolling mean episodic return at the end of every completed rung"""
+    checkpoint: Optional[str] = None
+    """the checkpoint at the end of the last completed rung"""
+
+
+class AshaSweep(Sweep):
+    """
+    Asynchronous successive halving (ASHA, Li et al., 2020) over the configurations of a `Sweep`.
+
+    The rungs have the budgets `min_timesteps * reduction_factor**k`, the last one is `total_timesteps` (the
+    learning rate schedule of every run is the one of `total_timesteps`). Every configuration first trains to the
+    budget of rung 0 with `--stop_timesteps`, saves a checkpoint and reports its rolling mean training return via
+    `--report_file` (see `RungReporter`). Whenever a slot is free, a configuration in the top `1 / reduction_factor`
+    of the completed ones of its rung is promoted and continues from its checkpoint (`--resume`) to the budget of
+    the next rung, otherwise the next configuration starts at rung 0. The configurations that are never promoted
+    stay `paused`.
+    """
+    run_type = AshaTrial
+
+    def __init__(
+        self,
+        script: str,
+        sweep_dir: str,
+        configs: List[Dict[str, Any]],
+        total_timesteps: int,
+        min_timesteps: int,
+        reduction_factor: int = 3,
+        **kwargs,
+    ):
+        super().__init__(script, sweep_dir, configs, **kwargs)
+        self.reduction_factor = reduction_factor
+        self.total_timesteps = total_timesteps
+        num_rungs = max(math.ceil(math.log(total_timesteps / min_timesteps, reduction_factor)), 0) + 1
+        self.budgets = [min(min_timesteps * reduction_factor ** k, total_timesteps) for k in range(num_rungs)]
+        self.budgets[-1] = total_timesteps
+
+    def _promotable(self) -> Optional[AshaTrial]:
+        # the higher rungs first, so the best configurations reach the full budget early
+        for rung in reversed(range(len(self.budgets) - 1)):
+            completed = [trial for trial in self.runs.values() if len(trial.results) > rung]
+            completed.sort(key=lambda trial: trial.results[rung], reverse=True)
+            for trial in completed[:len(completed) // self.reduction_factor]:
+                if trial.status == "paused" and trial.rung == rung + 1:
+                    return trial
+        return None
+
+    def _next_run(self) -> Optional[AshaTrial]:
+        # interrupted trials continue first, then promotions, then new trials
+        pending = [trial for trial in self.runs.values() if trial.status == "pending"]
+        resumed = next((trial for trial in pending if trial.rung > 0), None)
+        return resumed or self._promotable() or next(iter(pending), None)
+
+    def _report_path(self, trial: AshaTrial) -> str:
+        return os.path.join(self.sweep_dir, f"{trial.name}.jsonl")
+
+    def _overrides(self, trial: AshaTrial) -> Dict[str, Any]:
+        overrides = dict(super()._overrides(trial), total_timesteps=self.total_timesteps)
+        overrides["report_file"] = self._report_path(trial)
+        if trial.rung < len(self.budgets) - 1:
+            overrides["stop_timesteps"] = self.budgets[trial.rung]
+        if trial.checkpoint is not None and (trial.status == "paused" or "resume" not in overrides):
+            # a promoted trial continues from the checkpoint of its last rung, an interrupted one (with
+            # `checkpoint_interval`) from the newest checkpoint of the rung it was training (`resume auto`)
+            overrides["resume"] = trial.checkpoint
+        return overrides
+
+    def _on_exit(self, trial: AshaTrial, returncode: int):
+        report = read_last_report(self._report_path(trial))
+        if returncode != 0 or report is None:
+            trial.status = "failed"
+            return
+        # a rung without a finished episode ranks last
+        trial.results.append(report["mean_return"] if report["mean_return"] is not None else -math.inf)
+        trial.checkpoint = report["checkpoint"]
+        trial.rung += 1
+        # a run stopped at its budget reports its checkpoint, a run without one trained to the end (the trainers stop
+        # at the last multiple of their batch size, which can be below `total_timesteps`)
+        trial.status = "paused" if trial.checkpoint is not None else "done"
+        print(f"{trial.name}: rung {trial.rung - 1} ({self.budgets[trial.rung - 1]} steps) mean return {trial.results[-1]:.1f}")
@@ -0,0 +1,95 @@
+import cv2
+import gymnasium as gym
+import numpy as np
+
+
+class FusedAtariPreprocessing(gym.Wrapper):
+    """
+    Does the work of `MaxAndSkipEnv`, `ResizeObservation`, `GrayscaleObservation` and `FrameStackObservation`
+    in a single wrapper without allocating new arrays per step.
+
+    The wrapped ALE env must be created with `frameskip=1`, every action is then repeated exactly `action_repeat`
+    frames. The grayscale screens of the last two frames are read from ALE into preallocated buffers, max-pooled,
+    resized into the newest slot of the frame stack and the frame stack is shifted in place.
+    Since only the screen is used, the wrapped env can be created with `obs_type="ram"` to make its observations cheap.
+
+    The returned observation is the internal frame stack, it is overwritten by the next step or reset.
+    """
+    def __init__(self, env: gym.Env, action_repeat: int = 4, screen_size: int = 84, stack_size: int = 4):
+        super().__init__(env)
+        assert env.unwrapped._frameskip == 1, "the wrapped env must be created with `frameskip=1`"
+        assert action_repeat >= 1
+        self.action_repeat = action_repeat
+        self.screen_size = screen_size
+        self.ale = env.unwrapped.ale
+        height, width = self.ale.getScreenDims()
+        self._frames = np.zeros((2, height, width), dtype=np.uint8)
+        self._stack = np.zeros((stack_size, screen_size, screen_size), dtype=np.uint8)
+        self.observation_space = gym.spaces.Box(low=0, high=255, shape=self._stack.shape, dtype=np.uint8)
+
+    def _push_frame(self, frame: np.ndarray):
+        self._stack[:-1] = self._stack[1:]
+        cv2.resize(frame, (self.screen_size, self.screen_size), dst=self._stack[-1], interpolation=cv2.INTER_AREA)
+
+    def reset(self, **kwargs):
+        _, info = self.env.reset(**kwargs)
+        self.ale.getScreenGrayscale(self._frames[1])
+        self._push_frame(self._frames[1])
+        self._stack[:-1] = self._stack[-1]
+        return self._stack, info
+
+    def step(self, action):
+        total_reward = 0.0
+        for i in range(self.action_repeat):
+            _, reward, terminated, truncated, info = self.env.step(action)
+            total_reward += reward
+            if i == self.action_repeat - 2:
+                self.ale.getScreenGrayscale(self._frames[0])
+            if terminated or truncated:
+                break
+        self.ale.getScreenGrayscale(self._frames[1])
+        # max-pool the last two frames (only if both belong to this step) to remove the Atari sprite flickering
+        if self.action_repeat > 1 and i >= self.action_repeat - 2:
+            np.maximum(self._frames[0], self._frames[1], out=self._frames[1])
+        self._push_frame(self._frames[1])
+        return self._stack, total_reward, terminated, truncated, info
+
+
+class CachedNoopResetEnv(gym.Wrapper):
+    """
+    Samples the initial states like `NoopResetEnv` (a random number of 1 to `noop_max` no-op frames after the reset),
+    but restores them from a cache of ALE states instead of emulating the no-ops on every reset.
+
+    The game reset of ALE is deterministic and the no-ops are not affected by sticky actions,
+    so the state after `n` no-ops is always the same. On the first reset the states after 1 to `noop_max` no-ops
+    are cloned once, every later reset restores one of them without resetting or stepping the emulator.
+    The emulator RNG (sticky actions) is not part of the cached states and keeps running.
+
+    Must directly wrap the env returned by `gym.make`, since the wrappers in between would not see the reset.
+    """
+    def __init__(self, env: gym.Env, noop_max: int = 30):
+        super().__init__(env)
+        assert env.unwrapped.get_action_meanings()[0] == "NOOP"
+        self.noop_max = noop_max
+        self.noop_action = 0
+        # _states[n - 1] is the emulator state after n no-ops
+        self._states = []
+
+    def _fill_cache(self, **kwargs):
+        self.env.reset(**kwargs)
+        for _ in range(self.noop_max):
+            _, _, terminated, truncated, _ = self.env.step(self.noop_action)
+            if terminated or truncated:
+                break
+            self._states.append(self.env.unwrapped.clone_state())
+        assert len(self._states) > 0, "the episode ended during the first no-op"
+
+    def reset(self, **kwargs):
+        if not self._states:
+            self._fill_cache(**kwargs)
+        elif kwargs.get("seed") is not None:
+            # seeds the env and ALE, the cached states stay valid
+            self.env.reset(**kwargs)
+        noops = self.unwrapped.np_random.integers(1, len(self._states) + 1)
+        self.env.unwrapped.restore_state(self._states[noops - 1])
+        return self.env.unwrapped._get_obs(), self.env.unwrapped._get_info()
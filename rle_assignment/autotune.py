@@ -0,0 +1,261 @@
+import json
+import os
+import time
+import warnings
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence
+
+import gymnasium as gym
+import torch
+import torch.nn as nn
+import torch.optim as optim
+
+from rle_assignment.ppo import PPOUpdate
+from rle_assignment.quantization import QuantizedPolicy
+from rle_assignment.rollout_storage import FrameStackStorage
+from rle_assignment.vector_env import make_vector_env
+
+
+@dataclass
+class AutotuneResult:
+    """The configuration chosen by `autotune` and the measurements it is based on."""
+    env_backend: str
+    num_envs: int
+    num_threads: int
+    num_minibatches: int
+    minibatch_size: int
+    estimated_sps: float
+    estimated_memory_gb: float
+    env_step_times: Dict[str, float] = field(default_factory=dict)
+    """the seconds per vector env step of every `backend/num_envs`"""
+    inference_times: Dict[str, float] = field(default_factory=dict)
+    """the seconds per `act` call of every `threads/num_envs`"""
+    update_times: Dict[str, float] = field(default_factory=dict)
+    """the seconds per PPO update step of every `threads/minibatch_size`"""
+
+    def as_dict(self) -> Dict[str, str]:
+        return {
+            "autotune_threads": str(self.num_threads),
+            "autotune_estimated_sps": f"{self.estimated_sps:.0f}",
+            "autotune_estimated_memory_gb": f"{self.estimated_memory_gb:.2f}",
+        }
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            json.dump(asdict(self), f, indent=2)
+
+
+def _memory_bytes(pid="self", key: str = "VmRSS") -> int:
+    """The resident (`VmRSS`) or peak resident (`VmHWM`) memory of a process, read from `/proc`."""
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith(key + ":"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def _time_calls(fn: Callable, seconds: float, min_calls: int = 1) -> float:
+    """The mean duration of `fn` after one warm-up call, called until `seconds` passed (at least `min_calls` times)."""
+    fn()
+    calls = 0
+    start_time = time.perf_counter()
+    while calls < min_calls or time.perf_counter() - start_time < seconds:
+        fn()
+        calls += 1
+    return (time.perf_counter() - start_time) / calls
+
+
+class _Budget:
+    """One deadline for all measurements of `autotune`, the time left is split evenly between the measurements left."""
+    def __init__(self, seconds: float, num_measurements: int):
+        self.deadline = time.perf_counter() + seconds
+        self.num_left = num_measurements
+
+    @property
+    def expired(self) -> bool:
+        return time.perf_counter() >= self.deadline
+
+    def skip(self, num_measurements: int = 1):
+        self.num_left -= num_measurements
+
+    def next(self, required: bool = False, overhead: float = 0.0) -> Optional[float]:
+        """
+        The seconds of the next measurement, None if its estimated `overhead` (env start, warm-up call) does not fit
+        into its share of the time left and it is not `required` (the first measurement of every kind runs anyway,
+        so there is a configuration to choose).
+        """
+        share = max(self.deadline - time.perf_counter(), 0.0) / max(self.num_left, 1)
+        self.num_left -= 1
+        if not required and overhead >= share:
+            return None
+        return max(share - overhead, 0.0)
+
+
+def _default_threads() -> List[int]:
+    num_cores = len(os.sched_getaffinity(0))
+    threads = [2 ** i for i in range(num_cores.bit_length()) if 2 ** i <= num_cores]
+    return sorted(set(threads + [num_cores]))
+
+
+def autotune(
+    make_agent: Callable[[gym.vector.VectorEnv], nn.Module],
+    args,
+    seconds: float = 60.0,
+    memory_gb: float = 8.0,
+    backends: Optional[Sequence[str]] = None,
+    num_envs: Sequence[int] = (8, 16, 32, 64),
+    threads: Optional[Sequence[int]] = None,
+    minibatch_sizes: Sequence[int] = (128, 256, 512, 1024),
+) -> AutotuneResult:
+    """
+    Measures the env step time of every vector env backend and number of envs, the `act` latency and the PPO update
+    time of every torch thread count on this machine, and returns the configuration with the highest estimated SPS
+    whose estimated memory stays below `memory_gb`.
+
+    `seconds` is one budget for all measurements including the start of the env workers: the time left is split
+    evenly between the measurements left and once it is used up the remaining configurations are not measured (and
+    not chosen), a configuration is also skipped when its estimated env start or warm-up exceeds its share. Only the
+    first measurement of every kind (the fewest envs, the most threads, the smallest minibatch) runs anyway, so the
+    budget is exceeded by at most their duration.
+    An iteration is estimated as `num_steps` env steps and `act` calls plus `update_epochs * num_minibatches` update
+    steps, which ignores the overlap of `pipelined_rollout`. The memory is estimated from the resident memory of the
+    envs, the rollout storage and the peak memory growth while timing the update steps. `args` are the `Args` of the
+    trainer (`env_id`, `skip_frames`, `preprocessing`, `num_steps`, `update_epochs`, the PPO coefficients and
+    `quantized_rollout` are used), the update is timed without `torch.compile`.
+    """
+    if backends is None:
+        # the native backend cannot record videos, `env_batch_size` needs the pool
+        backends = ["pool"] if args.env_batch_size else ["sync", "async"] + ([] if args.capture_video else ["native"])
+    backends = list(backends)
+    num_envs = sorted(n for n in num_envs if n >= args.env_batch_size)
+    # the most threads first, they are the fastest to measure
+    threads = sorted(threads or _default_threads(), reverse=True)
+    minibatch_sizes = sorted(minibatch_sizes)
+    budget = _Budget(seconds, len(backends) * len(num_envs) + len(threads) * (len(num_envs) + len(minibatch_sizes)))
+
+    # env step time and resident memory per env
+    env_step_times, env_memory = {}, {}
+    # the seconds to start and reset one env of every backend, the first measured backend estimates the others
+    start_times: Dict[str, float] = {}
+    backends_tried = list(backends)
+    for backend in backends_tried:
+        for i, n in enumerate(num_envs):
+            start_time_per_env = start_times.get(backend, next(iter(start_times.values()), 0.0))
+            seconds_per_measurement = budget.next(required=not env_step_times, overhead=start_time_per_env * n)
+            if seconds_per_measurement is None:
+                continue
+            memory_before = _memory_bytes()
+            start_time = time.perf_counter()
+            try:
+                envs = make_vector_env(
+                    args.env_id, n, False, "autotune", args.skip_frames, backend=backend,
+                    batch_size=args.env_batch_size, preprocessing=args.preprocessing,
+                )
+            except gym.error.DependencyNotInstalled as e:
+                warnings.warn(f"autotune skips the `{backend}` vector env backend: {e}")
+                backends.remove(backend)
+                budget.skip(len(num_envs) - i - 1)
+                break
+            envs.action_space.seed(args.seed)
+            envs.reset(seed=args.seed)
+            start_times[backend] = (time.perf_counter() - start_time) / n
+            env_step_times[f"{backend}/{n}"] = _time_calls(
+                lambda: envs.step(envs.action_space.sample()), seconds_per_measurement
+            )
+            memory = _memory_bytes() - memory_before
+            memory += sum(_memory_bytes(process.pid) for process in getattr(envs, "processes", []))
+            env_memory[f"{backend}/{n}"] = max(memory, 0)
+            single_action_space = envs.single_action_space
+            envs.close()
+    if not env_step_times:
+        raise ValueError(f"autotune could not create a vector env with any of the backends {backends_tried}")
+
+    agent = make_agent(envs)
+    optimizer = optim.Adam(agent.parameters(), lr=args.learning_rate, eps=1e-5)
+    update_step = PPOUpdate(
+        agent, optimizer, args.max_grad_norm, args.clip_coef, args.ent_coef, args.vf_coef,
+        norm_adv=args.norm_adv, clip_vloss=args.clip_vloss,
+    )
+    obs_shape = envs.single_observation_space.shape
+
+    # act latency, with the int8 snapshot that selects the rollout actions with `quantized_rollout`
+    inference_times = {}
+    for num_threads in threads:
+        torch.set_num_threads(num_threads)
+        for n in num_envs:
+            seconds_per_measurement = budget.next(required=not inference_times)
+            if seconds_per_measurement is None:
+                continue
+            obs = torch.randint(0, 256, (n,) + obs_shape, dtype=torch.uint8)
+            policy = QuantizedPolicy(agent, obs) if args.quantized_rollout else agent
+            with torch.inference_mode():
+                inference_times[f"{num_threads}/{n}"] = _time_calls(lambda: policy.act(obs), seconds_per_measurement)
+
+    # update step time and peak memory growth, the minibatch sizes ascending so the peak grows with them
+    update_times, update_memory = {}, {}
+    memory_before = _memory_bytes(key="VmHWM")
+    previous_size = None
+    for minibatch_size in minibatch_sizes:
+        if update_times and budget.expired:
+            budget.skip(len(threads))
+            continue
+        minibatch = (
+            torch.randint(0, 256, (minibatch_size,) + obs_shape, dtype=torch.uint8),
+            torch.randint(0, single_action_space.n, (minibatch_size,)),
+            torch.randn(minibatch_size) - 2.0,
+            torch.randn(minibatch_size),
+            torch.randn(minibatch_size),
+            torch.randn(minibatch_size),
+        )
+        for num_threads in threads:
+            # the warm-up and the first call, estimated from the next smaller minibatch with as many threads
+            previous_time = update_times.get(f"{num_threads}/{previous_size}", 0.0)
+            overhead = 2 * previous_time * minibatch_size / previous_size if previous_time else 0.0
+            seconds_per_measurement = budget.next(required=not update_times, overhead=overhead)
+            if seconds_per_measurement is None:
+                continue
+            torch.set_num_threads(num_threads)
+            update_times[f"{num_threads}/{minibatch_size}"] = _time_calls(
+                lambda: update_step(*minibatch), seconds_per_measurement
+            )
+        if not any(f"{num_threads}/{minibatch_size}" in update_times for num_threads in threads):
+            continue
+        previous_size = minibatch_size
+        # the two observation buffers of the minibatch loader and the working set of the update
+        update_memory[minibatch_size] = 2 * minibatch[0].nbytes + _memory_bytes(key="VmHWM") - memory_before
+
+    best = None
+    for backend in backends:
+        for n in num_envs:
+            if f"{backend}/{n}" not in env_step_times:
+                continue
+            batch_size = n * args.num_steps
+            storage_memory = FrameStackStorage(args.num_steps, n, obs_shape).nbytes
+            storage_memory *= 2 if getattr(args, "pipelined_rollout", False) else 1
+            for num_threads in threads:
+                if f"{num_threads}/{n}" not in inference_times:
+                    continue
+                rollout_time = args.num_steps * (
+                    env_step_times[f"{backend}/{n}"] + inference_times[f"{num_threads}/{n}"]
+                )
+                for minibatch_size in minibatch_sizes:
+                    if minibatch_size > batch_size or batch_size % minibatch_size:
+                        continue
+                    if f"{num_threads}/{minibatch_size}" not in update_times:
+                        # not measured within the budget
+                        continue
+                    memory = env_memory[f"{backend}/{n}"] + storage_memory + update_memory[minibatch_size]
+                    if memory > memory_gb * 1024 ** 3:
+                        continue
+                    update_time = (
+                        args.update_epochs * batch_size // minibatch_size * update_times[f"{num_threads}/{minibatch_size}"]
+                    )
+                    sps = batch_size / (rollout_time + update_time)
+                    if best is None or sps > best.estimated_sps:
+                        best = AutotuneResult(
+                            backend, n, num_threads, batch_size // minibatch_size, minibatch_size, sps, memory / 1024 ** 3
+                        )
+    if best is None:
+        raise ValueError(f"no autotune configuration fits into {memory_gb} GB")
+    best.env_step_times, best.inference_times, best.update_times = env_step_times, inference_times, update_times
+    return best
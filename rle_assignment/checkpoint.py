@@ -0,0 +1,231 @@
+import glob
+import json
+import os
+import random
+import struct
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+# the dtype names of the safetensors format
+_DTYPES = {
+    torch.float64: "F64",
+    torch.float32: "F32",
+    torch.float16: "F16",
+    torch.bfloat16: "BF16",
+    torch.int64: "I64",
+    torch.int32: "I32",
+    torch.int16: "I16",
+    torch.int8: "I8",
+    torch.uint64: "U64",
+    torch.uint32: "U32",
+    torch.uint16: "U16",
+    torch.uint8: "U8",
+    torch.bool: "BOOL",
+}
+_TORCH_DTYPES = {name: dtype for dtype, name in _DTYPES.items()}
+
+
+def save_tensors(path: str, tensors: Dict[str, torch.Tensor], metadata: Optional[Dict[str, str]] = None):
+    """
+    Saves `tensors` in the safetensors format: an 8 byte header size, a JSON header with the dtype, shape and byte
+    range of every tensor (and the string `metadata`) and the raw tensor data. The tensors are ordered by element
+    size, so every tensor is aligned and `load_tensors` maps them without copying. The file is written to a temporary
+    file and renamed, so an interrupted save never leaves a truncated file behind.
+    """
+    names = sorted(tensors, key=lambda name: (-tensors[name].element_size(), name))
+    header, offset = {}, 0
+    for name in names:
+        tensor = tensors[name]
+        size = tensor.numel() * tensor.element_size()
+        header[name] = {
+            "dtype": _DTYPES[tensor.dtype], "shape": list(tensor.shape), "data_offsets": [offset, offset + size]
+        }
+        offset += size
+    if metadata:
+        header["__metadata__"] = metadata
+    header = json.dumps(header).encode()
+    # the data starts at a multiple of 8 bytes
+    header += b" " * (-(8 + len(header)) % 8)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for name in names:
+            f.write(tensors[name].detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy().data)
+    os.replace(tmp_path, path)
+
+
+def load_tensors(path: str, device=None) -> Tuple[Dict[str, torch.Tensor], Dict[str, str]]:
+    """
+    The tensors and the metadata of a safetensors file. On the CPU the tensors are copy-on-write views of the
+    memory-mapped file, so loading is near-instant and the data is only read when it is used.
+    """
+    with open(path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+    metadata = header.pop("__metadata__", None) or {}
+    data = torch.from_numpy(np.memmap(path, dtype=np.uint8, mode="c"))[8 + header_size:]
+    tensors = {}
+    for name, info in header.items():
+        dtype = _TORCH_DTYPES[info["dtype"]]
+        begin, end = info["data_offsets"]
+        tensor_data = data[begin:end]
+        if (8 + header_size + begin) % dtype.itemsize:
+            # files of other writers may have unaligned tensors
+            tensor_data = tensor_data.clone()
+        tensors[name] = tensor_data.view(dtype).reshape(info["shape"])
+        if device is not None:
+            tensors[name] = tensors[name].to(device)
+    return tensors, metadata
+
+
+def is_safetensors(path: str) -> bool:
+    """Whether `path` is a safetensors file (and not a `torch.save` file)."""
+    with open(path, "rb") as f:
+        return f.read(9)[8:] == b"{"
+
+
+def load_weights(path: str, device=None) -> Dict[str, torch.Tensor]:
+    """A state dict saved with `save_tensors`, or with `torch.save` by earlier versions of the trainers."""
+    if is_safetensors(path):
+        return load_tensors(path, device)[0]
+    return torch.load(path, map_location=device)
+
+
+def _flatten(value: Any, name: str, tensors: Dict[str, torch.Tensor]) -> Any:
+    """`value` as JSON, its tensors and NumPy arrays are copied to `tensors` and referenced by their name."""
+    if isinstance(value, torch.Tensor):
+        tensors[name] = value.detach().to("cpu", copy=True)
+        return {"__tensor__": name}
+    if isinstance(value, np.ndarray):
+        tensors[name] = torch.from_numpy(value.copy())
+        return {"__ndarray__": name}
+    if isinstance(value, dict):
+        # a list of pairs keeps keys that are not strings (e.g. the parameter ids of an optimizer state)
+        items = [[key, _flatten(item, f"{name}.{key}" if name else str(key), tensors)] for key, item in value.items()]
+        return {"__dict__": items}
+    if isinstance(value, (list, tuple)):
+        items = [_flatten(item, f"{name}.{i}", tensors) for i, item in enumerate(value)]
+        return {"__tuple__": items} if isinstance(value, tuple) else items
+    return value
+
+
+def _unflatten(value: Any, tensors: Dict[str, torch.Tensor]) -> Any:
+    if isinstance(value, list):
+        return [_unflatten(item, tensors) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if "__tensor__" in value:
+        return tensors[value["__tensor__"]]
+    if "__ndarray__" in value:
+        return tensors[value["__ndarray__"]].numpy()
+    if "__tuple__" in value:
+        return tuple(_unflatten(item, tensors) for item in value["__tuple__"])
+    return {key: _unflatten(item, tensors) for key, item in value["__dict__"]}
+
+
+def _encode(state: Dict[str, Any]) -> Tuple[Dict[str, torch.Tensor], Dict[str, str]]:
+    """CPU copies of the tensors of `state` and the metadata of its checkpoint."""
+    tensors = {}
+    structure = _flatten(state, "", tensors)
+    return tensors, {"format": "pt", "state": json.dumps(structure)}
+
+
+def save_checkpoint(path: str, **state: Any):
+    """
+    Saves the training state (state dicts, counters, the run name, the random number generator states, ...) to
+    `path` without pickle: the tensors and NumPy arrays with `save_tensors`, the rest as JSON in its metadata.
+    """
+    save_tensors(path, *_encode(state))
+
+
+def load_checkpoint(path: str, map_location=None) -> Dict[str, Any]:
+    """The training state saved by `save_checkpoint`, its tensors memory-mapped (see `load_tensors`)."""
+    tensors, metadata = load_tensors(path, map_location)
+    return _unflatten(json.loads(metadata["state"]), tensors)
+
+
+def list_checkpoints(directory: str) -> List[str]:
+    """The checkpoints of a `CheckpointWriter` in `directory`, the oldest first."""
+    return sorted(glob.glob(os.path.join(glob.escape(directory), "checkpoint_*.safetensors")))
+
+
+class CheckpointWriter:
+    """
+    Saves checkpoints of the training state (see `save_checkpoint`) to `directory/checkpoint_{global_step}.safetensors`
+    on a background thread, so the training loop only waits for the copy of its tensors to the CPU. Only the newest
+    `keep` checkpoints stay on disk (all with `keep <= 0`). One checkpoint is written at a time, `save` waits for the
+    previous one and raises its error if it failed.
+    """
+    def __init__(self, directory: str, keep: int = 2):
+        self.directory = directory
+        self.keep = keep
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending: Optional[Future] = None
+
+    def _write(self, path: str, tensors: Dict[str, torch.Tensor], metadata: Dict[str, str]):
+        save_tensors(path, tensors, metadata)
+        if self.keep > 0:
+            for old_path in list_checkpoints(self.directory)[:-self.keep]:
+                os.remove(old_path)
+
+    def save(self, **state: Any) -> str:
+        """Starts saving a checkpoint of `state` (named after its `global_step`) and returns its path."""
+        self.wait()
+        path = os.path.join(self.directory, f"checkpoint_{state['global_step']:012d}.safetensors")
+        self._pending = self._executor.submit(self._write, path, *_encode(state))
+        return path
+
+    def wait(self):
+        """Waits until the last checkpoint is on disk."""
+        if self._pending is not None:
+            pending, self._pending = self._pending, None
+            pending.result()
+
+    def close(self):
+        self.wait()
+        self._executor.shutdown()
+
+
+def find_checkpoint(resume: str, run_prefix: str) -> Optional[str]:
+    """
+    The checkpoint of the `resume` argument of a trainer: a checkpoint file, the newest checkpoint of a run directory
+    or with `auto` the newest checkpoint of the newest run directory `{run_prefix}__*` that has one (None if there is
+    none, the run starts from the beginning). With `auto` a chain of jobs of the same command continues one run.
+    """
+    if resume == "auto":
+        # the run directories end with their start time, so they sort by age
+        for run_dir in sorted(glob.glob(f"{glob.escape(run_prefix)}__*"), reverse=True):
+            checkpoints = list_checkpoints(run_dir)
+            if checkpoints:
+                return checkpoints[-1]
+        return None
+    if os.path.isdir(resume):
+        checkpoints = list_checkpoints(resume)
+        assert checkpoints, f"{resume} has no checkpoint"
+        return checkpoints[-1]
+    return resume
+
+
+def rng_state() -> Dict[str, Any]:
+    """The states of the global Python, NumPy and torch (CPU and CUDA) random number generators."""
+    return {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+        "cuda": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else [],
+    }
+
+
+def set_rng_state(state: Dict[str, Any]):
+    """Restores the random number generators to a `rng_state`."""
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    # the generators read the state from the start of its storage, a memory-mapped state is a view into the file
+    torch.set_rng_state(state["torch"].clone())
+    if state["cuda"] and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all([cuda_state.clone() for cuda_state in state["cuda"]])
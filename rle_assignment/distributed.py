@@ -0,0 +1,48 @@
+import os
+from typing import Tuple
+
+import torch
+import torch.distributed as dist
+import torch.nn as nn
+
+
+def init_distributed() -> Tuple[int, int]:
+    """
+    Joins the `gloo` process group if the script was started by `torchrun` with more than one process
+    (`WORLD_SIZE > 1`), the rendezvous is read from the environment variables `torchrun` sets.
+    Returns the rank of this process and the number of processes.
+    """
+    world_size = int(os.environ.get("WORLD_SIZE", "1"))
+    if world_size == 1:
+        return 0, 1
+    dist.init_process_group("gloo")
+    return dist.get_rank(), world_size
+
+
+def is_distributed() -> bool:
+    return dist.is_available() and dist.is_initialized()
+
+
+def broadcast_parameters(module: nn.Module, src: int = 0):
+    """Overwrites the parameters and buffers of `module` on all processes with the ones of process `src`."""
+    for tensor in list(module.parameters()) + list(module.buffers()):
+        dist.broadcast(tensor.data, src=src)
+
+
+def all_reduce_gradients(module: nn.Module):
+    """Averages the gradients of `module` over all processes with a single all-reduce of the flattened gradients."""
+    grads = [p.grad for p in module.parameters() if p.grad is not None]
+    flat = torch.cat([grad.flatten() for grad in grads])
+    dist.all_reduce(flat)
+    flat /= dist.get_world_size()
+    offset = 0
+    for grad in grads:
+        grad.copy_(flat[offset:offset + grad.numel()].view_as(grad))
+        offset += grad.numel()
+
+
+def all_reduce_mean(tensor: torch.Tensor) -> torch.Tensor:
+    """The mean of `tensor` over all processes."""
+    tensor = tensor.detach().clone()
+    dist.all_reduce(tensor)
+    return tensor / dist.get_world_size()
@@ -0,0 +1,215 @@
+import multiprocessing as mp
+import traceback
+from multiprocessing.connection import wait
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import gymnasium as gym
+import numpy as np
+from gymnasium.vector.utils import (
+    CloudpickleWrapper,
+    batch_space,
+    create_shared_memory,
+    read_from_shared_memory,
+    write_to_shared_memory,
+)
+
+
+def _worker(index, env_fn, pipe, parent_pipe, shared_memory, observation_space, shared_step_results):
+    parent_pipe.close()
+    env = env_fn()
+    rewards, terminations, truncations = _step_result_arrays(*shared_step_results)
+    try:
+        while True:
+            command, data = pipe.recv()
+            if command == "reset":
+                obs, info = env.reset(seed=data)
+                write_to_shared_memory(observation_space, index, obs, shared_memory)
+                rewards[index], terminations[index], truncations[index] = 0.0, False, False
+                pipe.send((True, info))
+            elif command == "step":
+                obs, reward, terminated, truncated, info = env.step(data)
+                if terminated or truncated:
+                    # same-step autoreset: the first observation of the next episode is returned
+                    # together with the reward and info of the last step of the finished one
+                    obs, _ = env.reset()
+                write_to_shared_memory(observation_space, index, obs, shared_memory)
+                rewards[index], terminations[index], truncations[index] = reward, terminated, truncated
+                pipe.send((True, info))
+            elif command == "close":
+                pipe.send((True, None))
+                break
+    except (KeyboardInterrupt, Exception):
+        pipe.send((False, traceback.format_exc()))
+    finally:
+        env.close()
+
+
+def _step_result_arrays(rewards, terminations, truncations) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """numpy views of the shared arrays the workers write their rewards, terminations and truncations into"""
+    return (
+        np.frombuffer(rewards.get_obj(), dtype=np.float64),
+        np.frombuffer(terminations.get_obj(), dtype=np.bool_),
+        np.frombuffer(truncations.get_obj(), dtype=np.bool_),
+    )
+
+
+def _add_info(vector_infos: Dict, info: Dict, index: int, num: int) -> Dict:
+    for key, value in info.items():
+        if isinstance(value, dict):
+            vector_infos[key] = _add_info(vector_infos.get(key, {}), value, index, num)
+        else:
+            if key not in vector_infos:
+                dtype = np.asarray(value).dtype if np.ndim(value) == 0 else object
+                vector_infos[key] = np.zeros(num, dtype=dtype)
+            vector_infos[key][index] = value
+        if f"_{key}" not in vector_infos:
+            vector_infos[f"_{key}"] = np.zeros(num, dtype=bool)
+        vector_infos[f"_{key}"][index] = True
+    return vector_infos
+
+
+class EnvPool(gym.vector.VectorEnv):
+    """
+    Runs every environment in its own worker process (observations are returned through shared memory)
+    and allows to step them asynchronously, like EnvPool does:
+    `send` actions to some of the envs and `recv` the results of the first `batch_size` envs that finished.
+    The indices of the returned envs are in `infos["env_id"]`.
+
+    Unlike the gymnasium vector envs, an env is reset in the same step its episode ends, i.e. the returned
+    observation is the first one of the next episode while reward, termination and info belong to the last step.
+    `step` sends actions to all envs and waits for all of them, so the pool can also be used as a plain vector env.
+
+    The workers write observations, rewards, terminations and truncations into shared memory. With `copy=False`,
+    `reset` and `step` return these shared arrays themselves, i.e. they are overwritten by the next step.
+    """
+    def __init__(
+        self,
+        env_fns: Sequence[Callable[[], gym.Env]],
+        batch_size: int = 0,
+        context: Optional[str] = None,
+        copy: bool = True,
+    ):
+        self.num_envs = len(env_fns)
+        self.batch_size = batch_size if batch_size > 0 else self.num_envs
+        assert self.batch_size <= self.num_envs, "batch_size must not be larger than the number of envs"
+
+        dummy_env = env_fns[0]()
+        self.metadata = dummy_env.metadata
+        self.single_observation_space = dummy_env.observation_space
+        self.single_action_space = dummy_env.action_space
+        dummy_env.close()
+        del dummy_env
+        self.observation_space = batch_space(self.single_observation_space, self.num_envs)
+        self.action_space = batch_space(self.single_action_space, self.num_envs)
+
+        ctx = mp.get_context(context)
+        self._shared_memory = create_shared_memory(self.single_observation_space, n=self.num_envs, ctx=ctx)
+        self._observations = read_from_shared_memory(self.single_observation_space, self._shared_memory, n=self.num_envs)
+        shared_step_results = tuple(ctx.Array(typecode, self.num_envs) for typecode in ("d", "b", "b"))
+        self._rewards, self._terminations, self._truncations = _step_result_arrays(*shared_step_results)
+        self.copy = copy
+        self._pending = np.zeros(self.num_envs, dtype=bool)
+        self.pipes, self.processes = [], []
+        for index, env_fn in enumerate(env_fns):
+            parent_pipe, child_pipe = ctx.Pipe()
+            process = ctx.Process(
+                target=_worker,
+                name=f"EnvPoolWorker-{index}",
+                args=(
+                    index,
+                    CloudpickleWrapper(env_fn),
+                    child_pipe,
+                    parent_pipe,
+                    self._shared_memory,
+                    self.single_observation_space,
+                    shared_step_results,
+                ),
+                daemon=True,
+            )
+            self.pipes.append(parent_pipe)
+            self.processes.append(process)
+            process.start()
+            child_pipe.close()
+
+    @property
+    def num_pending(self) -> int:
+        """the number of envs that were sent an action but whose result was not received yet"""
+        return int(self._pending.sum())
+
+    def _receive(self, index: int):
+        success, result = self.pipes[index].recv()
+        self._pending[index] = False
+        if not success:
+            self.close(terminate=True)
+            raise RuntimeError(f"EnvPool worker {index} failed:\n{result}")
+        return result
+
+    def _batch(self, env_ids: np.ndarray, results: List, all_envs: bool = False):
+        infos = {}
+        for i, info in enumerate(results):
+            _add_info(infos, info, i, len(results))
+        infos["env_id"] = env_ids
+        if all_envs and not self.copy:
+            return self._observations, self._rewards, self._terminations, self._truncations, infos
+        return (
+            self._observations[env_ids],
+            self._rewards[env_ids],
+            self._terminations[env_ids],
+            self._truncations[env_ids],
+            infos,
+        )
+
+    def reset(self, *, seed=None, options=None):
+        assert self.num_pending == 0, "cannot reset while envs are stepping"
+        if seed is None or isinstance(seed, int):
+            seed = [None if seed is None else seed + i for i in range(self.num_envs)]
+        for pipe, env_seed in zip(self.pipes, seed):
+            pipe.send(("reset", env_seed))
+        self._pending[:] = True
+        env_ids = np.arange(self.num_envs)
+        obs, _, _, _, infos = self._batch(env_ids, [self._receive(i) for i in env_ids], all_envs=True)
+        return obs, infos
+
+    def send(self, actions: np.ndarray, env_ids: Optional[np.ndarray] = None):
+        """Sends `actions` to the envs `env_ids` (all envs if None) without waiting for the results."""
+        env_ids = np.arange(self.num_envs) if env_ids is None else np.asarray(env_ids)
+        assert not self._pending[env_ids].any(), "cannot send actions to envs that are still stepping"
+        for env_id, action in zip(env_ids, actions):
+            self.pipes[env_id].send(("step", action))
+        self._pending[env_ids] = True
+
+    def recv(self):
+        """
+        Waits for the first `batch_size` envs (or all pending envs, if fewer are stepping) to finish their step
+        and returns their observations, rewards, terminations, truncations and infos.
+        """
+        num_results = min(self.batch_size, self.num_pending)
+        env_ids, results = [], []
+        while len(env_ids) < num_results:
+            waiting = {self.pipes[i]: i for i in np.flatnonzero(self._pending)}
+            for pipe in wait(list(waiting)):
+                if len(env_ids) == num_results:
+                    break
+                env_ids.append(waiting[pipe])
+                results.append(self._receive(waiting[pipe]))
+        return self._batch(np.array(env_ids, dtype=np.int64), results)
+
+    def step(self, actions: np.ndarray):
+        self.send(actions)
+        env_ids = np.arange(self.num_envs)
+        return self._batch(env_ids, [self._receive(i) for i in env_ids], all_envs=True)
+
+    def close_extras(self, terminate: bool = False, **kwargs):
+        if not terminate:
+            for i in np.flatnonzero(self._pending):
+                self._receive(i)
+            for pipe in self.pipes:
+                pipe.send(("close", None))
+            for pipe in self.pipes:
+                pipe.recv()
+        for process in self.processes:
+            if terminate and process.is_alive():
+                process.terminate()
+            process.join()
+        for pipe in self.pipes:
+            pipe.close()
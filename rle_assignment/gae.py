@@ -0,0 +1,157 @@
+from typing import Literal, Tuple
+
+import numpy as np
+import torch
+
+GaeBackend = Literal["loop", "torchscript", "numba", "cumsum"]
+
+
+def gae_loop(
+    rewards: torch.Tensor,
+    values: torch.Tensor,
+    dones: torch.Tensor,
+    next_value: torch.Tensor,
+    next_done: torch.Tensor,
+    gamma: float,
+    gae_lambda: float,
+) -> torch.Tensor:
+    """The reference implementation, the loop of the cleanRL PPO scripts."""
+    num_steps = rewards.shape[0]
+    advantages = torch.zeros_like(rewards)
+    lastgaelam = 0
+    for t in reversed(range(num_steps)):
+        if t == num_steps - 1:
+            nextnonterminal = 1.0 - next_done
+            nextvalues = next_value
+        else:
+            nextnonterminal = 1.0 - dones[t + 1]
+            nextvalues = values[t + 1]
+        delta = rewards[t] + gamma * nextvalues * nextnonterminal - values[t]
+        advantages[t] = lastgaelam = delta + gamma * gae_lambda * nextnonterminal * lastgaelam
+    return advantages
+
+
+def _gae_scan_python(deltas: torch.Tensor, discounts: torch.Tensor) -> torch.Tensor:
+    advantages = torch.empty_like(deltas)
+    lastgaelam = torch.zeros_like(deltas[0])
+    for t in range(deltas.shape[0] - 1, -1, -1):
+        lastgaelam = deltas[t] + discounts[t] * lastgaelam
+        advantages[t] = lastgaelam
+    return advantages
+
+
+# the kernels are compiled on first use, so importing this module neither needs numba nor scripts anything
+_scan_kernel = None
+_numba_kernel = None
+
+
+def _gae_scan(deltas: torch.Tensor, discounts: torch.Tensor) -> torch.Tensor:
+    global _scan_kernel
+    if _scan_kernel is None:
+        _scan_kernel = torch.jit.script(_gae_scan_python)
+    return _scan_kernel(deltas, discounts)
+
+
+def _gae_numba_kernel():
+    try:
+        import numba
+    except ImportError as e:
+        raise ImportError("the `numba` GAE backend requires numba, run `pip install numba`") from e
+
+    @numba.njit
+    def kernel(deltas, discounts):
+        advantages = np.empty_like(deltas)
+        lastgaelam = np.zeros(deltas.shape[1], dtype=deltas.dtype)
+        for t in range(deltas.shape[0] - 1, -1, -1):
+            for i in range(deltas.shape[1]):
+                lastgaelam[i] = deltas[t, i] + discounts[t, i] * lastgaelam[i]
+                advantages[t, i] = lastgaelam[i]
+        return advantages
+
+    return kernel
+
+
+def _gae_numba(deltas: torch.Tensor, discounts: torch.Tensor) -> torch.Tensor:
+    global _numba_kernel
+    if _numba_kernel is None:
+        _numba_kernel = _gae_numba_kernel()
+    advantages = _numba_kernel(deltas.cpu().numpy(), discounts.cpu().numpy())
+    return torch.from_numpy(advantages).to(deltas.device)
+
+
+def _gae_cumsum(deltas: torch.Tensor, discounts: torch.Tensor, chunk_size: int = 32) -> torch.Tensor:
+    """
+    Solves `A[t] = deltas[t] + discounts[t] * A[t + 1]` as a discounted cumulative sum within chunks of
+    `chunk_size` steps: `A[t] = sum_j P[t, j] * deltas[j] + P[t, end] * A[end]` with the products of the
+    discounts `P[t, j] = discounts[t] * ... * discounts[j - 1]`, which are one matrix product per chunk.
+    Only the chunks are iterated in Python, the cost of a chunk grows with `chunk_size ** 2`.
+    """
+    num_steps = deltas.shape[0]
+    advantages = torch.empty_like(deltas)
+    carry = torch.zeros_like(deltas[0])
+    for end in range(num_steps, 0, -chunk_size):
+        start = max(end - chunk_size, 0)
+        n = end - start
+        # (envs, n, n) with discounts[j] in row t for j >= t and ones elsewhere, the cumulative products along the
+        # rows are the products from step t up to and including step j
+        factors = discounts[start:end].T.unsqueeze(1).expand(-1, n, -1)
+        upper = torch.ones(n, n, dtype=torch.bool, device=deltas.device).triu()
+        products = torch.where(upper, factors, torch.ones_like(factors)).cumprod(dim=2)
+        # P[t, j] is the product up to j - 1 (one on the diagonal, zero below)
+        weights = torch.cat([torch.ones_like(products[:, :, :1]), products[:, :, :-1]], dim=2) * upper
+        advantages[start:end] = (
+            torch.bmm(weights, deltas[start:end].T.unsqueeze(2)).squeeze(2) + products[:, :, -1] * carry.unsqueeze(1)
+        ).T
+        carry = advantages[start]
+    return advantages
+
+
+def discounted_scan(deltas: torch.Tensor, discounts: torch.Tensor, backend: GaeBackend = "cumsum") -> torch.Tensor:
+    """
+    Solves the backward recursion `A[t] = deltas[t] + discounts[t] * A[t + 1]` with `A[num_steps] = 0` for inputs of
+    shape `(num_steps, num_envs)`, the core of the advantage estimators (GAE, V-trace).
+    """
+    if backend == "loop":
+        return _gae_scan_python(deltas, discounts)
+    if backend == "torchscript":
+        return _gae_scan(deltas, discounts)
+    if backend == "numba":
+        return _gae_numba(deltas, discounts)
+    if backend == "cumsum":
+        return _gae_cumsum(deltas, discounts)
+    raise ValueError(f"unknown GAE backend: {backend}")
+
+
+def compute_gae(
+    rewards: torch.Tensor,
+    values: torch.Tensor,
+    dones: torch.Tensor,
+    next_value: torch.Tensor,
+    next_done: torch.Tensor,
+    gamma: float,
+    gae_lambda: float,
+    backend: GaeBackend = "cumsum",
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Computes the generalized advantage estimates and the lambda-returns of a rollout.
+
+    `rewards`, `values` and `dones` have the shape `(num_steps, num_envs)`, `dones[t]` marks that the observation
+    of step `t` is the first of a new episode. `next_value` and `next_done` belong to the observation after the
+    last step. All backends compute the same values as the loop of the cleanRL scripts (`loop`):
+    `torchscript` runs the backward recursion as a scan compiled with the deprecated `torch.jit.script`, `numba` as
+    a compiled NumPy loop on the CPU and `cumsum` as a chunked discounted cumulative sum of batched matrix products
+    (one Python iteration per chunk).
+    """
+    next_value = next_value.reshape(1, -1)
+    next_done = next_done.reshape(1, -1)
+    if backend == "loop":
+        advantages = gae_loop(rewards, values, dones, next_value, next_done, gamma, gae_lambda)
+        return advantages, advantages + values
+
+    # the recursion A[t] = deltas[t] + discounts[t] * A[t + 1] is the same for all other backends
+    nextnonterminal = 1.0 - torch.cat([dones[1:], next_done])
+    nextvalues = torch.cat([values[1:], next_value])
+    deltas = rewards + gamma * nextvalues * nextnonterminal - values
+    discounts = gamma * gae_lambda * nextnonterminal
+    advantages = discounted_scan(deltas, discounts, backend)
+    return advantages, advantages + values
@@ -0,0 +1,35 @@
+from typing import Literal
+
+import torch
+import torch.nn as nn
+
+Precision = Literal["fp32", "bf16"]
+
+
+class ScaledConv2d(nn.Conv2d):
+    """
+    `nn.Conv2d` that takes the raw uint8 frames and normalizes them itself as `x * scale + shift`.
+
+    Without a shift the scale is folded into the weights (`conv(x * s, W) == conv(x, W * s)`), so the only
+    float copy of the input is the dtype conversion. The parameters are the ones of `nn.Conv2d`, i.e. the
+    state dict is the same as for a `nn.Conv2d` applied to `x * scale + shift`.
+    """
+    def __init__(self, *args, scale: float = 1 / 255.0, shift: float = 0.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.scale = scale
+        self.shift = shift
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        x = x.to(self.weight.dtype)
+        if self.shift == 0.0:
+            return self._conv_forward(x, self.weight * self.scale, self.bias)
+        # a shift cannot be folded into the weights because of the zero padding
+        return self._conv_forward(x * self.scale + self.shift, self.weight, self.bias)
+
+
+def autocast(x: torch.Tensor, precision: Precision):
+    """
+    Context in which the forward of a network runs in `precision`. With `bf16` the convolutions and matrix
+    products run in bfloat16 under autocast (and with them their backward), the parameters stay fp32.
+    """
+    return torch.autocast(x.device.type, dtype=torch.bfloat16, enabled=precision == "bf16")
@@ -0,0 +1,72 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+
+import torch
+
+from rle_assignment.rollout_storage import FrameStackStorage
+
+
+def _gather(source, inds: torch.Tensor, out: Optional[torch.Tensor]) -> torch.Tensor:
+    if isinstance(source, FrameStackStorage):
+        return source.gather(inds, out=out)
+    if out is None:
+        return torch.index_select(source, 0, inds)
+    return torch.index_select(source, 0, inds, out=out)
+
+
+def _reuse(buffer: Optional[torch.Tensor], like: torch.Tensor, length: int) -> Optional[torch.Tensor]:
+    """The first `length` rows of `buffer` if it can hold `length` rows of `like`, otherwise None."""
+    if buffer is None or buffer.shape[0] < length or buffer.shape[1:] != like.shape[1:] or buffer.dtype != like.dtype:
+        return None
+    return buffer[:length]
+
+
+class MinibatchLoader:
+    """
+    Yields the minibatches of one epoch of the PPO update as contiguous tensors.
+
+    The flat rollout tensors (actions, log-probs, advantages, ...) are permuted once per epoch into reused
+    contiguous buffers, so every minibatch is a slice of them. The observation stacks are gathered into one of
+    two reused buffers, with `prefetch` the stacks of the next minibatch are gathered on a background thread while
+    the current one is optimized. The yielded tensors are only valid until the next minibatch is requested.
+    """
+    def __init__(self, minibatch_size: int, prefetch: bool = True):
+        self.minibatch_size = minibatch_size
+        self._executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        self._obs_buffers: List[Optional[torch.Tensor]] = [None, None]
+        self._buffers: List[Optional[torch.Tensor]] = []
+
+    def _gather_obs(self, obs, inds: torch.Tensor, slot: int) -> torch.Tensor:
+        out = self._obs_buffers[slot]
+        out = out[:len(inds)] if out is not None and out.shape[0] >= len(inds) else None
+        minibatch_obs = _gather(obs, inds, out)
+        if out is None:
+            self._obs_buffers[slot] = minibatch_obs
+        return minibatch_obs
+
+    def __call__(self, b_inds, obs, *tensors: torch.Tensor) -> Iterator[Tuple[torch.Tensor, ...]]:
+        """
+        Iterates the minibatches of the flat batch indices `b_inds` (in this order): tuples of the gathered `obs`
+        (a tensor or a `FrameStackStorage`) followed by the gathered `tensors`.
+        """
+        inds = torch.as_tensor(b_inds, device=tensors[0].device)
+        if len(self._buffers) != len(tensors):
+            self._buffers = [None] * len(tensors)
+        for i, tensor in enumerate(tensors):
+            self._buffers[i] = _gather(tensor, inds, _reuse(self._buffers[i], tensor, len(inds)))
+        permuted = list(self._buffers)
+
+        starts = range(0, len(inds), self.minibatch_size)
+
+        def gather_obs(k: int) -> torch.Tensor:
+            return self._gather_obs(obs, inds[starts[k]:starts[k] + self.minibatch_size], k % 2)
+
+        # the single worker thread runs the gathers in order, so a prefetch of an abandoned epoch (e.g. stopped
+        # by `target_kl`) finishes before the first gather of the next epoch starts
+        pending = self._executor.submit(gather_obs, 0) if self._executor else None
+        for k, start in enumerate(starts):
+            minibatch_obs = pending.result() if self._executor else gather_obs(k)
+            if self._executor and k + 1 < len(starts):
+                pending = self._executor.submit(gather_obs, k + 1)
+            end = start + self.minibatch_size
+            yield (minibatch_obs, *(tensor[start:end] for tensor in permuted))
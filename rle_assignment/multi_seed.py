@@ -0,0 +1,157 @@
+import copy
+from typing import Callable, Dict, List, Literal
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.func import functional_call, stack_module_state, vmap
+
+from rle_assignment.policy import sample_categorical
+from rle_assignment.ppo import ppo_loss
+
+SeedBatching = Literal["vmap", "loop"]
+
+
+class _Call(nn.Module):
+    """Runs `fn(agent, *args)` in `forward`, so `functional_call` can call any method of the agent."""
+    def __init__(self, agent: nn.Module):
+        super().__init__()
+        self.agent = agent
+
+    def forward(self, fn: Callable, *args):
+        return fn(self.agent, *args)
+
+
+def _heads(agent: nn.Module, x: torch.Tensor):
+    hidden = agent.features(x)
+    return agent.actor(hidden), agent.critic(hidden).flatten()
+
+
+class SeedEnsemble:
+    """
+    `num_seeds` independent agents of the same architecture trained in one process.
+
+    The parameters of the agents are stacked along a leading seed dimension (`torch.func.stack_module_state`) and
+    the methods of the agent run on the stacked parameters with `functional_call`, either one seed after another
+    (`batching="loop"`) or for all seeds at once with `vmap` (`batching="vmap"`, the convolutions become grouped
+    convolutions, which were about 1.5x slower than the loop on a CPU). The inputs of `act` and `get_value` are flat over all envs, env `i` belongs to seed
+    `i // (len(x) // num_seeds)`. Every seed samples its actions from its own generator.
+    """
+    def __init__(self, agents: List[nn.Module], seeds: List[int], batching: SeedBatching = "loop"):
+        self.num_seeds = len(agents)
+        self.batching = batching
+        params, buffers = stack_module_state(agents)
+        self.params = {"agent." + name: param for name, param in params.items()}
+        self.buffers = {"agent." + name: buffer for name, buffer in buffers.items()}
+        self._module = _Call(copy.deepcopy(agents[0]).to("meta"))
+        device = next(iter(self.params.values())).device
+        self.generators = [torch.Generator(device).manual_seed(seed) for seed in seeds]
+
+    def parameters(self) -> List[torch.Tensor]:
+        return list(self.params.values())
+
+    def map(self, fn: Callable, *args: torch.Tensor):
+        """`fn(agent, *args)` of every seed, the `args` and the results have a leading seed dimension."""
+        def call(params, buffers, *args):
+            return functional_call(self._module, (params, buffers), (fn,) + args)
+
+        if self.batching == "vmap":
+            return vmap(call, randomness="different")(self.params, self.buffers, *args)
+        outputs = [
+            call(
+                {name: param[i] for name, param in self.params.items()},
+                {name: buffer[i] for name, buffer in self.buffers.items()},
+                *(arg[i] for arg in args),
+            )
+            for i in range(self.num_seeds)
+        ]
+        if isinstance(outputs[0], tuple):
+            return tuple(torch.stack(output) for output in zip(*outputs))
+        return torch.stack(outputs)
+
+    def _by_seed(self, x: torch.Tensor) -> torch.Tensor:
+        return x.view(self.num_seeds, -1, *x.shape[1:])
+
+    @torch.no_grad()
+    def get_value(self, x):
+        return self.map(lambda agent, x: agent.get_value(x), self._by_seed(x)).flatten(0, 1)
+
+    @torch.inference_mode()
+    def act(self, x, action=None, logprob=None, value=None):
+        """`Agent.act` of every seed for the flat observations `x` of all envs."""
+        logits, values = self.map(_heads, self._by_seed(x))
+        actions, logprobs = zip(*(
+            sample_categorical(seed_logits, generator=generator)
+            for seed_logits, generator in zip(logits, self.generators)
+        ))
+        outputs = (torch.cat(actions), torch.cat(logprobs), values.flatten())
+        for out, output in zip((action, logprob, value), outputs):
+            if out is not None:
+                out.copy_(output)
+        return outputs
+
+    def state_dicts(self) -> List[Dict[str, torch.Tensor]]:
+        """The state dicts of the single agents, loadable into the agent architecture."""
+        tensors = {**self.params, **self.buffers}
+        return [
+            {name[len("agent."):]: tensor[i].detach().clone() for name, tensor in tensors.items()}
+            for i in range(self.num_seeds)
+        ]
+
+
+class SeedPPOUpdate:
+    """
+    `PPOUpdate` for a `SeedEnsemble`: one PPO gradient step of every seed on its own minibatch.
+
+    The minibatch tensors are flat with the minibatches of the seeds one after another (see `seed_batch_indices`).
+    The losses of the seeds are summed for a single backward pass (their parameters are independent), the gradients
+    are clipped per seed. The optimizer holds the stacked parameters, Adam works elementwise so this equals one
+    optimizer per seed. Returns the statistics of `PPOUpdate` with one value per seed.
+    """
+    def __init__(
+        self,
+        ensemble: SeedEnsemble,
+        optimizer: torch.optim.Optimizer,
+        max_grad_norm: float,
+        clip_coef: float,
+        ent_coef: float,
+        vf_coef: float,
+        norm_adv: bool = True,
+        clip_vloss: bool = True,
+    ):
+        self.ensemble = ensemble
+        self.optimizer = optimizer
+        self.max_grad_norm = max_grad_norm
+        self.loss_kwargs = dict(
+            clip_coef=clip_coef, ent_coef=ent_coef, vf_coef=vf_coef, norm_adv=norm_adv, clip_vloss=clip_vloss
+        )
+
+    def _loss(self, agent, *minibatch):
+        return ppo_loss(agent, *minibatch, **self.loss_kwargs)
+
+    def __call__(self, obs, actions, logprobs, advantages, returns, values):
+        minibatch = [self.ensemble._by_seed(tensor) for tensor in (obs, actions, logprobs, advantages, returns, values)]
+        loss, *stats = self.ensemble.map(self._loss, *minibatch)
+        self.optimizer.zero_grad()
+        loss.sum().backward()
+        # the gradient norm of every seed, clipped like `clip_grad_norm_`
+        grads = [param.grad for param in self.ensemble.parameters()]
+        norms = torch.stack([grad.flatten(1).pow(2).sum(1) for grad in grads]).sum(0).sqrt()
+        scale = (self.max_grad_norm / (norms + 1e-6)).clamp(max=1.0)
+        for grad in grads:
+            grad.mul_(scale.view(-1, *[1] * (grad.dim() - 1)))
+        self.optimizer.step()
+        return stats
+
+
+def seed_batch_indices(rngs: List[np.random.Generator], num_steps: int, num_envs: int, minibatch_size: int) -> np.ndarray:
+    """
+    The flat batch indices of one update epoch of a `SeedEnsemble` whose seeds step `num_envs` envs each. Every seed
+    shuffles its own `num_steps * num_envs` transitions with its generator in `rngs`, the indices of the `(num_steps,
+    num_seeds * num_envs)` rollout are ordered by minibatch and then by seed, so the minibatches of
+    `num_seeds * minibatch_size` indices of a `MinibatchLoader` hold the minibatch of every seed.
+    """
+    num_seeds = len(rngs)
+    inds = np.stack([rng.permutation(num_steps * num_envs) for rng in rngs])
+    inds = inds // num_envs * (num_seeds * num_envs) + np.arange(num_seeds)[:, None] * num_envs + inds % num_envs
+    return inds.reshape(num_seeds, -1, minibatch_size).transpose(1, 0, 2).reshape(-1)
@@ -0,0 +1,110 @@
+import os
+import warnings
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+import gymnasium as gym
+import torch
+
+
+def _pin_process(cores: Sequence[int]):
+    """Pins all threads of this process, the affinity of a running thread can only be set by its thread id."""
+    for tid in os.listdir("/proc/self/task"):
+        try:
+            os.sched_setaffinity(int(tid), cores)
+        except ProcessLookupError:
+            # the thread ended in the meantime
+            pass
+
+
+@dataclass
+class CpuPlacement:
+    """
+    A split of the CPU cores of the run between the env worker processes and the torch threads of the learner.
+
+    The env workers are pinned round-robin to `env_cores`, the threads of the learner process to `learner_cores`
+    during the rollout and to `update_cores` during the update (all cores unless the rollout overlaps the update).
+    Threads started later (torch, thread pools) inherit the affinity of the thread that starts them.
+    The torch thread count of a phase is its number of cores, at most `max_threads` (e.g. chosen by `autotune`).
+    """
+    cores: List[int]
+    env_cores: List[int]
+    learner_cores: List[int]
+    update_cores: List[int]
+    max_threads: int = 0
+
+    def _threads(self, cores: List[int]) -> int:
+        return min(len(cores), self.max_threads) if self.max_threads > 0 else len(cores)
+
+    @property
+    def rollout_threads(self) -> int:
+        return self._threads(self.learner_cores)
+
+    @property
+    def update_threads(self) -> int:
+        return self._threads(self.update_cores)
+
+    def pin_learner(self):
+        """Pins this process to the learner cores, call it at startup before the env workers start."""
+        _pin_process(self.learner_cores)
+
+    def pin_env_workers(self, envs: gym.vector.VectorEnv):
+        """Pins the worker processes of an `async` or `pool` vector env, in-process backends have none."""
+        for i, process in enumerate(getattr(envs, "processes", [])):
+            os.sched_setaffinity(process.pid, {self.env_cores[i % len(self.env_cores)]})
+
+    def rollout_phase(self):
+        if self.update_cores != self.learner_cores:
+            _pin_process(self.learner_cores)
+        torch.set_num_threads(self.rollout_threads)
+
+    def update_phase(self):
+        if self.update_cores != self.learner_cores:
+            _pin_process(self.update_cores)
+        torch.set_num_threads(self.update_threads)
+
+    def as_dict(self) -> Dict[str, str]:
+        return {
+            "placement_cores": _format_cores(self.cores),
+            "placement_env_cores": _format_cores(self.env_cores),
+            "placement_learner_cores": _format_cores(self.learner_cores),
+            "placement_rollout_threads": str(self.rollout_threads),
+            "placement_update_threads": str(self.update_threads),
+        }
+
+
+def _format_cores(cores: Sequence[int]) -> str:
+    return ",".join(str(core) for core in cores) if cores else "-"
+
+
+def plan_cpu_placement(
+    num_env_workers: int,
+    env_cores: int = 0,
+    overlapped: bool = False,
+    cores: Optional[Sequence[int]] = None,
+    max_threads: int = 0,
+) -> CpuPlacement:
+    """
+    Splits `cores` (by default the cores this process may run on, e.g. the `--cpus-per-task` of SLURM) between
+    `num_env_workers` env worker processes (0 for in-process backends) and the learner.
+
+    The env workers get the last `env_cores` cores (0 chooses one core per worker, but leaves at least one core to
+    the learner). During the rollout the learner runs on the remaining cores, during the update the workers are idle
+    and the learner uses all cores, unless the rollout is `overlapped` with the update (pipelined rollout).
+    With `max_threads > 0` the learner uses at most `max_threads` torch threads in both phases.
+    """
+    cores = sorted(os.sched_getaffinity(0) if cores is None else cores)
+    if num_env_workers == 0:
+        warnings.warn(
+            "`cpu_placement` splits the cores between env worker processes and the learner, it has no effect with "
+            "the in-process env backends (`sync`, `native`)"
+        )
+        return CpuPlacement(cores, [], cores, cores, max_threads)
+    if env_cores <= 0:
+        env_cores = min(num_env_workers, len(cores) - 1)
+    env_cores = min(max(env_cores, 1), len(cores))
+    # with as many env cores as cores the learner shares them
+    learner_cores = cores[:len(cores) - env_cores] or cores
+    return CpuPlacement(
+        cores, cores[len(cores) - env_cores:], learner_cores, learner_cores if overlapped else cores, max_threads
+    )
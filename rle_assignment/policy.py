@@ -0,0 +1,32 @@
+from typing import Optional, Tuple
+
+import torch
+
+
+def sample_categorical(
+    logits: torch.Tensor,
+    action: Optional[torch.Tensor] = None,
+    logprob: Optional[torch.Tensor] = None,
+    generator: Optional[torch.Generator] = None,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Samples one action per row of `logits` with the Gumbel-max trick (`argmax(log_probs + G)` with standard
+    Gumbel noise `G = -log(E)`, `E ~ Exp(1)`), which has the distribution of `Categorical(logits=logits).sample()`
+    without building the distribution object or computing the entropy.
+
+    The actions and their log-probs are written into `action` and `logprob` if they are given, the noise is drawn
+    from `generator` (default: the global generator).
+    """
+    log_probs = logits.log_softmax(dim=-1)
+    scores = torch.empty_like(log_probs).exponential_(generator=generator).log_().neg_().add_(log_probs)
+    index = scores.argmax(dim=-1)
+    log_prob = log_probs.gather(-1, index.unsqueeze(-1)).squeeze(-1)
+    if action is None:
+        action = index
+    else:
+        action.copy_(index)
+    if logprob is None:
+        logprob = log_prob
+    else:
+        logprob.copy_(log_prob)
+    return action, logprob
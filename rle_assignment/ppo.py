@@ -0,0 +1,146 @@
+import time
+import warnings
+from typing import Optional
+
+import torch
+import torch.nn as nn
+
+from rle_assignment.distributed import all_reduce_gradients
+
+
+def ppo_loss(
+    agent: nn.Module,
+    obs: torch.Tensor,
+    actions: torch.Tensor,
+    logprobs: torch.Tensor,
+    advantages: torch.Tensor,
+    returns: torch.Tensor,
+    values: torch.Tensor,
+    clip_coef: float,
+    ent_coef: float,
+    vf_coef: float,
+    norm_adv: bool = True,
+    clip_vloss: bool = True,
+):
+    """
+    The clipped PPO loss of cleanRL for one minibatch.
+    Returns the loss and the detached policy loss, value loss, entropy, both KL approximations and the clip fraction.
+    """
+    _, newlogprob, entropy, newvalue = agent.get_action_and_value(obs, actions)
+    logratio = newlogprob - logprobs
+    ratio = logratio.exp()
+
+    with torch.no_grad():
+        # calculate approx_kl http://joschu.net/blog/kl-approx.html
+        old_approx_kl = (-logratio).mean()
+        approx_kl = ((ratio - 1) - logratio).mean()
+        clipfrac = ((ratio - 1.0).abs() > clip_coef).float().mean()
+
+    if norm_adv:
+        advantages = (advantages - advantages.mean()) / (advantages.std() + 1e-8)
+
+    # Policy loss
+    pg_loss1 = -advantages * ratio
+    pg_loss2 = -advantages * torch.clamp(ratio, 1 - clip_coef, 1 + clip_coef)
+    pg_loss = torch.max(pg_loss1, pg_loss2).mean()
+
+    # Value loss
+    newvalue = newvalue.view(-1)
+    if clip_vloss:
+        v_loss_unclipped = (newvalue - returns) ** 2
+        v_clipped = values + torch.clamp(newvalue - values, -clip_coef, clip_coef)
+        v_loss_clipped = (v_clipped - returns) ** 2
+        v_loss = 0.5 * torch.max(v_loss_unclipped, v_loss_clipped).mean()
+    else:
+        v_loss = 0.5 * ((newvalue - returns) ** 2).mean()
+
+    entropy_loss = entropy.mean()
+    loss = pg_loss - ent_coef * entropy_loss + v_loss * vf_coef
+    return loss, pg_loss.detach(), v_loss.detach(), entropy_loss.detach(), old_approx_kl, approx_kl, clipfrac
+
+
+class PPOUpdate:
+    """
+    One PPO gradient step on a minibatch: forward, `ppo_loss`, backward, gradient clipping and optimizer step.
+
+    With `compile=True` the forward, the loss and (through AOTAutograd) the backward are compiled with
+    `torch.compile`. The first call compiles and its duration is kept in `compile_time`. If compiling fails,
+    a warning is shown and all steps run in eager mode.
+
+    With `distributed=True` the gradients are averaged over all processes of the process group before clipping.
+    """
+    def __init__(
+        self,
+        agent: nn.Module,
+        optimizer: torch.optim.Optimizer,
+        max_grad_norm: float,
+        clip_coef: float,
+        ent_coef: float,
+        vf_coef: float,
+        norm_adv: bool = True,
+        clip_vloss: bool = True,
+        compile: bool = False,
+        distributed: bool = False,
+    ):
+        self.agent = agent
+        self.optimizer = optimizer
+        self.max_grad_norm = max_grad_norm
+        self.loss_kwargs = dict(
+            clip_coef=clip_coef, ent_coef=ent_coef, vf_coef=vf_coef, norm_adv=norm_adv, clip_vloss=clip_vloss
+        )
+        self.compiled = compile
+        self.distributed = distributed
+        self.compile_time: Optional[float] = None
+        self._loss = torch.compile(self._eager_loss) if compile else self._eager_loss
+
+    def _eager_loss(self, *minibatch):
+        return ppo_loss(self.agent, *minibatch, **self.loss_kwargs)
+
+    def _step(self, loss_fn, minibatch):
+        loss, *stats = loss_fn(*minibatch)
+        self.optimizer.zero_grad()
+        loss.backward()
+        if self.distributed:
+            all_reduce_gradients(self.agent)
+        nn.utils.clip_grad_norm_(self.agent.parameters(), self.max_grad_norm)
+        self.optimizer.step()
+        return stats
+
+    def __call__(self, obs, actions, logprobs, advantages, returns, values):
+        """Returns the policy loss, value loss, entropy, old and new approximate KL and the clip fraction."""
+        minibatch = (obs, actions, logprobs, advantages, returns, values)
+        if not self.compiled or self.compile_time is not None:
+            return self._step(self._loss, minibatch)
+        start_time = time.perf_counter()
+        try:
+            stats = self._step(self._loss, minibatch)
+        except Exception as e:
+            warnings.warn(f"compiling the PPO update failed, falling back to eager mode: {e}")
+            self.compiled = False
+            self._loss = self._eager_loss
+            return self._step(self._loss, minibatch)
+        self.compile_time = time.perf_counter() - start_time
+        return stats
+
+
+@torch.no_grad()
+def recompute_logprobs_and_values(
+    agent: nn.Module,
+    obs,
+    actions: torch.Tensor,
+    logprobs: torch.Tensor,
+    values: torch.Tensor,
+    batch_size: int,
+):
+    """
+    Overwrites the rollout `logprobs` and `values` (shape `(num_steps, num_envs)`) with the ones of `agent` for
+    the stored `obs` and `actions`, in batches of `batch_size` flat indices. Used when the actions were selected by
+    another copy of the policy (e.g. a `QuantizedPolicy`), so the PPO ratio and GAE refer to the trained agent.
+    """
+    flat_actions, flat_logprobs, flat_values = actions.view(-1), logprobs.view(-1), values.view(-1)
+    for start in range(0, flat_logprobs.shape[0], batch_size):
+        end = min(start + batch_size, flat_logprobs.shape[0])
+        inds = torch.arange(start, end, device=flat_actions.device)
+        _, logprob, _, value = agent.get_action_and_value(obs[inds], flat_actions[start:end])
+        flat_logprobs[start:end] = logprob
+        flat_values[start:end] = value.flatten()
@@ -3,6 +3,10 @@ from typing import Callable
 import gymnasium as gym
 import torch
 
+from rle_assignment.checkpoint import load_weights
+from rle_assignment.quantization import QuantizedPolicy, collect_observations
+from rle_assignment.video import VideoReplayer
+
 
 def evaluate(
     model_path: str,
@@ -13,20 +17,29 @@ def evaluate(
     Model: torch.nn.Module,
     device: torch.device = torch.device("cpu"),
     capture_video: bool = True,
+    quantize: bool = False,
+    calibration_steps: int = 256,
 ):
     """
     Evaluate the model on the environment.
+    With `quantize` the actions are selected by an int8 `QuantizedPolicy` of the model (CPU only), calibrated on
+    the observations of `calibration_steps` steps the fp32 model plays in a separate env.
     Returns a list of dictionaries, each containing the return, length, and time of the episode.
     """
     envs = gym.vector.SyncVectorEnv([make_env(env_id, 0, capture_video, run_name)])
+    video_replayer = VideoReplayer(f"videos/{run_name}") if capture_video else None
     agent = Model(envs).to(device)
-    agent.load_state_dict(torch.load(model_path, map_location=device))
+    agent.load_state_dict(load_weights(model_path, device))
     agent.eval()
+    if quantize:
+        assert device.type == "cpu", "the quantized evaluation requires the CPU"
+        calibration_obs = collect_observations(agent, make_env(env_id, 0, False, run_name)(), calibration_steps, device)
+        agent = QuantizedPolicy(agent, calibration_obs)
 
     obs, _ = envs.reset()
     episodic_events = []
     while len(episodic_events) < eval_episodes:
-        actions, *_ = agent.get_action_and_value(torch.Tensor(obs).to(device))
+        actions, *_ = agent.act(torch.as_tensor(obs).to(device))
         next_obs, rewards, terminated , truncated, infos = envs.step(actions.cpu().numpy())
         # terminated is also sent when the space ship gets one hist but the agent still has a live left.
         # So we check whether "episode" is in infos. But could also check whether "lives" is 0.
@@ -35,5 +48,8 @@ def evaluate(
             episodic_events += [{'return': infos['episode']['r'], 'length': infos['episode']['l'], 'time': infos['episode']['t']}]
         obs = next_obs
 
+    envs.close()
+    if video_replayer is not None:
+        video_replayer.close()
     return episodic_events
 
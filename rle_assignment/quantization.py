@@ -0,0 +1,103 @@
+"""
+Int8 copies of the agents for the rollout and the evaluation on the CPU.
+
+The quantization uses the FX graph mode API of `torch.ao.quantization` (`prepare_fx` / `convert_fx`), which is
+deprecated in favour of torchao and emits its deprecation warnings when a network is quantized. Its PT2E successor
+is no longer part of `torch.ao` and needs the separate torchao package, which this repo does not depend on.
+"""
+import copy
+
+import gymnasium as gym
+import numpy as np
+import torch
+import torch.nn as nn
+
+from rle_assignment.layers import ScaledConv2d
+from rle_assignment.policy import sample_categorical
+
+
+class _Normalize(nn.Module):
+    def __init__(self, scale: float, shift: float):
+        super().__init__()
+        self.scale = scale
+        self.shift = shift
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return x * self.scale + self.shift
+
+
+def _unfold_scaled_convs(network: nn.Module) -> nn.Module:
+    """Replaces every `ScaledConv2d` of a copy of `network` by an explicit normalization and a plain `nn.Conv2d`."""
+    network = copy.deepcopy(network)
+    for name, module in list(network.named_modules()):
+        if isinstance(module, ScaledConv2d):
+            conv = nn.Conv2d(
+                module.in_channels, module.out_channels, module.kernel_size, module.stride, module.padding,
+                module.dilation, module.groups, module.bias is not None,
+            )
+            # the state dict of a `ScaledConv2d` is the one of the plain conv on the normalized input
+            conv.load_state_dict(module.state_dict())
+            parent_name, _, child_name = name.rpartition(".")
+            parent = network.get_submodule(parent_name) if parent_name else network
+            setattr(parent, child_name, nn.Sequential(_Normalize(module.scale, module.shift), conv))
+    return network.eval()
+
+
+def quantize_network(network: nn.Module, calibration_obs: torch.Tensor) -> nn.Module:
+    """
+    Statically quantizes a copy of `network` to int8 with the deprecated FX graph mode quantization: convolutions
+    (fused with their batch norms and ReLUs), linear layers and the input normalization run in int8, the activation
+    ranges are calibrated on `calibration_obs`. The returned module takes float observations and returns float features.
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    calibration_obs = calibration_obs.float()
+    prepared = prepare_fx(
+        _unfold_scaled_convs(network),
+        get_default_qconfig_mapping(torch.backends.quantized.engine),
+        (calibration_obs[:1],),
+    )
+    with torch.no_grad():
+        prepared(calibration_obs)
+    return convert_fx(prepared)
+
+
+class QuantizedPolicy(nn.Module):
+    """
+    Int8 snapshot of an agent for action selection on the CPU: the network is statically quantized with
+    `quantize_network`, the actor and critic heads are fp32 copies. It has the `act` interface of the agents
+    and is not updated with them, a new snapshot has to be created after every update of the agent.
+
+    The log-probs and values of `act` are the ones of the quantized network. They differ slightly from the fp32
+    agent, so the rollout log-probs and values are recomputed with the agent before the update
+    (see `rle_assignment.ppo.recompute_logprobs_and_values`).
+    """
+    def __init__(self, agent: nn.Module, calibration_obs: torch.Tensor):
+        super().__init__()
+        self.network = quantize_network(agent.network, calibration_obs.cpu())
+        self.actor = copy.deepcopy(agent.actor).eval()
+        self.critic = copy.deepcopy(agent.critic).eval()
+
+    @torch.inference_mode()
+    def act(self, x, action=None, logprob=None, value=None):
+        """Samples actions with their log-probs and values like `Agent.act`, for observations on the CPU."""
+        hidden = self.network(x.float())
+        action, logprob = sample_categorical(self.actor(hidden), action, logprob)
+        value = self.critic(hidden).flatten() if value is None else value.copy_(self.critic(hidden).flatten())
+        return action, logprob, value
+
+
+def collect_observations(agent: nn.Module, env: gym.Env, num_steps: int, device: torch.device) -> torch.Tensor:
+    """Plays `num_steps` steps of the single `env` with `agent` and returns the observations, e.g. for calibration."""
+    observations = []
+    obs, _ = env.reset()
+    for _ in range(num_steps):
+        # the fused preprocessing reuses its observation buffer
+        observations.append(np.array(obs))
+        action, *_ = agent.act(torch.as_tensor(obs).unsqueeze(0).to(device))
+        obs, _, terminated, truncated, _ = env.step(action.item())
+        if terminated or truncated:
+            obs, _ = env.reset()
+    env.close()
+    return torch.as_tensor(np.stack(observations))
@@ -0,0 +1,116 @@
+from typing import Callable, List, Optional
+
+import numpy as np
+import torch
+from torch.utils.tensorboard import SummaryWriter
+
+from rle_assignment.asha import RungReporter
+
+
+def collect_rollout(
+    policy,
+    envs,
+    storage,
+    next_obs: torch.Tensor,
+    next_done: torch.Tensor,
+    global_step: int,
+    num_steps: int,
+    num_envs: int,
+    env_batch_size: int = 0,
+    world_size: int = 1,
+    writers: Optional[List[SummaryWriter]] = None,
+    reporter: Optional[RungReporter] = None,
+    step_hook: Optional[Callable] = None,
+):
+    """
+    Collects `num_steps` transitions of every env with `policy.act` into `storage`, the tuple of the observation,
+    action, log-prob, reward, done and value buffers of the rollout. With `env_batch_size` the envs are stepped
+    EnvPool-style (`pool` backend). Every step adds `num_envs * world_size` to the global step (the envs of one seed
+    of all processes).
+    The episodes of env `i` are logged to `writers[i // num_envs]` (one writer per seed, None logs nothing) and their
+    returns are added to `reporter` if given.
+    `step_hook(steps, env_ids, next_obs, rewards)` is called after every env step once the rewards are stored, with the
+    indices of the stored transitions (`rewards[steps, env_ids]`, a step and `slice(None)` for all envs) and the new
+    observations of these envs, e.g. to add an intrinsic reward.
+    Returns the observations and dones after the last step and the updated global step.
+    """
+    obs, actions, logprobs, rewards, dones, values = storage
+    device = next_obs.device
+    if env_batch_size:
+        # EnvPool-style rollout: every env collects `num_steps` transitions, but only the first
+        # `env_batch_size` envs that are ready get a new action, so inference never waits for a straggler
+        env_steps = np.zeros(len(next_obs), dtype=np.int64)
+        env_ids = np.arange(len(next_obs))
+        batch_obs, batch_done = next_obs, next_done
+        # the rewards and dones of the envs of one step are written into these buffers and scattered from there
+        step_rewards, step_dones = torch.zeros_like(next_done), torch.zeros_like(next_done)
+        while len(env_ids) or envs.num_pending:
+            if len(env_ids):
+                steps = env_steps[env_ids]
+                obs[steps, env_ids] = batch_obs
+                dones[steps, env_ids] = batch_done
+
+                # ALGO LOGIC: action logic
+                action, logprob, value = policy.act(batch_obs)
+                values[steps, env_ids] = value
+                actions[steps, env_ids] = action
+                logprobs[steps, env_ids] = logprob
+                envs.send(action.cpu().numpy(), env_ids)
+
+            batch_obs, reward, terminations, truncations, infos = envs.recv()
+            env_ids = infos["env_id"]
+            steps = env_steps[env_ids]
+            global_step += len(env_ids) * world_size
+            rewards[steps, env_ids] = step_rewards[:len(env_ids)].copy_(torch.from_numpy(reward))
+            batch_obs = torch.as_tensor(batch_obs).to(device)
+            batch_done = step_dones[:len(env_ids)].copy_(torch.from_numpy(terminations))
+            batch_done.logical_or_(torch.from_numpy(truncations).to(device))
+            next_obs[env_ids], next_done[env_ids] = batch_obs, batch_done
+            if step_hook is not None:
+                step_hook(steps, env_ids, batch_obs, rewards)
+            env_steps[env_ids] += 1
+
+            if writers is not None and (terminations.any() or truncations.any()) and "episode" in infos:
+                for i in np.argwhere(infos["_episode"]):
+                    writer = writers[env_ids[i].item() // num_envs]
+                    print(f"global_step={global_step}, episodic_return={infos['episode']['r'][i]}")
+                    writer.add_scalar("train/episodic_return", infos["episode"]["r"][i], global_step)
+                    writer.add_scalar("train/episodic_length", infos["episode"]["l"][i], global_step)
+                    writer.add_scalar("train/episodic_time",   infos["episode"]["t"][i], global_step)
+                    if reporter is not None:
+                        reporter.add_episode(infos["episode"]["r"][i].item())
+
+            # envs that collected all their transitions stay idle until the next rollout
+            active = env_steps[env_ids] < num_steps
+            env_ids, batch_obs, batch_done = env_ids[active], batch_obs[active], batch_done[active]
+    else:
+        for step in range(0, num_steps):
+            global_step += num_envs * world_size
+            obs[step] = next_obs
+            dones[step] = next_done
+
+            # ALGO LOGIC: action logic
+            action, _, _ = policy.act(next_obs, actions[step], logprobs[step], values[step])
+
+            # TRY NOT TO MODIFY: execute the game and log data.
+            next_obs, reward, terminations, truncations, infos = envs.step(action.cpu().numpy())
+            # the env results are written into the preallocated tensors, on the CPU next_obs shares
+            # its memory with the observation buffer of the vector env
+            rewards[step].copy_(torch.from_numpy(reward))
+            next_done.copy_(torch.from_numpy(terminations)).logical_or_(torch.from_numpy(truncations).to(device))
+            next_obs = torch.as_tensor(next_obs).to(device)
+            if step_hook is not None:
+                step_hook(step, slice(None), next_obs, rewards)
+
+            # terminated is also sent when the space ship gets one hist but the agent still has a live left.
+            # So we check whether "episode" is in infos. But could also check whether "lives" is 0.
+            if writers is not None and (terminations.any() or truncations.any()) and "episode" in infos:
+                for i in np.argwhere(infos["_episode"]):
+                    writer = writers[i.item() // num_envs]
+                    print(f"global_step={global_step}, episodic_return={infos['episode']['r'][i]}")
+                    writer.add_scalar("train/episodic_return", infos["episode"]["r"][i], global_step)
+                    writer.add_scalar("train/episodic_length", infos["episode"]["l"][i], global_step)
+                    writer.add_scalar("train/episodic_time",   infos["episode"]["t"][i], global_step)
+                    if reporter is not None:
+                        reporter.add_episode(infos["episode"]["r"][i].item())
+    return next_obs, next_done, global_step
@@ -0,0 +1,108 @@
+from typing import Optional, Tuple
+
+import torch
+
+
+class FrameStackStorage:
+    """
+    Rollout storage for stacked frame observations of shape `(stack_size, H, W)` that keeps every frame only once.
+
+    Consecutive stacks of an env share `stack_size - 1` frames, so only the newest frame of every (step, env) is
+    stored. The older frames of a stack that does not continue the previous stack of its env (the first step of a
+    rollout and the stacks padded by a reset) are stored as a boundary. Whether a stack continues the previous one
+    is checked on write by comparing the shifted frames, so the storage makes no assumption about the wrappers.
+
+    Used like the dense `(num_steps, num_envs, stack_size, H, W)` tensor it replaces: the stacks are written with
+    `storage[step] = obs` or `storage[steps, env_ids] = obs` (every env in step order, starting at step 0 in each
+    rollout) and gathered with `storage[flat_inds]`, where `flat_inds` index the flattened `(num_steps * num_envs)`
+    batch. The stacks are only rebuilt for the gathered indices.
+    """
+    def __init__(
+        self,
+        num_steps: int,
+        num_envs: int,
+        obs_shape: Tuple[int, ...],
+        device: torch.device = torch.device("cpu"),
+        boundary_capacity: int = 4,
+    ):
+        self.num_steps = num_steps
+        self.num_envs = num_envs
+        self.stack_size, *self.frame_shape = obs_shape
+        self.device = device
+        # the step and slot of the last boundary of every (step, env)
+        self.start_steps = torch.zeros((num_steps, num_envs), dtype=torch.int64, device=device)
+        self.boundary_slots = torch.zeros((num_steps, num_envs), dtype=torch.int64, device=device)
+        self._num_boundaries = torch.zeros(num_envs, dtype=torch.int64, device=device)
+        self._last_obs = torch.zeros((num_envs,) + tuple(obs_shape), dtype=torch.uint8, device=device)
+        self._allocate(boundary_capacity)
+
+    def _allocate(self, boundary_capacity: int):
+        # a single pool for the newest frames and the boundaries, so a stack is gathered with one index
+        old_pool = getattr(self, "_pool", None)
+        num_frames = self.num_steps * self.num_envs
+        num_boundary_frames = self.num_envs * boundary_capacity * (self.stack_size - 1)
+        self._pool = torch.zeros((num_frames + num_boundary_frames, *self.frame_shape), dtype=torch.uint8, device=self.device)
+        self.frames = self._pool[:num_frames].view(self.num_steps, self.num_envs, *self.frame_shape)
+        self.boundaries = self._pool[num_frames:].view(
+            self.num_envs, boundary_capacity, self.stack_size - 1, *self.frame_shape
+        )
+        if old_pool is not None:
+            self.frames.copy_(old_pool[:num_frames].view_as(self.frames))
+            self.boundaries[:, :self.boundary_capacity].copy_(
+                old_pool[num_frames:].view(self.num_envs, self.boundary_capacity, self.stack_size - 1, *self.frame_shape)
+            )
+        self.boundary_capacity = boundary_capacity
+
+    def __len__(self) -> int:
+        return self.num_steps * self.num_envs
+
+    @property
+    def nbytes(self) -> int:
+        return self._pool.nbytes
+
+    def __setitem__(self, key, obs: torch.Tensor):
+        if isinstance(key, tuple):
+            steps, env_ids = (torch.as_tensor(k, device=self.device) for k in key)
+        else:
+            env_ids = torch.arange(self.num_envs, device=self.device)
+            steps = torch.full_like(env_ids, key)
+        prev_steps = (steps - 1).clamp(min=0)
+        continues = (obs[:, :-1] == self._last_obs[env_ids, 1:]).flatten(1).all(dim=1)
+        is_boundary = (steps == 0) | ~continues
+        self._num_boundaries[env_ids[steps == 0]] = 0
+        slots = self._num_boundaries[env_ids]
+        if is_boundary.any():
+            boundary_envs = env_ids[is_boundary]
+            max_slot = int(slots[is_boundary].max())
+            if max_slot >= self.boundary_capacity:
+                self._allocate(2 * max_slot)
+            self.boundaries[boundary_envs, slots[is_boundary]] = obs[is_boundary, :-1]
+            self._num_boundaries[boundary_envs] += 1
+        self.frames[steps, env_ids] = obs[:, -1]
+        self.start_steps[steps, env_ids] = torch.where(is_boundary, steps, self.start_steps[prev_steps, env_ids])
+        self.boundary_slots[steps, env_ids] = torch.where(is_boundary, slots, self.boundary_slots[prev_steps, env_ids])
+        self._last_obs[env_ids] = obs
+
+    def __getitem__(self, flat_inds) -> torch.Tensor:
+        return self.gather(flat_inds)
+
+    def gather(self, flat_inds, out: Optional[torch.Tensor] = None) -> torch.Tensor:
+        """`storage[flat_inds]`, written into `out` (of shape `(len(flat_inds), stack_size, H, W)`) if it is given."""
+        flat_inds = torch.as_tensor(flat_inds, device=self.device)
+        steps, env_ids = flat_inds // self.num_envs, flat_inds % self.num_envs
+        start_steps = self.start_steps[steps, env_ids].unsqueeze(1)
+        slots = self.boundary_slots[steps, env_ids].unsqueeze(1)
+        # the step every frame of the stacks was observed in
+        frame_steps = steps.unsqueeze(1) + torch.arange(1 - self.stack_size, 1, device=self.device)
+        # frames observed before the boundary come from the boundary, all others from the newest frames
+        frame_inds = frame_steps.clamp(min=0) * self.num_envs + env_ids.unsqueeze(1)
+        boundary_inds = (
+            self.num_steps * self.num_envs
+            + (env_ids.unsqueeze(1) * self.boundary_capacity + slots) * (self.stack_size - 1)
+            + (frame_steps - start_steps + self.stack_size - 1).clamp(min=0, max=self.stack_size - 2)
+        )
+        pool_inds = torch.where(frame_steps >= start_steps, frame_inds, boundary_inds)
+        if out is None:
+            return self._pool[pool_inds]
+        torch.index_select(self._pool, 0, pool_inds.flatten(), out=out.view(-1, *self.frame_shape))
+        return out
@@ -0,0 +1,204 @@
+import itertools
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Literal, Optional, Sequence
+
+RunStatus = Literal["pending", "running", "paused", "done", "failed"]
+
+
+@dataclass
+class SweepRun:
+    name: str
+    overrides: Dict[str, Any]
+    status: RunStatus = "pending"
+    returncode: Optional[int] = None
+    cores: List[int] = field(default_factory=list)
+    start_time: Optional[float] = None
+    end_time: Optional[float] = None
+
+
+def grid(**values: Sequence[Any]) -> List[Dict[str, Any]]:
+    """All combinations of the given values, e.g. `grid(clip_coef=[0.1, 0.2], skip_frames=[2, 4])`."""
+    return [dict(zip(values, combination)) for combination in itertools.product(*values.values())]
+
+
+def parse_value(value: str) -> Any:
+    """A command line value as bool, int, float or str."""
+    if value.lower() in ("true", "false"):
+        return value.lower() == "true"
+    for parse in (int, float):
+        try:
+            return parse(value)
+        except ValueError:
+            pass
+    return value
+
+
+def parse_overrides(items: Sequence[str], multiple: bool = False) -> Dict[str, Any]:
+    """`key=value` items as a dict, with `multiple` the values are comma separated lists (`key=value1,value2`)."""
+    overrides = {}
+    for item in items:
+        key, value = item.split("=", 1)
+        overrides[key] = [parse_value(v) for v in value.split(",")] if multiple else parse_value(value)
+    return overrides
+
+
+def to_flags(overrides: Dict[str, Any]) -> List[str]:
+    """The tyro flags of `Args` overrides: `--key value`, booleans as `--key`/`--no-key`, lists as several values."""
+    flags = []
+    for key, value in overrides.items():
+        if isinstance(value, bool):
+            flags.append(f"--{key}" if value else f"--no-{key}")
+        elif isinstance(value, (list, tuple)):
+            flags += [f"--{key}", *(str(v) for v in value)]
+        else:
+            flags += [f"--{key}", str(value)]
+    return flags
+
+
+def run_name(prefix: str, overrides: Dict[str, Any]) -> str:
+    return "_".join([prefix] + [f"{key}_{value}" for key, value in overrides.items()])
+
+
+class Sweep:
+    """
+    Runs a trainer script once per `Args` overrides in `configs` and packs the runs onto the cores this process may
+    run on (e.g. the `--cpus-per-task` of a SLURM allocation).
+
+    Every run gets `cores_per_run` cores (0: the cores split evenly between the runs, at least one each), it is
+    pinned to them and its torch thread budget (`OMP_NUM_THREADS`) is set to their number. The runs keep the
+    `num_envs` of the trainer (and with it its batch size and learning rate schedule), only with `envs_per_core > 0`
+    runs without a `num_envs` override step `envs_per_core` envs per core. The runs are named after the sweep and
+    their overrides, which are also their `exp_name` unless it is overridden or `exp_name_format` (e.g.
+    `"epsilon_tuning_{clip_coef}"`) is given.
+
+    The status of every run is kept in `sweep_dir/status.json` and its output in `sweep_dir/{name}.log`. With
+    `checkpoint_interval > 0` every run saves a checkpoint every `checkpoint_interval` iterations and is started with
+    `--resume auto`, so after a restart (e.g. of a preempted job) the runs that did not finish continue from their
+    newest checkpoint (0 for scripts without `resume`, their runs start again from the beginning). `done` runs are
+    skipped and `failed` runs are only started again with `retry_failed`.
+
+    Schedulers that start a run several times (e.g. `AshaSweep`) override `run_type`, `_next_run`, `_overrides`
+    and `_on_exit`.
+    """
+    run_type = SweepRun
+
+    def __init__(
+        self,
+        script: str,
+        sweep_dir: str,
+        configs: List[Dict[str, Any]],
+        common: Optional[Dict[str, Any]] = None,
+        cores_per_run: int = 0,
+        envs_per_core: int = 0,
+        exp_name_format: Optional[str] = None,
+        checkpoint_interval: int = 50,
+        retry_failed: bool = False,
+        python: str = sys.executable,
+    ):
+        self.script = script
+        self.sweep_dir = sweep_dir
+        self.common = common or {}
+        self.envs_per_core = envs_per_core
+        self.checkpoint_interval = checkpoint_interval
+        self.python = python
+        os.makedirs(sweep_dir, exist_ok=True)
+        self.status_path = os.path.join(sweep_dir, "status.json")
+
+        self.runs: Dict[str, SweepRun] = {}
+        for overrides in configs:
+            name = run_name(os.path.basename(os.path.normpath(sweep_dir)), overrides)
+            exp_name = exp_name_format.format(**overrides) if exp_name_format else name
+            self.runs[name] = self.run_type(name, {"exp_name": exp_name, **overrides})
+        if os.path.exists(self.status_path):
+            with open(self.status_path) as f:
+                for name, saved in json.load(f).items():
+                    if name in self.runs:
+                        self.runs[name] = self.run_type(**saved)
+        for run in self.runs.values():
+            if run.status == "running" or (run.status == "failed" and retry_failed):
+                run.status = "pending"
+
+        cores = sorted(os.sched_getaffinity(0))
+        num_pending = sum(run.status == "pending" for run in self.runs.values())
+        if cores_per_run <= 0:
+            cores_per_run = max(len(cores) // max(num_pending, 1), 1)
+        self.slots = [cores[i:i + cores_per_run] for i in range(0, len(cores) - cores_per_run + 1, cores_per_run)]
+        self.slots = self.slots or [cores]
+
+    def save(self):
+        tmp_path = self.status_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({name: asdict(run) for name, run in self.runs.items()}, f, indent=2)
+        os.replace(tmp_path, self.status_path)
+
+    def _next_run(self) -> Optional[SweepRun]:
+        """The next run to start, None if no run can start now."""
+        return next((run for run in self.runs.values() if run.status == "pending"), None)
+
+    def _overrides(self, run: SweepRun) -> Dict[str, Any]:
+        """The overrides of the next start of `run`."""
+        overrides = {**self.common, **run.overrides}
+        if self.checkpoint_interval > 0:
+            # a run started again after a restart continues from its newest checkpoint
+            overrides.setdefault("checkpoint_interval", self.checkpoint_interval)
+            overrides.setdefault("resume", "auto")
+        return overrides
+
+    def _on_exit(self, run: SweepRun, returncode: int):
+        run.status = "done" if returncode == 0 else "failed"
+
+    def _launch(self, run: SweepRun, cores: List[int]) -> subprocess.Popen:
+        overrides = self._overrides(run)
+        if self.envs_per_core > 0 and "num_envs" not in overrides:
+            overrides["num_envs"] = self.envs_per_core * len(cores)
+        log = open(os.path.join(self.sweep_dir, f"{run.name}.log"), "a")
+        process = subprocess.Popen(
+            [self.python, self.script, *to_flags(overrides)],
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            env=dict(os.environ, OMP_NUM_THREADS=str(len(cores))),
+            preexec_fn=lambda: os.sched_setaffinity(0, cores),
+        )
+        log.close()
+        run.status, run.cores, run.start_time, run.end_time, run.returncode = "running", cores, time.time(), None, None
+        print(f"started {run.name} on cores {cores}")
+        return process
+
+    def run(self, poll_interval: float = 5.0) -> Dict[str, SweepRun]:
+        """Runs until no run is left to start and returns the runs with their final status."""
+        free_slots = list(self.slots)
+        running: Dict[str, subprocess.Popen] = {}
+        # a SIGTERM (e.g. the SLURM time limit) stops the runs, they stay `running` and start again after a restart
+        previous_handler = signal.signal(signal.SIGTERM, lambda *_: sys.exit(1))
+        try:
+            while True:
+                while free_slots and (run := self._next_run()) is not None:
+                    running[run.name] = self._launch(run, free_slots.pop(0))
+                    self.save()
+                if not running:
+                    break
+                time.sleep(poll_interval)
+                for name, process in list(running.items()):
+                    if process.poll() is None:
+                        continue
+                    run = self.runs[name]
+                    run.returncode, run.end_time = process.returncode, time.time()
+                    self._on_exit(run, process.returncode)
+                    print(f"{run.status} {name} after {(run.end_time - run.start_time) / 60:.1f} min")
+                    free_slots.append(run.cores)
+                    del running[name]
+                    self.save()
+        finally:
+            for process in running.values():
+                process.terminate()
+            for process in running.values():
+                process.wait()
+            self.save()
+            signal.signal(signal.SIGTERM, previous_handler)
+        return self.runs
@@ -0,0 +1,191 @@
+import re
+import time
+import warnings
+from typing import Callable, Literal
+
+import gymnasium as gym
+import ale_py
+import numpy as np
+
+from stable_baselines3.common.atari_wrappers import (  # isort:skip
+    ClipRewardEnv,
+    EpisodicLifeEnv,
+    FireResetEnv,
+    MaxAndSkipEnv,
+)
+
+from rle_assignment.atari_wrappers import CachedNoopResetEnv, FusedAtariPreprocessing
+from rle_assignment.env_pool import EnvPool
+from rle_assignment.video import RecordActionLog
+
+
+gym.register_envs(ale_py)  # unnecessary but helpful for IDEs
+
+Backend = Literal["sync", "async", "pool", "native"]
+Preprocessing = Literal["fused", "legacy"]
+
+
+def make_env(
+    env_id: str,
+    idx: int,
+    capture_video: bool,
+    run_name: str,
+    skip_frames: int = 4,
+    preprocessing: Preprocessing = "fused",
+) -> Callable[[], gym.Env]:
+    """
+    Returns a thunk that creates a single preprocessed Atari environment.
+    Only the environment with `idx == 0` records videos: it logs the actions of the selected episodes,
+    the videos are rendered from these logs by a `VideoReplayer` running next to the training.
+
+    The ALE env is created without internal frameskip, so every action is repeated exactly `skip_frames` frames
+    (`ALE/...-v5` skips 4 frames by itself, which `MaxAndSkipEnv` used to repeat another `skip_frames` times).
+    `fused` does the frame skipping, max-pooling, grayscale, resizing and frame stacking in `FusedAtariPreprocessing`,
+    `legacy` uses the separate `MaxAndSkipEnv`, `ResizeObservation`, `GrayscaleObservation` and `FrameStackObservation`.
+    The episode lengths are counted in agent steps (without the no-ops of the reset), one step is `skip_frames` frames.
+    The random no-op starts are restored from a cache of emulator states, see `CachedNoopResetEnv`.
+    """
+    def thunk():
+        # the fused preprocessing reads the grayscale screen from ALE itself, the cheap RAM observations are ignored
+        obs_type = "ram" if preprocessing == "fused" else "rgb"
+        env = gym.make(env_id, obs_type=obs_type, frameskip=1)
+        env = CachedNoopResetEnv(env, noop_max=30)
+        if capture_video and idx == 0:
+            env = RecordActionLog(env, f"videos/{run_name}")
+        if preprocessing == "fused":
+            env = FusedAtariPreprocessing(env, action_repeat=skip_frames, screen_size=84, stack_size=4)
+        else:
+            env = MaxAndSkipEnv(env, skip=skip_frames)
+        # above the frame skipping, the episode lengths are agent steps
+        env = gym.wrappers.RecordEpisodeStatistics(env)
+        env = EpisodicLifeEnv(env)
+        if "FIRE" in env.unwrapped.get_action_meanings():
+            env = FireResetEnv(env)
+        env = ClipRewardEnv(env)
+        if preprocessing == "legacy":
+            env = gym.wrappers.ResizeObservation(env, (84, 84))
+            env = gym.wrappers.GrayscaleObservation(env)
+            env = gym.wrappers.FrameStackObservation(env, 4)
+        return env
+
+    return thunk
+
+
+def make_vector_env(
+    env_id: str,
+    num_envs: int,
+    capture_video: bool,
+    run_name: str,
+    skip_frames: int = 4,
+    backend: Backend = "sync",
+    batch_size: int = 0,
+    preprocessing: Preprocessing = "fused",
+    copy: bool = True,
+) -> gym.vector.VectorEnv:
+    """
+    Creates the vector environment used by the trainers.
+
+    `sync` steps all environments one after another in this process.
+    `async` runs every environment in its own worker process and returns the observations
+    through shared memory, so they are not pickled on every step.
+    `pool` runs the envs in worker processes like `async`, but they can also be stepped in batches of
+    the first `batch_size` ready envs, see `EnvPool`.
+    `native` uses the C++ vector environment of ale_py, see `make_native_vector_env`.
+
+    With `copy=False`, `sync`, `async` and `pool` return their internal buffers (shared memory for `async` and
+    `pool`) from `reset` and `step` instead of copies, so the results are only valid until the next step.
+    """
+    if backend == "native":
+        if capture_video:
+            warnings.warn("the `native` vector env backend cannot record videos, `capture_video` is ignored")
+        return make_native_vector_env(env_id, num_envs, skip_frames)
+    env_fns = [make_env(env_id, i, capture_video, run_name, skip_frames, preprocessing) for i in range(num_envs)]
+    if backend == "sync":
+        return gym.vector.SyncVectorEnv(env_fns, copy=copy)
+    if backend == "async":
+        return gym.vector.AsyncVectorEnv(env_fns, shared_memory=True, copy=copy)
+    if backend == "pool":
+        return EnvPool(env_fns, batch_size=batch_size, copy=copy)
+    raise ValueError(f"unknown vector env backend: {backend}")
+
+
+class NativeEpisodeStatistics(gym.vector.VectorWrapper):
+    """
+    Adds the episode statistics of `RecordEpisodeStatistics` and the reward clipping of `ClipRewardEnv`
+    to the native ALE vector env.
+
+    The native env terminates on every life loss (like `EpisodicLifeEnv`), an episode only ends
+    when no lives are left or the env is truncated. The returns are recorded before clipping and the
+    lengths are counted in agent steps, like the Python wrappers do.
+    """
+    def __init__(self, env: gym.vector.VectorEnv):
+        super().__init__(env)
+        self.episode_returns = np.zeros(self.num_envs, dtype=np.float64)
+        self.episode_lengths = np.zeros(self.num_envs, dtype=np.int64)
+        self.episode_start_times = np.zeros(self.num_envs, dtype=np.float64)
+        self.prev_dones = np.zeros(self.num_envs, dtype=bool)
+
+    def reset(self, **kwargs):
+        obs, infos = self.env.reset(**kwargs)
+        self.episode_returns[:] = 0
+        self.episode_lengths[:] = 0
+        self.episode_start_times[:] = time.perf_counter()
+        self.prev_dones[:] = False
+        return obs, infos
+
+    def step(self, actions):
+        obs, rewards, terminations, truncations, infos = self.env.step(actions)
+
+        # envs that ended an episode in the previous step were reset by this step (next-step autoreset)
+        self.episode_returns[self.prev_dones] = 0
+        self.episode_returns[~self.prev_dones] += rewards[~self.prev_dones]
+        self.episode_lengths[self.prev_dones] = 0
+        self.episode_lengths[~self.prev_dones] += 1
+        self.episode_start_times[self.prev_dones] = time.perf_counter()
+
+        self.prev_dones = dones = truncations | (terminations & (infos["lives"] == 0))
+        if dones.any():
+            infos["episode"] = {
+                "r": np.where(dones, self.episode_returns, 0.0),
+                "l": np.where(dones, self.episode_lengths, 0),
+                "t": np.where(dones, np.round(time.perf_counter() - self.episode_start_times, 6), 0.0),
+            }
+            infos["_episode"] = dones
+        return obs, np.sign(rewards).astype(np.float32), terminations, truncations, infos
+
+
+def make_native_vector_env(env_id: str, num_envs: int, skip_frames: int = 4) -> gym.vector.VectorEnv:
+    """
+    Creates the C++ vector env of ale_py (available from ale-py 0.11). It does the noop and fire resets,
+    frame skipping, max-pooling, grayscale, resizing and frame stacking of `make_env` in its own thread pool
+    and returns the same `(num_envs, 4, 84, 84)` uint8 observations.
+
+    The settings mirror `make_env` on `ALE/...-v5`: sticky actions with probability 0.25 and
+    `skip_frames` frames per action.
+    """
+    try:
+        from ale_py.vector_env import AtariVectorEnv
+    except ImportError as e:
+        raise gym.error.DependencyNotInstalled(
+            'the `native` vector env backend requires ale-py>=0.11, run `pip install "ale-py[vector]>=0.11"`'
+        ) from e
+
+    # "ALE/SpaceInvaders-v5" -> "space_invaders"
+    game = re.sub(r"(?<!^)(?=[A-Z])", "_", env_id.split("/")[-1].split("-")[0]).lower()
+    envs = AtariVectorEnv(
+        game,
+        num_envs,
+        frameskip=skip_frames,
+        repeat_action_probability=0.25,
+        max_num_frames_per_episode=108000,
+        noop_max=30,
+        use_fire_reset=True,
+        life_loss_info=True,
+        reward_clipping=False,
+        grayscale=True,
+        img_height=84,
+        img_width=84,
+        stack_num=4,
+        maxpool=True,
+    )
+    return NativeEpisodeStatistics(envs)
@@ -0,0 +1,146 @@
+import glob
+import multiprocessing as mp
+import os
+import pickle
+import warnings
+from typing import Callable, Optional
+
+import gymnasium as gym
+import numpy as np
+from gymnasium.utils.save_video import capped_cubic_video_schedule
+
+
+# ALE emulates 60 frames per second and every frame is replayed
+VIDEO_FPS = 60
+
+
+class RecordActionLog(gym.Wrapper):
+    """
+    Replacement for `RecordVideo` that does not render anything: for the selected episodes it only saves the
+    emulator state at the start of the episode (including the RNG of the sticky actions) and the actions.
+    `VideoReplayer` replays these logs in a background process and encodes the videos.
+
+    Must wrap the ALE env created with `frameskip=1` (below any frame skipping), so every frame is logged.
+    The logs are written to `video_folder/rl-video-episode-{episode_id}.pkl` when the episode ends.
+    """
+    def __init__(
+        self,
+        env: gym.Env,
+        video_folder: str,
+        episode_trigger: Callable[[int], bool] = capped_cubic_video_schedule,
+    ):
+        super().__init__(env)
+        assert env.unwrapped._frameskip == 1, "the wrapped env must be created with `frameskip=1`"
+        self.video_folder = os.path.abspath(video_folder)
+        os.makedirs(self.video_folder, exist_ok=True)
+        self.episode_trigger = episode_trigger
+        self.episode_id = -1
+        self._start_state = None
+        self._actions = []
+
+    def reset(self, **kwargs):
+        if self._start_state is not None:
+            self._save_log()
+        obs, info = self.env.reset(**kwargs)
+        self.episode_id += 1
+        if self.episode_trigger(self.episode_id):
+            self._start_state = self.env.unwrapped.clone_state(include_rng=True)
+        return obs, info
+
+    def step(self, action):
+        obs, reward, terminated, truncated, info = self.env.step(action)
+        if self._start_state is not None:
+            self._actions.append(action)
+            if terminated or truncated:
+                self._save_log()
+        return obs, reward, terminated, truncated, info
+
+    def _save_log(self):
+        log = {
+            "env_id": self.env.spec.id,
+            "env_kwargs": self.env.spec.kwargs,
+            "start_state": self._start_state,
+            "actions": np.array(self._actions, dtype=np.uint8),
+        }
+        path = os.path.join(self.video_folder, f"rl-video-episode-{self.episode_id}.pkl")
+        # the replayer only picks up complete logs
+        with open(f"{path}.tmp", "wb") as f:
+            pickle.dump(log, f)
+        os.replace(f"{path}.tmp", path)
+        self._start_state = None
+        self._actions = []
+
+    def close(self):
+        if self._start_state is not None:
+            self._save_log()
+        super().close()
+
+
+def replay_action_log(log_path: str, fps: int = VIDEO_FPS):
+    """Replays an action log of `RecordActionLog` and encodes it as mp4 next to the log."""
+    from moviepy.video.io.ImageSequenceClip import ImageSequenceClip
+
+    with open(log_path, "rb") as f:
+        log = pickle.load(f)
+    env = gym.make(log["env_id"], **log["env_kwargs"])
+    env.reset()
+    ale = env.unwrapped.ale
+    # the restored RNG replays the sticky actions exactly like in the recorded episode
+    env.unwrapped.restore_state(log["start_state"])
+    frames = [ale.getScreenRGB()]
+    for action in log["actions"]:
+        env.step(action)
+        frames.append(ale.getScreenRGB())
+    env.close()
+    clip = ImageSequenceClip(frames, fps=fps)
+    clip.write_videofile(f"{os.path.splitext(log_path)[0]}.mp4", logger=None)
+    os.remove(log_path)
+
+
+def _replay_worker(video_folder: str, stop_event, poll_interval: float):
+    # a log that cannot be replayed is reported once and kept, the other logs are still encoded
+    failed = set()
+    while True:
+        stopping = stop_event.is_set()
+        for log_path in sorted(glob.glob(os.path.join(video_folder, "*.pkl"))):
+            if log_path in failed:
+                continue
+            try:
+                replay_action_log(log_path)
+            except Exception as e:
+                failed.add(log_path)
+                warnings.warn(f"could not replay the action log {log_path}: {e!r}")
+        if stopping:
+            break
+        stop_event.wait(poll_interval)
+
+
+class VideoReplayer:
+    """
+    Replays the action logs that `RecordActionLog` writes to `video_folder` in a background process and
+    encodes them as mp4, so the envs used for training and evaluation never render or encode videos.
+    `close` waits until all logs written before it was called are encoded. A log that fails to replay is reported
+    with a warning and left in `video_folder`.
+    """
+    def __init__(self, video_folder: str, poll_interval: float = 5.0, context: Optional[str] = None):
+        try:
+            import moviepy  # noqa: F401
+        except ImportError as e:
+            raise gym.error.DependencyNotInstalled(
+                'MoviePy is not installed, run `pip install "gymnasium[other]"`'
+            ) from e
+        self.video_folder = os.path.abspath(video_folder)
+        os.makedirs(self.video_folder, exist_ok=True)
+        ctx = mp.get_context(context)
+        self._stop_event = ctx.Event()
+        self.process = ctx.Process(
+            target=_replay_worker,
+            name="VideoReplayer",
+            args=(self.video_folder, self._stop_event, poll_interval),
+            daemon=True,
+        )
+        self.process.start()
+
+    def close(self):
+        self._stop_event.set()
+        self.process.join()
@@ -0,0 +1,38 @@
+from typing import Tuple
+
+import torch
+
+from rle_assignment.gae import GaeBackend, discounted_scan
+
+
+@torch.no_grad()
+def vtrace(
+    behaviour_logprobs: torch.Tensor,
+    target_logprobs: torch.Tensor,
+    rewards: torch.Tensor,
+    values: torch.Tensor,
+    bootstrap_value: torch.Tensor,
+    discounts: torch.Tensor,
+    clip_rho: float = 1.0,
+    clip_pg_rho: float = 1.0,
+    clip_c: float = 1.0,
+    backend: GaeBackend = "cumsum",
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    The V-trace targets and policy gradient advantages of IMPALA (Espeholt et al., 2018) for trajectories collected
+    with a behaviour policy that lags behind the target policy.
+
+    All inputs have the shape `(num_steps, num_envs)` except `bootstrap_value`, the value of the observation after
+    the last step `(num_envs,)`. `discounts[t]` is `gamma` for transitions within an episode and 0 for the last
+    transition of an episode. With `rho_t = pi(a_t|x_t) / mu(a_t|x_t)` the targets are
+    `vs_t = V(x_t) + min(clip_rho, rho_t) * delta_t + discounts[t] * min(clip_c, rho_t) * (vs_{t+1} - V(x_{t+1}))`,
+    which is the backward recursion of `discounted_scan`. Returns the targets `vs` and the advantages
+    `min(clip_pg_rho, rho_t) * (r_t + discounts[t] * vs_{t+1} - V(x_t))`.
+    """
+    rhos = (target_logprobs - behaviour_logprobs).exp()
+    next_values = torch.cat([values[1:], bootstrap_value.unsqueeze(0)])
+    deltas = rhos.clamp(max=clip_rho) * (rewards + discounts * next_values - values)
+    vs = discounted_scan(deltas, discounts * rhos.clamp(max=clip_c), backend) + values
+    next_vs = torch.cat([vs[1:], bootstrap_value.unsqueeze(0)])
+    pg_advantages = rhos.clamp(max=clip_pg_rho) * (rewards + discounts * next_vs - values)
+    return vs, pg_advantages
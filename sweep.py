@@ -0,0 +1,84 @@
+import json
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import tyro
+
+from rle_assignment.asha import AshaSweep
+from rle_assignment.sweep import Sweep, grid, parse_overrides
+
+
+@dataclass
+class Args:
+    name: str
+    """the name of the sweep, the status and the logs of its runs are kept in `sweeps/{name}`"""
+    script: str = "ppo_clean_rl.py"
+    """the trainer script of the runs"""
+    grid: List[str] = field(default_factory=list)
+    """the swept `Args` of the script as `key=value1,value2,...`, every combination is one run"""
+    runs_file: Optional[str] = None
+    """a JSON file with a list of `Args` overrides (one object per run), run in addition to the grid"""
+    common: List[str] = field(default_factory=list)
+    """`key=value` overrides of all runs, e.g. `track=True`"""
+    cores_per_run: int = 0
+    """the number of cores of every run, 0 splits the cores evenly between the runs"""
+    envs_per_core: int = 0
+    """if > 0, the `num_envs` of every run without a `num_envs` override is `envs_per_core` times its cores, 0 keeps the `num_envs` of the script"""
+    exp_name_format: Optional[str] = None
+    """the `exp_name` of every run as a format string of its overrides, e.g. `epsilon_tuning_{clip_coef}`, by default the name of the run"""
+    checkpoint_interval: int = 50
+    """if > 0, every run saves a checkpoint every `checkpoint_interval` iterations and continues from it after a restart (`--resume auto`), 0 for scripts without `resume`"""
+    retry_failed: bool = False
+    """also start the failed runs of a previous job again"""
+    poll_interval: float = 5.0
+    """the seconds between two checks of the running runs"""
+    asha: bool = False
+    """schedule the runs with asynchronous successive halving (`rle_assignment/asha.py`) instead of running all of them to the end"""
+    total_timesteps: int = 10000000
+    """with `asha`, the total timesteps of the runs that reach the last rung"""
+    min_timesteps: int = 1000000
+    """with `asha`, the timesteps of the first rung"""
+    reduction_factor: int = 3
+    """with `asha`, only the top `1 / reduction_factor` of the runs of a rung continue to the next one"""
+
+
+if __name__ == "__main__":
+    args = tyro.cli(Args)
+    configs = grid(**parse_overrides(args.grid, multiple=True)) if args.grid else []
+    if args.runs_file:
+        with open(args.runs_file) as f:
+            configs += json.load(f)
+    kwargs = dict(
+        common=parse_overrides(args.common),
+        cores_per_run=args.cores_per_run,
+        envs_per_core=args.envs_per_core,
+        exp_name_format=args.exp_name_format,
+        checkpoint_interval=args.checkpoint_interval,
+        retry_failed=args.retry_failed,
+    )
+    if args.asha:
+        sweep = AshaSweep(
+            args.script,
+            f"sweeps/{args.name}",
+            configs,
+            args.total_timesteps,
+            args.min_timesteps,
+            args.reduction_factor,
+            **kwargs,
+        )
+    else:
+        sweep = Sweep(args.script, f"sweeps/{args.name}", configs, **kwargs)
+    runs = sweep.run(args.poll_interval)
+
+    if args.asha:
+        print("|run|status|rung|mean return|")
+        print("|-|-|-|-|")
+        for run in sorted(runs.values(), key=lambda run: (run.rung, run.results[-1] if run.results else float("-inf")), reverse=True):
+            mean_return = f"{run.results[-1]:.1f}" if run.results else ""
+            print(f"|{run.name}|{run.status}|{run.rung}|{mean_return}|")
+    else:
+        print("|run|status|cores|minutes|")
+        print("|-|-|-|-|")
+        for run in runs.values():
+            minutes = (run.end_time - run.start_time) / 60 if run.end_time else float("nan")
+            print(f"|{run.name}|{run.status}|{len(run.cores)}|{minutes:.1f}|")
@@ -0,0 +1,71 @@
+import json
+import textwrap
+
+from rle_assignment.asha import AshaSweep
+
+# a trainer that steps in batches of 96 like the PPO scripts: it stops at the first multiple of the batch size
+# at or above `stop_timesteps` with a checkpoint, or at the last multiple of the batch size below `total_timesteps`
+FAKE_TRAINER = textwrap.dedent('''
+    import argparse, json, os
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--exp_name")
+    parser.add_argument("--score", type=float)
+    parser.add_argument("--total_timesteps", type=int)
+    parser.add_argument("--stop_timesteps", type=int, default=0)
+    parser.add_argument("--report_file")
+    parser.add_argument("--resume")
+    args, _ = parser.parse_known_args()
+    batch_size = 96
+    if args.stop_timesteps:
+        global_step = -(-args.stop_timesteps // batch_size) * batch_size
+        checkpoint = os.path.join(os.path.dirname(args.report_file), args.exp_name + ".ckpt")
+    else:
+        global_step, checkpoint = args.total_timesteps // batch_size * batch_size, None
+    with open(args.report_file, "a") as f:
+        report = {"global_step": global_step, "mean_return": args.score, "checkpoint": checkpoint, "resume": args.resume}
+        f.write(json.dumps(report) + "\\n")
+''')
+
+
+def test_promoted_trial_finishes_last_rung(tmp_path):
+    script = tmp_path / "trainer.py"
+    script.write_text(FAKE_TRAINER)
+    sweep = AshaSweep(
+        str(script),
+        str(tmp_path / "asha"),
+        [{"score": 1.0}, {"score": 2.0}],
+        total_timesteps=1000,
+        min_timesteps=500,
+        reduction_factor=2,
+        cores_per_run=1,
+    )
+    assert sweep.budgets == [500, 1000]
+    runs = sweep.run(poll_interval=0.05)
+
+    best, worst = runs["asha_score_2.0"], runs["asha_score_1.0"]
+    # 1000 steps are not a multiple of the batch size, the last rung ends at 960
+    assert best.status == "done" and best.rung == 2 and best.results == [2.0, 2.0]
+    assert worst.status == "paused" and worst.rung == 1
+    with open(tmp_path / "asha" / "status.json") as f:
+        assert json.load(f)["asha_score_2.0"]["status"] == "done"
+
+
+def test_promoted_trial_resumes_from_rung_checkpoint(tmp_path):
+    script = tmp_path / "trainer.py"
+    script.write_text(FAKE_TRAINER)
+    sweep = AshaSweep(
+        str(script),
+        str(tmp_path / "asha"),
+        [{"score": 1.0}, {"score": 2.0}],
+        total_timesteps=1000,
+        min_timesteps=500,
+        reduction_factor=2,
+        cores_per_run=1,
+    )
+    sweep.run(poll_interval=0.05)
+
+    with open(tmp_path / "asha" / "asha_score_2.0.jsonl") as f:
+        first_rung, last_rung = [json.loads(line) for line in f]
+    # rung 0 starts with `resume auto` (from the periodic checkpoints of the sweep), the promotion from the rung checkpoint
+    assert first_rung["resume"] == "auto"
+    assert last_rung["resume"] == first_rung["checkpoint"] == str(tmp_path / "asha" / "asha_score_2.0.ckpt")
@@ -0,0 +1,59 @@
+import pytest
+import torch
+
+from rle_assignment.gae import compute_gae, gae_loop
+
+GAMMA, GAE_LAMBDA = 0.99, 0.95
+
+
+@pytest.fixture(params=["loop", "torchscript", "numba", "cumsum"])
+def backend(request):
+    if request.param == "numba":
+        pytest.importorskip("numba")
+    return request.param
+
+
+def rollout(num_steps, num_envs, dones):
+    generator = torch.Generator().manual_seed(0)
+    rewards = torch.randn(num_steps, num_envs, generator=generator)
+    values = torch.randn(num_steps, num_envs, generator=generator)
+    next_value = torch.randn(num_envs, generator=generator)
+    return rewards, values, dones, next_value
+
+
+def check_against_loop(rewards, values, dones, next_value, next_done, backend):
+    # the reference is the cleanRL loop in float64
+    expected = gae_loop(rewards.double(), values.double(), dones.double(), next_value.double().reshape(1, -1),
+                        next_done.double().reshape(1, -1), GAMMA, GAE_LAMBDA)
+    advantages, returns = compute_gae(rewards, values, dones, next_value, next_done, GAMMA, GAE_LAMBDA, backend)
+    assert advantages.shape == rewards.shape
+    torch.testing.assert_close(advantages.double(), expected, rtol=1e-4, atol=1e-4)
+    torch.testing.assert_close(returns, advantages + values)
+
+
+@pytest.mark.parametrize("num_steps", [1, 32, 37, 128])
+def test_random_dones(backend, num_steps):
+    dones = (torch.rand(num_steps, 4, generator=torch.Generator().manual_seed(1)) < 0.1).float()
+    next_done = torch.tensor([0.0, 1.0, 0.0, 1.0])
+    check_against_loop(*rollout(num_steps, 4, dones), next_done, backend)
+
+
+@pytest.mark.parametrize("next_done", [0.0, 1.0])
+def test_no_dones(backend, next_done):
+    dones = torch.zeros(37, 3)
+    check_against_loop(*rollout(37, 3, dones), torch.full((3,), next_done), backend)
+
+
+def test_all_dones(backend):
+    # every step starts a new episode, so the advantage is the one step TD error without bootstrapping
+    rewards, values, dones, next_value = rollout(37, 3, torch.ones(37, 3))
+    check_against_loop(rewards, values, dones, next_value, torch.ones(3), backend)
+    advantages, _ = compute_gae(rewards, values, dones, next_value, torch.ones(3), GAMMA, GAE_LAMBDA, backend)
+    torch.testing.assert_close(advantages, rewards - values)
+
+
+def test_dones_at_start_and_chunk_borders(backend):
+    dones = torch.zeros(70, 2)
+    dones[0] = 1.0
+    dones[31, 0] = dones[32, 1] = dones[64, 0] = 1.0
+    check_against_loop(*rollout(70, 2, dones), torch.tensor([1.0, 0.0]), backend)
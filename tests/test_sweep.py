@@ -0,0 +1,65 @@
+import json
+import os
+
+from rle_assignment.sweep import Sweep
+
+# a trainer that records its command line flags
+FAKE_TRAINER = "import json, sys\njson.dump(sys.argv[1:], open(sys.argv[sys.argv.index('--exp_name') + 1] + '.json', 'w'))\n"
+
+
+def test_runs_resume_and_keep_num_envs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    script = tmp_path / "trainer.py"
+    script.write_text(FAKE_TRAINER)
+    sweep = Sweep(str(script), str(tmp_path / "sweep"), [{"clip_coef": 0.1}], cores_per_run=1)
+    runs = sweep.run(poll_interval=0.05)
+    assert all(run.status == "done" for run in runs.values())
+
+    with open("sweep_clip_coef_0.1.json") as f:
+        flags = json.load(f)
+    assert flags[flags.index("--resume") + 1] == "auto"
+    assert flags[flags.index("--checkpoint_interval") + 1] == "50"
+    # the trainer's own num_envs (and batch size) is kept
+    assert "--num_envs" not in flags
+
+
+def test_envs_per_core_and_exp_name_format(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    script = tmp_path / "trainer.py"
+    script.write_text(FAKE_TRAINER)
+    configs = [{"clip_coef": 0.1}, {"clip_coef": 0.2, "num_envs": 3}]
+    sweep = Sweep(
+        str(script),
+        str(tmp_path / "sweep"),
+        configs,
+        cores_per_run=1,
+        envs_per_core=2,
+        exp_name_format="epsilon_tuning_{clip_coef}",
+    )
+    runs = sweep.run(poll_interval=0.05)
+    assert set(runs) == {"sweep_clip_coef_0.1", "sweep_clip_coef_0.2_num_envs_3"}
+
+    with open("epsilon_tuning_0.1.json") as f:
+        flags = json.load(f)
+    assert flags[flags.index("--num_envs") + 1] == "2"
+    with open("epsilon_tuning_0.2.json") as f:
+        flags = json.load(f)
+    assert flags[flags.index("--num_envs") + 1] == "3"
+
+
+def test_restart_continues_unfinished_runs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    script = tmp_path / "trainer.py"
+    script.write_text(FAKE_TRAINER)
+    sweep = Sweep(str(script), str(tmp_path / "sweep"), [{"clip_coef": 0.1}, {"clip_coef": 0.2}], cores_per_run=1)
+    # the job was preempted while the first run was running, the second one had finished
+    sweep.runs["sweep_clip_coef_0.1"].status = "running"
+    sweep.runs["sweep_clip_coef_0.2"].status = "done"
+    sweep.save()
+
+    restarted = Sweep(str(script), str(tmp_path / "sweep"), [{"clip_coef": 0.1}, {"clip_coef": 0.2}], cores_per_run=1)
+    assert restarted.runs["sweep_clip_coef_0.1"].status == "pending"
+    restarted.run(poll_interval=0.05)
+    assert os.path.exists("sweep_clip_coef_0.1.json") and not os.path.exists("sweep_clip_coef_0.2.json")
+    with open("sweep_clip_coef_0.1.json") as f:
+        assert "auto" in json.load(f)